@@ -5,6 +5,7 @@ Listens to TARGET_CHANNELS, downloads videos, and triggers the detection pipelin
 
 import sys
 import os
+import copy
 import asyncio
 from telethon import TelegramClient, events
 
@@ -12,10 +13,13 @@ from telethon import TelegramClient, events
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import config
+import utils
+import video_source
 import recorded_extractor
-import comparator
+import detection
+import audio_cache
+import catalog
 import reporter
-import json
 
 # Ensure download dir exists
 if not os.path.exists(config.TELEGRAM_DOWNLOADS):
@@ -24,11 +28,83 @@ if not os.path.exists(config.TELEGRAM_DOWNLOADS):
 client = TelegramClient(config.SESSION_NAME, config.API_ID, config.API_HASH)
 
 def load_metadata():
-    if not os.path.exists(config.METADATA_FILE):
+    try:
+        return recorded_extractor.load_metadata()
+    except FileNotFoundError:
         print("❌ Metadata file not found. Run reference_extractor.py first!")
         return None
-    with open(config.METADATA_FILE, 'r') as f:
-        return json.load(f)
+
+def analyze_prefix(path, metadata, available_duration):
+    """
+    Run the detection pipeline on the already-downloaded prefix of a video.
+    Runs in a worker thread while the download continues.
+    """
+    try:
+        print(f"🔎 Analysing first {int(available_duration)}s while downloading...")
+        # Probe results and artifacts of the prefix stay out of the on-disk caches
+        with utils.transient_file(path):
+            return detection.detect(path, copy.deepcopy(metadata), available_duration=available_duration)
+    except Exception as e:
+        print(f"⚠ Partial analysis failed: {e}")
+        return None
+    finally:
+        # The prefix decode is only valid for this pass
+        video_source.close_video(path)
+        audio_cache.discard_audio_cache(path)
+
+def write_chunk(f, chunk):
+    """Append a downloaded chunk and flush it to disk"""
+    f.write(chunk)
+    f.flush()
+
+async def download_and_detect(event, path, metadata):
+    """
+    Download a video while analysing its growing prefix at STREAM_CHECKPOINTS.
+    A confident PIRATED verdict on the prefix cancels the rest of the download;
+    otherwise the full file is analysed once it is complete.
+    """
+    total_size = event.file.size
+    duration = event.file.duration
+    state = {"written": 0}
+    cancel = asyncio.Event()
+
+    async def download():
+        with open(path, 'wb') as f:
+            async for chunk in client.iter_download(event.message.media):
+                # Disk writes run off the event loop; flushing makes the prefix visible to the analysis thread
+                await asyncio.to_thread(write_chunk, f, chunk)
+                state["written"] += len(chunk)
+                if cancel.is_set():
+                    return False
+        return True
+
+    download_task = asyncio.create_task(download())
+    loop = asyncio.get_running_loop()
+
+    # Without a known size/duration we can't tell how much of the video is readable
+    if total_size and duration:
+        for fraction in config.STREAM_CHECKPOINTS:
+            while state["written"] < fraction * total_size and not download_task.done():
+                await asyncio.sleep(0.5)
+            if download_task.done():
+                break
+
+            available = duration * (state["written"] / total_size) * config.STREAM_SAFETY_MARGIN
+            results = await loop.run_in_executor(None, analyze_prefix, path, metadata, available)
+
+            # A settled sequential test is enough evidence on its own
+            settled = results and results.get("sequential", {}).get("decision") == "pirated"
+            if results and results["is_pirated"] and (settled or results["total_samples"] >= config.STREAM_MIN_SAMPLES):
+                cancel.set()
+                await download_task
+                print(f"⏹ Verdict reached at {state['written'] / total_size * 100:.0f}% downloaded. Download cancelled.")
+                results["partial"] = True
+                return results
+
+    await download_task
+    print("✅ Download Complete.")
+
+    return await loop.run_in_executor(None, detection.detect, path, metadata)
 
 @client.on(events.NewMessage(chats=config.TARGET_CHANNELS))
 async def new_video_handler(event):
@@ -42,32 +118,43 @@ async def new_video_handler(event):
             filename = f"{event.chat_id}_{event.id}{event.file.ext}"
             path = os.path.join(config.TELEGRAM_DOWNLOADS, filename)
             
-            print(f"⬇ Downloading to {path}...")
-            await client.download_media(event.message, path)
-            print("✅ Download Complete.")
-            
-            # 2. Run Detection Pipeline
-            # This is synchronous blocking code, might want to offload to thread in real prod
-            # but for demo it's fine.
-            metadata = load_metadata()
-            if not metadata:
+            metadata = None if config.USE_CATALOG else load_metadata()
+            if not metadata and not config.USE_CATALOG:
                 return
 
-            # Extract & Sync
-            # We pass the downloaded video path
-            updated_info = recorded_extractor.extract_recorded_data(path, metadata)
-            
-            # Compare
-            results = comparator.compare_and_decide(updated_info)
+            # Detection and reporting block, so they run in worker threads and keep the client responsive
+            loop = asyncio.get_running_loop()
+            print(f"⬇ Downloading to {path}...")
+            if config.USE_CATALOG:
+                # 2. Identify the title among the catalog, then run detection against it
+                await client.download_media(event.message, path)
+                print("✅ Download Complete.")
+                results = await loop.run_in_executor(None, catalog.detect_title, path)
+            elif config.STREAMING_INGEST:
+                # 2. Download and Run Detection Pipeline on the growing file
+                results = await download_and_detect(event, path, metadata)
+            else:
+                await client.download_media(event.message, path)
+                print("✅ Download Complete.")
+                
+                # 2. Run Detection Pipeline
+                # Extract, Sync & Compare
+                # We pass the downloaded video path
+                results = await loop.run_in_executor(None, detection.detect, path, metadata)
             
             # 3. Report
-            if results["is_pirated"]:
+            if results is None:
+                print("❌ No recorded samples were extracted")
+            elif results["is_pirated"]:
                 print("🚨 PIRACY DETECTED! Triggering Actions...")
-                reporter.handle_detection(results, path)
+                await loop.run_in_executor(None, reporter.handle_detection, results, path)
                 # Optional: Reply to message
                 # await event.reply("🚨 @Admin Possible Copyright Infringement Detected!")
             else:
                 print("✅ Video seems clean.")
+            
+            # The upload's decoded audio is not needed once it has been analysed
+            audio_cache.discard_audio_cache(path)
                 
         except Exception as e:
             print(f"❌ Error handling message: {e}")
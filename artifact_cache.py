@@ -0,0 +1,192 @@
+"""
+Artifact Cache Module
+Size-bounded store for intermediate results (hashes, audio clips, features,
+sync offsets), keyed by the input files they came from (path, size and mtime)
+and the parameters they were made with, so repeated or interrupted runs pick
+up where they left off instead of redoing the work
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+import config
+import utils
+
+
+# Serialises size bookkeeping and eviction scans between worker threads
+_evict_lock = threading.Lock()
+
+# Bytes in the cache directory as of the last scan plus entries stored since (None = not scanned yet)
+_size: Optional[int] = None
+
+# Eviction frees space down to this fraction of the limit, so a full cache isn't rescanned on every store
+_EVICT_TO = 0.9
+
+
+def artifact_key(kind: str, sources: List[str], params: Dict) -> Optional[str]:
+    """
+    Key for one artifact: what it is, which input files it came from and the
+    parameters it was made with
+
+    Args:
+        kind: Artifact type (e.g. "phashes", "sync")
+        sources: Input files; each is identified by path, size and mtime
+        params: Extraction parameters (JSON-serialisable)
+
+    Returns:
+        Cache key, or None if an input file can't be identified or is still
+        being written (see utils.transient_file); caching is skipped then
+    """
+    if any(utils.is_transient(path) for path in sources):
+        return None
+    try:
+        identity = json.dumps({
+            "kind": kind,
+            "sources": [utils.file_key(path) for path in sources],
+            "params": params
+        }, sort_keys=True, default=float)
+    except OSError:
+        return None
+    return f"{kind}_{hashlib.sha1(identity.encode()).hexdigest()[:24]}"
+
+
+def _path(key: str, ext: str) -> str:
+    return os.path.join(config.ARTIFACT_CACHE_DIR, f"{key}.{ext}")
+
+
+def _hit(path: str) -> bool:
+    """Check an entry exists and mark it as recently used"""
+    try:
+        os.utime(path)
+        return True
+    except OSError:
+        return False
+
+
+def _store(path: str, write: Callable[[str], None]) -> None:
+    """Write an entry atomically, then keep the cache within its size limit"""
+    global _size
+    utils.ensure_directory(config.ARTIFACT_CACHE_DIR)
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.{threading.get_ident()}.tmp{ext}"
+    write(tmp_path)
+    added = os.path.getsize(tmp_path)
+    with _evict_lock:
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        if _size is not None:
+            _size += added - replaced
+    # The directory is only scanned once, and again whenever the tracked size exceeds the limit
+    if _size is None or _size > config.ARTIFACT_CACHE_MAX_MB * 1024 * 1024:
+        _evict()
+
+
+def _evict() -> None:
+    """Delete least recently used entries once the cache exceeds ARTIFACT_CACHE_MAX_MB"""
+    global _size
+    limit = config.ARTIFACT_CACHE_MAX_MB * 1024 * 1024
+    with _evict_lock:
+        entries = []
+        for entry in os.scandir(config.ARTIFACT_CACHE_DIR):
+            if entry.is_file() and ".tmp" not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        target = limit * _EVICT_TO if total > limit else limit
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        _size = total
+
+
+def cached_json(kind: str, sources: List[str], params: Dict, compute: Callable[[], Any]) -> Any:
+    """
+    Return a cached JSON-serialisable artifact, computing and storing it on a miss
+
+    None results are returned but not cached.
+    """
+    key = artifact_key(kind, sources, params) if config.USE_ARTIFACT_CACHE else None
+    if key is None:
+        return compute()
+
+    path = _path(key, "json")
+    if _hit(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    value = compute()
+    if value is not None:
+        def write(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f)
+        _store(path, write)
+    return value
+
+
+def cached_arrays(kind: str, sources: List[str], params: Dict,
+                  compute: Callable[[], Optional[Dict[str, np.ndarray]]]) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Return a cached set of named numpy arrays, computing and storing it on a miss
+
+    None results are returned but not cached.
+    """
+    key = artifact_key(kind, sources, params) if config.USE_ARTIFACT_CACHE else None
+    if key is None:
+        return compute()
+
+    path = _path(key, "npz")
+    if _hit(path):
+        try:
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            pass
+
+    arrays = compute()
+    if arrays is not None:
+        _store(path, lambda tmp_path: np.savez(tmp_path, **arrays))
+    return arrays
+
+
+def cached_file(kind: str, sources: List[str], params: Dict, output_path: str,
+                compute: Callable[[str], bool]) -> bool:
+    """
+    Produce a file (e.g. an audio clip) at output_path, copying it from the
+    cache when it was made before
+
+    Args:
+        compute: Writes the file to the path it is given and returns success
+
+    Returns:
+        True if output_path now holds the artifact
+    """
+    key = artifact_key(kind, sources, params) if config.USE_ARTIFACT_CACHE else None
+    if key is None:
+        return compute(output_path)
+
+    ext = os.path.splitext(output_path)[1].lstrip(".") or "bin"
+    path = _path(key, ext)
+    if _hit(path):
+        try:
+            shutil.copyfile(path, output_path)
+            return True
+        except OSError:
+            pass
+
+    if not compute(output_path):
+        return False
+    _store(path, lambda tmp_path: shutil.copyfile(output_path, tmp_path))
+    return True
@@ -0,0 +1,242 @@
+"""
+Audio Cache Module
+Decodes a video's audio track once into a memory-mapped PCM file and serves
+any (start, duration) clip as a slice of it
+"""
+
+import os
+import subprocess
+import threading
+import wave
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from scipy import signal
+import config
+import utils
+
+
+# Open caches, keyed by (video path, sample rate), least recently used first
+_caches: OrderedDict = OrderedDict()
+_caches_lock = threading.Lock()
+
+
+class AudioCache:
+    """Mono 16-bit PCM of a whole audio track, decoded once and memory-mapped"""
+
+    def __init__(self, video_path: str, sample_rate: int = config.AUDIO_SAMPLE_RATE):
+        self.video_path = video_path
+        self.sample_rate = sample_rate
+        self.pcm_path = os.path.join(config.AUDIO_CACHE_DIR, f"{utils.file_key(video_path)}_{sample_rate}.pcm")
+        self._data = None
+        self.failed = False  # The track couldn't be decoded; don't run FFmpeg on it again
+        self._lock = threading.Lock()  # Clips may be requested from several worker threads
+
+    def load(self) -> bool:
+        """
+        Decode the track to PCM (once per file) and memory-map it
+
+        Returns:
+            True if the PCM data is available, False otherwise
+        """
+        with self._lock:
+            return self._load_locked()
+
+    def _load_locked(self) -> bool:
+        if self._data is not None:
+            return True
+        if self.failed:
+            return False
+
+        if not os.path.exists(self.pcm_path):
+            utils.ensure_directory(config.AUDIO_CACHE_DIR)
+            tmp_path = self.pcm_path + ".tmp"
+            try:
+                cmd = [
+                    'ffmpeg',
+                    '-i', self.video_path,
+                    '-vn',  # No video
+                    '-acodec', 'pcm_s16le',  # Raw PCM 16-bit
+                    '-ar', str(self.sample_rate),  # Sample rate
+                    '-ac', '1',  # Mono
+                    '-f', 's16le',
+                    '-y',  # Overwrite output file
+                    tmp_path
+                ]
+                subprocess.run(
+                    cmd,
+                    check=True,
+                    stderr=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL
+                )
+                os.replace(tmp_path, self.pcm_path)
+            except subprocess.CalledProcessError as e:
+                print(f"❌ Error decoding audio track of {self.video_path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                self.failed = True
+                return False
+            _evict(keep=self.pcm_path)
+        else:
+            # Mark as recently used for eviction
+            os.utime(self.pcm_path)
+
+        if os.path.getsize(self.pcm_path) == 0:
+            self.failed = True
+            return False
+
+        self._data = np.memmap(self.pcm_path, dtype=np.int16, mode='r')
+        return True
+
+    def _mapped(self) -> Optional[np.memmap]:
+        """The PCM memory map (None if unavailable), safe against a concurrent release"""
+        with self._lock:
+            return self._data if self._load_locked() else None
+
+    def release(self) -> None:
+        """Drop the memory map (it is mapped again on the next read)"""
+        with self._lock:
+            self._data = None
+
+    @property
+    def duration(self) -> float:
+        """Length of the decoded track in seconds"""
+        data = self._mapped()
+        return len(data) / self.sample_rate if data is not None else 0.0
+
+    def segment(self, start_time: float, duration: float) -> Optional[np.ndarray]:
+        """
+        Zero-copy int16 view of a clip at the cache's sample rate
+
+        Args:
+            start_time: Start time in seconds
+            duration: Duration of the clip in seconds
+
+        Returns:
+            View into the memory-mapped PCM, or None if unavailable
+        """
+        data = self._mapped()
+        if data is None:
+            return None
+        start = max(0, int(round(start_time * self.sample_rate)))
+        end = min(len(data), start + int(round(duration * self.sample_rate)))
+        return data[start:end]
+
+    def segment_float(self, start_time: float, duration: float, sr: Optional[int] = None) -> Optional[np.ndarray]:
+        """
+        Float32 clip in [-1, 1] (like librosa.load), resampled on demand
+
+        Args:
+            start_time: Start time in seconds
+            duration: Duration of the clip in seconds
+            sr: Target sample rate (defaults to the cache's rate)
+
+        Returns:
+            Audio samples, or None if unavailable
+        """
+        pcm = self.segment(start_time, duration)
+        if pcm is None:
+            return None
+
+        y = pcm.astype(np.float32) / 32768.0
+        if sr and sr != self.sample_rate and len(y) > 0:
+            g = np.gcd(int(sr), int(self.sample_rate))
+            y = signal.resample_poly(y, sr // g, self.sample_rate // g).astype(np.float32)
+        return y
+
+    def write_clip(self, start_time: float, duration: float, output_path: str) -> bool:
+        """
+        Write a clip to a WAV file straight from the cached PCM
+
+        Returns:
+            True if successful, False otherwise
+        """
+        pcm = self.segment(start_time, duration)
+        if pcm is None or len(pcm) == 0:
+            return False
+
+        with wave.open(output_path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.sample_rate)
+            f.writeframes(np.ascontiguousarray(pcm, dtype='<i2').tobytes())
+        return True
+
+
+def _evict(keep: str) -> None:
+    """Delete least recently used PCM files until the directory fits AUDIO_CACHE_MAX_MB"""
+    limit = config.AUDIO_CACHE_MAX_MB * 1024 * 1024
+    with _caches_lock:
+        in_use = {cache.pcm_path for cache in _caches.values()} | {keep}
+    entries = []
+    for entry in os.scandir(config.AUDIO_CACHE_DIR):
+        if entry.is_file() and entry.name.endswith(".pcm"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if path in in_use:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def get_audio_cache(video_path: str, sample_rate: int = config.AUDIO_SAMPLE_RATE) -> AudioCache:
+    """Return the shared AudioCache for a video, creating it on first use"""
+    key = (os.path.abspath(video_path), sample_rate)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = AudioCache(video_path, sample_rate)
+        _caches.move_to_end(key)
+        cache = _caches[key]
+        # Only the most recently used tracks stay memory-mapped
+        closed = [_caches.popitem(last=False)[1] for _ in range(len(_caches) - config.AUDIO_CACHE_MAX_OPEN)]
+    for stale in closed:
+        stale.release()
+    return cache
+
+
+def discard_audio_cache(video_path: str) -> None:
+    """
+    Forget a video's caches and delete their PCM files
+
+    Used for files that are still growing: each pass over a partial download
+    decodes a different prefix, so its PCM must not outlive the pass.
+    """
+    key = os.path.abspath(video_path)
+    with _caches_lock:
+        stale = [k for k in _caches if k[0] == key]
+        caches = [_caches.pop(k) for k in stale]
+    for cache in caches:
+        with cache._lock:
+            cache._data = None
+            if os.path.exists(cache.pcm_path):
+                os.remove(cache.pcm_path)
+
+
+def extract_audio_clip(video_path: str, start_time: float, duration: float, output_path: str) -> bool:
+    """
+    Extract an audio clip via the decoded-once cache, falling back to FFmpeg
+    (unless the whole track already failed to decode)
+
+    Args:
+        video_path: Path to the video file
+        start_time: Start time in seconds
+        duration: Duration of the clip in seconds
+        output_path: Path to save the audio clip
+
+    Returns:
+        True if successful, False otherwise
+    """
+    cache = get_audio_cache(video_path)
+    if cache.write_clip(start_time, duration, output_path):
+        return True
+    if cache.failed:
+        return False  # No audio track to cut from
+    return utils.extract_audio_clip(video_path, start_time, duration, output_path)
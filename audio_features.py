@@ -0,0 +1,375 @@
+"""
+Audio Features Module
+Spectrogram features shared by extraction (precomputed reference features)
+and comparison
+"""
+
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import librosa
+import soundfile as sf
+import config
+import utils
+import audio_cache
+import artifact_cache
+
+
+# Bump when mel_spectrogram changes, so cached features are recomputed
+FEATURE_VERSION = 1
+
+# Bump when the block descriptor changes
+DESCRIPTOR_VERSION = 1
+
+
+def normalize_audio(audio: np.ndarray) -> np.ndarray:
+    """RMS normalization: scale to consistent energy level (removes volume differences)"""
+    rms = np.sqrt(np.mean(audio**2)) if len(audio) else 0
+    if rms > 0:
+        return audio / rms
+    return audio
+
+
+def mel_spectrogram(audio: np.ndarray, sr: int = config.AUDIO_SAMPLE_RATE) -> np.ndarray:
+    """
+    Mel spectrogram of an RMS-normalized clip
+
+    Args:
+        audio: Mono samples
+        sr: Sample rate
+
+    Returns:
+        (n_mels, frames) power mel spectrogram
+    """
+    return librosa.feature.melspectrogram(y=normalize_audio(audio), sr=sr)
+
+
+def load_mel_spectrogram(audio_path: str, sr: int = config.AUDIO_SAMPLE_RATE) -> np.ndarray:
+    """
+    Mel spectrogram of an audio file, computed once per file content
+
+    Reference clips are compared against every upload and recorded clips are
+    restored unchanged on repeated runs, so both are usually cache hits.
+
+    Args:
+        audio_path: Path to the audio file
+        sr: Sample rate to load at
+
+    Returns:
+        (n_mels, frames) power mel spectrogram
+    """
+    def compute():
+        y, _ = librosa.load(audio_path, sr=sr)
+        return {"spec": mel_spectrogram(y, sr)}
+
+    params = {"content": utils.content_key(audio_path), "sr": sr, "version": FEATURE_VERSION}
+    return artifact_cache.cached_arrays("mel", [], params, compute)["spec"]
+
+
+def _stack_frames(specs: List[np.ndarray], frames: int) -> np.ndarray:
+    """Zero-pad (n_mels, frames) spectrograms to a common length and stack them"""
+    stacked = np.zeros((len(specs), specs[0].shape[0], frames), dtype=np.float64)
+    for i, spec in enumerate(specs):
+        stacked[i, :, :spec.shape[1]] = spec
+    return stacked
+
+
+def spectral_similarities(specs1: List[np.ndarray], specs2: List[np.ndarray]) -> np.ndarray:
+    """
+    Cosine similarity of many mel spectrogram pairs at once
+
+    The shorter spectrogram of each pair is zero-padded in time (the same as
+    padding the shorter clip with silence) before both are flattened.
+
+    Returns:
+        (N,) similarities (0 for pairs where either spectrogram is silent)
+    """
+    if not specs1:
+        return np.zeros(0)
+    frames = max(max(s.shape[1] for s in specs1), max(s.shape[1] for s in specs2))
+    stack1 = _stack_frames(specs1, frames).reshape(len(specs1), -1)
+    stack2 = _stack_frames(specs2, frames).reshape(len(specs2), -1)
+
+    norms = np.linalg.norm(stack1, axis=1) * np.linalg.norm(stack2, axis=1)
+    dots = np.einsum('ij,ij->i', stack1, stack2)
+    return np.divide(dots, norms, out=np.zeros(len(dots)), where=norms > 0)
+
+
+def pack_spectrograms(specs: list) -> tuple:
+    """
+    Stack spectrograms of different lengths into one float16 array for storage
+
+    Each spectrogram is scaled by its peak (cosine similarity is scale-free)
+    so power values can't overflow float16.
+
+    Returns:
+        Tuple of ((N, n_mels, max_frames) float16 array, (N,) int32 frame counts)
+    """
+    n_mels = next((s.shape[0] for s in specs if s is not None), 128)
+    frames = max((s.shape[1] for s in specs if s is not None), default=0)
+    packed = np.zeros((len(specs), n_mels, frames), dtype=np.float16)
+    lengths = np.zeros(len(specs), dtype=np.int32)
+    for i, spec in enumerate(specs):
+        if spec is None:
+            continue
+        peak = float(np.max(spec)) if spec.size else 0.0
+        if peak > 0:
+            packed[i, :, :spec.shape[1]] = (spec / peak).astype(np.float16)
+        lengths[i] = spec.shape[1]
+    return packed, lengths
+
+
+def descriptor_params() -> Dict:
+    """Settings that change the block descriptors (part of every cache key)"""
+    return {
+        "bands": config.DESCRIPTOR_BANDS,
+        "fmin": config.DESCRIPTOR_FMIN,
+        "fmax": config.DESCRIPTOR_FMAX,
+        "frame": config.DESCRIPTOR_FRAME,
+        "hop": config.DESCRIPTOR_HOP,
+        "block": config.DESCRIPTOR_BLOCK,
+        "version": DESCRIPTOR_VERSION
+    }
+
+
+@lru_cache(maxsize=8)
+def _descriptor_layout(sr: int):
+    """STFT sizes and mel filterbank for one sample rate (descriptors match across rates)"""
+    hop = int(round(config.DESCRIPTOR_HOP * sr))
+    n_fft = int(2 ** np.ceil(np.log2(config.DESCRIPTOR_FRAME * sr)))
+    mel = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=config.DESCRIPTOR_BANDS,
+                              fmin=config.DESCRIPTOR_FMIN, fmax=min(config.DESCRIPTOR_FMAX, sr / 2))
+    return hop, n_fft, mel.astype(np.float32)
+
+
+class DescriptorStream:
+    """
+    Block descriptor built up as audio arrives
+
+    Every DESCRIPTOR_BLOCK seconds become one row: the mean log-mel energy of
+    the STFT frames starting in that block, over DESCRIPTOR_BANDS bands that
+    fit inside every sample rate used. Only the unprocessed tail (less than an
+    FFT window) is kept between chunks, so memory doesn't grow with the clip.
+    """
+
+    def __init__(self, sr: int):
+        self.sr = sr
+        self.hop, self.n_fft, self.mel = _descriptor_layout(sr)
+        self.block = config.DESCRIPTOR_BLOCK * sr
+        self.energy = []  # Per block: summed mel power and frame count
+        self.counts = []
+        self.carry = np.zeros(0, dtype=np.float32)
+        self.consumed = 0  # Sample position of carry[0]
+
+    @property
+    def seconds(self) -> float:
+        """Audio fed so far"""
+        return (self.consumed + len(self.carry)) / self.sr
+
+    def feed(self, chunk: np.ndarray) -> None:
+        """Add the next mono audio piece (any length)"""
+        buffer = np.concatenate([self.carry, np.asarray(chunk, dtype=np.float32)])
+        frames = (len(buffer) - self.n_fft) // self.hop + 1
+        if frames > 0:
+            power = np.abs(librosa.stft(buffer[:(frames - 1) * self.hop + self.n_fft], n_fft=self.n_fft,
+                                        hop_length=self.hop, center=False)) ** 2
+            bands = self.mel @ power
+            rows = ((self.consumed + np.arange(frames) * self.hop) // self.block).astype(np.int64)
+            needed = int(rows[-1]) + 1
+            if needed > len(self.energy):
+                self.energy.extend(np.zeros(config.DESCRIPTOR_BANDS) for _ in range(needed - len(self.energy)))
+                self.counts.extend(0 for _ in range(needed - len(self.counts)))
+            for row in np.unique(rows):
+                in_row = rows == row
+                self.energy[row] = self.energy[row] + bands[:, in_row].sum(axis=1)
+                self.counts[row] += int(in_row.sum())
+            buffer = buffer[frames * self.hop:]
+            self.consumed += frames * self.hop
+        self.carry = buffer
+
+    def descriptor(self) -> np.ndarray:
+        """(blocks, DESCRIPTOR_BANDS) float32 descriptor of everything fed so far"""
+        if not self.energy:
+            return np.zeros((0, config.DESCRIPTOR_BANDS), dtype=np.float32)
+        counts = np.maximum(np.array(self.counts, dtype=np.float64), 1)[:, np.newaxis]
+        return np.log(np.stack(self.energy) / counts + 1e-10).astype(np.float32)
+
+
+def describe_stream(chunks: Iterable[np.ndarray], sr: int) -> np.ndarray:
+    """
+    Block descriptor of audio that arrives in chunks
+
+    Args:
+        chunks: Mono audio pieces in order (any lengths)
+        sr: Sample rate
+
+    Returns:
+        (blocks, DESCRIPTOR_BANDS) float32 descriptor
+    """
+    stream = DescriptorStream(sr)
+    for chunk in chunks:
+        stream.feed(chunk)
+    return stream.descriptor()
+
+
+def _chunked(audio: np.ndarray, sr: int):
+    """Slices of DESCRIPTOR_CHUNK seconds (converted to float32 one at a time)"""
+    step = max(1, int(config.DESCRIPTOR_CHUNK * sr))
+    for start in range(0, len(audio), step):
+        piece = audio[start:start + step]
+        yield piece.astype(np.float32) / 32768.0 if piece.dtype == np.int16 else piece
+
+
+def describe_audio(audio: np.ndarray, sr: int) -> np.ndarray:
+    """Block descriptor of an in-memory clip (float, or int16 PCM)"""
+    return describe_stream(_chunked(audio, sr), sr)
+
+
+def describe_video_segment(video_path: str, start_time: float, duration: float) -> Optional[np.ndarray]:
+    """
+    Block descriptor of a clip of a video's audio, streamed from the decoded-once
+    PCM at DESCRIPTOR_SAMPLE_RATE (the sync track, so no extra decode)
+
+    Returns:
+        (blocks, DESCRIPTOR_BANDS) descriptor, or None if the audio is unavailable
+    """
+    def compute():
+        pcm = audio_cache.get_audio_cache(video_path, config.DESCRIPTOR_SAMPLE_RATE).segment(start_time, duration)
+        if pcm is None or len(pcm) == 0:
+            return None
+        return {"descriptor": describe_audio(pcm, config.DESCRIPTOR_SAMPLE_RATE)}
+
+    params = dict(descriptor_params(), start=start_time, duration=duration, sr=config.DESCRIPTOR_SAMPLE_RATE)
+    result = artifact_cache.cached_arrays("descriptor", [video_path], params, compute)
+    return result["descriptor"] if result is not None else None
+
+
+def load_descriptor(audio_path: str) -> np.ndarray:
+    """
+    Block descriptor of an audio file, read in DESCRIPTOR_CHUNK blocks at its
+    own sample rate (computed once per file content)
+    """
+    def compute():
+        info = sf.info(audio_path)
+        blocks = sf.blocks(audio_path, blocksize=max(1, int(config.DESCRIPTOR_CHUNK * info.samplerate)),
+                           dtype='float32', always_2d=True)
+        return {"descriptor": describe_stream((block.mean(axis=1) for block in blocks), info.samplerate)}
+
+    params = dict(descriptor_params(), content=utils.content_key(audio_path))
+    return artifact_cache.cached_arrays("descriptor", [], params, compute)["descriptor"]
+
+
+def progressive_descriptors(audio_path: str, stages: List[float]):
+    """
+    Descriptors of growing prefixes of an audio file
+
+    The file is read only as far as each stage needs, so a caller that stops
+    early never decodes or transforms the rest.
+
+    Args:
+        audio_path: Path to the audio file
+        stages: Prefix lengths in seconds (ascending); the whole file always comes last
+
+    Yields:
+        (seconds read, descriptor of those seconds, whether the file is finished)
+    """
+    with sf.SoundFile(audio_path) as f:
+        stream = DescriptorStream(f.samplerate)
+        chunk = max(1, int(config.DESCRIPTOR_CHUNK * f.samplerate))
+        for stage in list(stages) + [None]:
+            target = f.frames if stage is None else min(f.frames, int(stage * f.samplerate))
+            while f.tell() < target:
+                block = f.read(min(chunk, target - f.tell()), dtype='float32', always_2d=True)
+                if len(block) == 0:
+                    break
+                stream.feed(block.mean(axis=1))
+            finished = f.tell() >= f.frames
+            yield f.tell() / f.samplerate, stream.descriptor(), finished
+            if finished:
+                return
+
+
+def block_levels(descriptor: np.ndarray) -> np.ndarray:
+    """Overall level of every descriptor block in dB (summed over the bands)"""
+    return 10 * np.log10(np.exp(descriptor.astype(np.float64)).sum(axis=1) + 1e-10)
+
+
+def descriptor_similarity(ref: np.ndarray, rec: np.ndarray, rate: float = 1.0) -> float:
+    """
+    Correlation of two block descriptors
+
+    Each band's mean over the clip is removed first, so volume and a fixed
+    equalisation (speakers, microphone) don't count. With a playback rate,
+    the recorded descriptor is resampled onto the reference's block times.
+
+    Args:
+        ref: Reference descriptor
+        rec: Recorded descriptor
+        rate: Reference seconds per recorded second (from the time map)
+
+    Returns:
+        Similarity in [-1, 1] (0 when there is nothing to compare)
+    """
+    return float(descriptor_similarities([ref], [rec], rate)[0])
+
+
+def _resample_blocks(descriptor: np.ndarray, rate: float) -> np.ndarray:
+    """Recorded blocks resampled onto the reference's block times"""
+    if rate == 1.0 or len(descriptor) < 2:
+        return descriptor
+    positions = np.arange(int(len(descriptor) * rate)) / rate
+    positions = positions[positions <= len(descriptor) - 1]
+    return np.stack([np.interp(positions, np.arange(len(descriptor)), band) for band in descriptor.T], axis=1)
+
+
+def descriptor_similarities(refs: List[np.ndarray], recs: List[np.ndarray], rate: float = 1.0) -> np.ndarray:
+    """
+    Correlation of many descriptor pairs at once (same rule as descriptor_similarity)
+
+    Pairs are trimmed to their common length and stacked with a block mask,
+    so the band means and norms of the whole batch are a few array operations.
+
+    Returns:
+        (N,) similarities (0 for pairs with fewer than two common blocks)
+    """
+    recs = [_resample_blocks(rec, rate) for rec in recs]
+    lengths = np.array([min(len(ref), len(rec)) for ref, rec in zip(refs, recs)], dtype=np.int64)
+    if len(lengths) == 0:
+        return np.zeros(0)
+
+    blocks = max(int(lengths.max()), 1)
+    ref_stack = np.zeros((len(refs), blocks, config.DESCRIPTOR_BANDS), dtype=np.float64)
+    rec_stack = np.zeros_like(ref_stack)
+    for i, (ref, rec) in enumerate(zip(refs, recs)):
+        ref_stack[i, :lengths[i]] = ref[:lengths[i]]
+        rec_stack[i, :lengths[i]] = rec[:lengths[i]]
+
+    # Remove each band's mean over the valid blocks; padded blocks stay zero
+    mask = (np.arange(blocks) < lengths[:, np.newaxis])[:, :, np.newaxis]
+    counts = np.maximum(lengths, 1)[:, np.newaxis, np.newaxis]
+    ref_stack = np.where(mask, ref_stack - ref_stack.sum(axis=1, keepdims=True) / counts, 0)
+    rec_stack = np.where(mask, rec_stack - rec_stack.sum(axis=1, keepdims=True) / counts, 0)
+
+    dots = np.einsum('ijk,ijk->i', ref_stack, rec_stack)
+    norms = np.sqrt(np.einsum('ijk,ijk->i', ref_stack, ref_stack) * np.einsum('ijk,ijk->i', rec_stack, rec_stack))
+    similarities = np.divide(dots, norms, out=np.zeros(len(dots)), where=norms > 0)
+    similarities[lengths < 2] = 0.0
+    return similarities
+
+
+def pack_descriptors(descriptors: list) -> tuple:
+    """
+    Stack descriptors of different lengths into one float16 array for storage
+
+    Returns:
+        Tuple of ((N, max_blocks, bands) float16 array, (N,) int32 block counts)
+    """
+    blocks = max((len(d) for d in descriptors if d is not None), default=0)
+    packed = np.zeros((len(descriptors), blocks, config.DESCRIPTOR_BANDS), dtype=np.float16)
+    lengths = np.zeros(len(descriptors), dtype=np.int32)
+    for i, descriptor in enumerate(descriptors):
+        if descriptor is None:
+            continue
+        packed[i, :len(descriptor)] = descriptor
+        lengths[i] = len(descriptor)
+    return packed, lengths
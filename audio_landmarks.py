@@ -0,0 +1,199 @@
+"""
+Audio Landmarks Module
+Spectral-peak landmark fingerprints (pairs of peaks hashed with their time
+gap) and an index that finds a recording's offset by voting
+"""
+
+from typing import Dict, Optional, Tuple
+import numpy as np
+import librosa
+from scipy.ndimage import maximum_filter
+import config
+import audio_cache
+import artifact_cache
+
+
+# Indexes of loaded fingerprints, keyed by path
+_indexes: Dict = {}
+
+
+def _peaks(audio: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Prominent time-frequency peaks of a clip
+
+    Returns:
+        Tuple of (frame indexes, frequency bins), sorted by frame
+    """
+    spectrum = np.log(np.abs(librosa.stft(
+        audio, n_fft=config.LANDMARK_FFT_SIZE, hop_length=config.LANDMARK_HOP, center=False
+    )) + 1e-6)
+    if spectrum.size == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+
+    # Local maxima that stand out from the clip's typical level
+    local_max = (spectrum == maximum_filter(spectrum, size=(15, 15))) & (spectrum > np.percentile(spectrum, 75))
+    bins, frames = np.nonzero(local_max)
+
+    # Keep the strongest LANDMARK_PEAKS_PER_SECOND (on average) so quiet scenes still count
+    seconds = spectrum.shape[1] * config.LANDMARK_HOP / config.SYNC_SAMPLE_RATE
+    limit = max(1, int(seconds * config.LANDMARK_PEAKS_PER_SECOND))
+    if len(frames) > limit:
+        strongest = np.argsort(spectrum[bins, frames])[-limit:]
+        bins, frames = bins[strongest], frames[strongest]
+
+    order = np.lexsort((bins, frames))
+    return frames[order].astype(np.int32), bins[order].astype(np.int32)
+
+
+def _pair_peaks(frames: np.ndarray, bins: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hash every peak together with the next LANDMARK_FAN_OUT peaks after it
+
+    Hash layout: first bin (9 bits) | second bin (9 bits) | frame gap (6 bits)
+
+    Returns:
+        Tuple of ((N,) uint32 hashes, (N,) int32 frames of the first peak)
+    """
+    hashes, times = [], []
+    first_later = np.searchsorted(frames, frames + 1, side='left')
+    for k in range(config.LANDMARK_FAN_OUT):
+        partner = first_later + k
+        valid = partner < len(frames)
+        partner = partner[valid]
+        dt = frames[partner] - frames[valid]
+        close = dt <= config.LANDMARK_MAX_DT
+        f1 = bins[valid][close].astype(np.uint32)
+        f2 = bins[partner][close].astype(np.uint32)
+        hashes.append((f1 << 15) | (f2 << 6) | dt[close].astype(np.uint32))
+        times.append(frames[valid][close])
+    if not hashes:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int32)
+    return np.concatenate(hashes).astype(np.uint32), np.concatenate(times).astype(np.int32)
+
+
+def landmark_params() -> Dict:
+    """Settings that change the landmark hashes (stored with every index)"""
+    return {
+        "sr": config.SYNC_SAMPLE_RATE,
+        "fft": config.LANDMARK_FFT_SIZE,
+        "hop": config.LANDMARK_HOP,
+        "density": config.LANDMARK_PEAKS_PER_SECOND,
+        "fan_out": config.LANDMARK_FAN_OUT,
+        "max_dt": config.LANDMARK_MAX_DT
+    }
+
+
+def video_landmarks(video_path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Landmarks of a video's whole audio track
+
+    The track is read from the decoded-once PCM a minute at a time, so memory
+    stays flat for feature-length films.
+
+    Returns:
+        Tuple of ((N,) uint32 hashes, (N,) int32 frames), or None if the audio is unavailable
+    """
+    def compute():
+        cache = audio_cache.get_audio_cache(video_path, config.SYNC_SAMPLE_RATE)
+        if not cache.load():
+            return None
+        pcm = cache.segment(0, cache.duration)
+
+        # Chunks are a whole number of hops, so chunk frame k is global frame offset + k
+        chunk_frames = int(60 * config.SYNC_SAMPLE_RATE / config.LANDMARK_HOP)
+        chunk = chunk_frames * config.LANDMARK_HOP
+        frames, bins = [], []
+        for number, start in enumerate(range(0, len(pcm), chunk)):
+            audio = pcm[start:start + chunk].astype(np.float32) / 32768.0
+            if len(audio) < config.LANDMARK_FFT_SIZE:
+                continue
+            chunk_peaks, chunk_bins = _peaks(audio)
+            frames.append(chunk_peaks + number * chunk_frames)
+            bins.append(chunk_bins)
+        if not frames:
+            return None
+
+        hashes, times = _pair_peaks(np.concatenate(frames), np.concatenate(bins))
+        return {"hashes": hashes, "times": times}
+
+    landmarks = artifact_cache.cached_arrays("landmarks", [video_path], landmark_params(), compute)
+    if landmarks is None:
+        return None
+    return landmarks["hashes"], landmarks["times"]
+
+
+def clip_landmarks(audio: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Landmarks of one short clip at SYNC_SAMPLE_RATE
+
+    Returns:
+        Tuple of ((N,) uint32 hashes, (N,) int32 frames from the clip's start)
+    """
+    return _pair_peaks(*_peaks(audio))
+
+
+def sort_landmarks(hashes: np.ndarray, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Order landmarks by hash, the layout LandmarkIndex searches"""
+    order = np.argsort(hashes, kind='stable')
+    return hashes[order], times[order]
+
+
+class LandmarkIndex:
+    """
+    Reference landmarks sorted by hash
+
+    Each suspect landmark finds its reference twins with a binary search, and
+    every twin votes for the offset between the two; the true offset collects
+    far more votes than chance, in time linear in the suspect's landmarks.
+    """
+
+    def __init__(self, hashes: np.ndarray, times: np.ndarray):
+        self.hashes = hashes
+        self.times = times
+
+    def match(self, hashes: np.ndarray, times: np.ndarray) -> Optional[Tuple[float, int, float]]:
+        """
+        Vote for the offset of a set of suspect landmarks
+
+        Returns:
+            Tuple of (offset in seconds = reference time - suspect time, votes for it,
+            fraction of suspect landmarks that voted for it), or None if nothing matched
+        """
+        if len(hashes) == 0 or len(self.hashes) == 0:
+            return None
+
+        lo = np.searchsorted(self.hashes, hashes, side='left')
+        hi = np.searchsorted(self.hashes, hashes, side='right')
+        counts = hi - lo
+        # Very common hashes (steady tones, silence) say little and cost a lot
+        keep = (counts > 0) & (counts <= config.LANDMARK_MAX_HITS)
+        if not np.any(keep):
+            return None
+        lo, counts, times = lo[keep], counts[keep], times[keep]
+
+        # Every (suspect landmark, reference twin) pair
+        first = np.repeat(lo, counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        deltas = self.times[first + within].astype(np.int64) - np.repeat(times, counts).astype(np.int64)
+
+        smallest = deltas.min()
+        votes = np.bincount(deltas - smallest)
+        best = int(np.argmax(votes))
+
+        # Sub-frame estimate from the winning bin and its neighbours
+        around = np.arange(max(0, best - 1), min(len(votes), best + 2))
+        delta = float(np.sum(around * votes[around]) / np.sum(votes[around])) + smallest
+
+        offset = delta * config.LANDMARK_HOP / config.SYNC_SAMPLE_RATE
+        return float(offset), int(votes[best]), float(votes[best] / len(hashes))
+
+
+def load_landmark_index(fp) -> Optional[LandmarkIndex]:
+    """The landmark index stored in a fingerprint, if it has one (and it was built with the current settings)"""
+    if "landmark_hashes" not in fp or len(fp["landmark_hashes"]) == 0:
+        return None
+    if fp.info.get("landmarks") != landmark_params():
+        return None
+    if fp.path not in _indexes:
+        _indexes[fp.path] = LandmarkIndex(fp["landmark_hashes"], fp["landmark_times"])
+    return _indexes[fp.path]
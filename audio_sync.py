@@ -5,15 +5,29 @@ using Cross-Correlation.
 """
 
 import os
+import hashlib
+import threading
+from functools import partial
 import numpy as np
-from scipy import signal
+from scipy import signal, fft
 import librosa
 import config
+import utils
+import video_source
+import audio_cache
+import audio_landmarks
+import artifact_cache
+import fingerprint
 
-def load_audio_segment(path, start_time, duration, sr=8000):
+def load_audio_segment(path, start_time, duration, sr=config.SYNC_SAMPLE_RATE):
     """
     Load a specific segment of audio at a low sample rate for fast correlation.
+    The track is decoded once per file and every segment is sliced from that cache.
     """
+    y = video_source.open_video(path).audio(start_time, duration, sr=sr)
+    if y is not None:
+        return y
+    
     try:
         y, _ = librosa.load(path, sr=sr, offset=start_time, duration=duration)
         return y
@@ -21,7 +35,163 @@ def load_audio_segment(path, start_time, duration, sr=8000):
         print(f"  ⚠ Error loading audio segment from {path}: {e}")
         return None
 
-def find_offset(ref_path, rec_path, anchor_time, window=60, anchor_duration=10):
+def _log_energy(y, hop):
+    """Log-energy envelope: one value per hop samples (robust to gain and EQ changes)"""
+    frames = len(y) // hop
+    power = np.square(y[:frames * hop], dtype=np.float32).reshape(frames, hop).mean(axis=1)
+    return np.log(power + 1e-6)
+
+
+def _normalized_correlation(correlation, sums, sums_sq, template):
+    """
+    Turn raw correlation values into Pearson coefficients per window
+
+    Args:
+        correlation: sum(template * track window) for every lag
+        sums, sums_sq: Cumulative sums (with a leading 0) of the track and its square
+        template: The zero-mean template that was correlated
+    """
+    m = len(template)
+    norm = np.linalg.norm(template)
+    window_sum = sums[m:] - sums[:-m]
+    window_sq = sums_sq[m:] - sums_sq[:-m]
+    spread = np.sqrt(np.maximum(window_sq - window_sum ** 2 / m, 0))
+    # Flat windows (silence) can't match anything
+    return np.where(spread > 1e-3, correlation / (norm * np.maximum(spread, 1e-3)), 0.0)
+
+
+def _running_sums(track):
+    track = track.astype(np.float64)
+    return (np.concatenate([[0.0], np.cumsum(track)]),
+            np.concatenate([[0.0], np.cumsum(track ** 2)]))
+
+
+class TrackCorrelator:
+    """
+    The whole recorded audio track, prepared once for any number of anchor searches
+
+    Anchors are first located on a low-rate energy envelope of the full track,
+    correlated through one FFT of that envelope that every anchor reuses; the
+    best coarse lags are then refined on the waveform at SYNC_SAMPLE_RATE.
+    """
+
+    def __init__(self, rec_path, sr=config.SYNC_SAMPLE_RATE):
+        self.sr = sr
+        self.hop = max(1, sr // config.SYNC_ENVELOPE_RATE)
+        self.rate = sr / self.hop
+        self.audio = audio_cache.get_audio_cache(rec_path, sr)
+        self.envelope = self._track_envelope()
+        self._sums, self._sums_sq = _running_sums(self.envelope)
+        self._spectra = {}  # FFT size -> spectrum of the envelope
+        self._lock = threading.Lock()
+
+    def _track_envelope(self):
+        if not self.audio.load():
+            return np.zeros(0, dtype=np.float32)
+        pcm = self.audio.segment(0, self.audio.duration)
+        
+        # Work through the memory-mapped track a minute at a time
+        chunk = self.hop * int(self.rate * 60)
+        parts = [
+            _log_energy(pcm[i:i + chunk].astype(np.float32) / 32768.0, self.hop)
+            for i in range(0, len(pcm), chunk)
+        ]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+    def _spectrum(self, n):
+        with self._lock:
+            if n not in self._spectra:
+                self._spectra[n] = np.fft.rfft(self.envelope, n)
+            return self._spectra[n]
+
+    def coarse_lags(self, anchor_audio, first=0.0, last=None):
+        """
+        Candidate start times of an anchor in the recorded track
+
+        Args:
+            anchor_audio: Anchor clip at the correlator's sample rate
+            first, last: Only consider start times in this range (seconds)
+
+        Returns:
+            Up to SYNC_COARSE_CANDIDATES start times in seconds, best first
+        """
+        template = _log_energy(anchor_audio, self.hop)
+        template = template - template.mean()
+        m, n_track = len(template), len(self.envelope)
+        if m == 0 or n_track < m or not np.any(template):
+            return []
+        
+        # Correlation at every lag: one multiplication against the cached track spectrum
+        n = fft.next_fast_len(n_track + m - 1)
+        correlation = np.fft.irfft(self._spectrum(n) * np.fft.rfft(template[::-1], n), n)[m - 1:n_track]
+        scores = _normalized_correlation(correlation, self._sums, self._sums_sq, template)
+        
+        lo = max(0, int(first * self.rate))
+        hi = len(scores) if last is None else min(len(scores), int(last * self.rate) + 1)
+        scores = scores[lo:hi].copy()
+        
+        # Best peaks at least a second apart
+        lags = []
+        suppress = int(self.rate)
+        while len(lags) < config.SYNC_COARSE_CANDIDATES and len(scores) and np.max(scores) > 0:
+            k = int(np.argmax(scores))
+            lags.append((lo + k) / self.rate)
+            scores[max(0, k - suppress):k + suppress + 1] = 0
+        return lags
+
+    def refine(self, anchor_audio, start_time):
+        """
+        Exact start of an anchor near a coarse lag, on the waveform
+
+        Returns:
+            Tuple of (start time in seconds, correlation coefficient), or None
+        """
+        margin = config.SYNC_REFINE_MARGIN
+        search_start = max(0.0, start_time - margin)
+        pcm = self.audio.segment(search_start, len(anchor_audio) / self.sr + 2 * margin)
+        if pcm is None or len(pcm) < len(anchor_audio):
+            return None
+        
+        track = pcm.astype(np.float32) / 32768.0
+        template = anchor_audio - np.mean(anchor_audio)
+        if not np.any(template):
+            return None
+        correlation = signal.correlate(track, template, mode='valid')
+        sums, sums_sq = _running_sums(track)
+        scores = _normalized_correlation(correlation, sums, sums_sq, template)
+        
+        best = int(np.argmax(scores))
+        return search_start + best / self.sr, float(scores[best])
+
+    def locate(self, anchor_audio, anchor_time, window=None):
+        """
+        Find an anchor clip in the recorded track
+
+        Args:
+            anchor_audio: Anchor clip from the reference at the correlator's sample rate
+            anchor_time: Where the anchor starts in the reference
+            window: Only search +/- this many seconds around anchor_time (None = whole track)
+
+        Returns:
+            Tuple of (offset, confidence) as for find_offset, or None
+        """
+        first, last = (0.0, None) if window is None else (max(0.0, anchor_time - window), anchor_time + window)
+        refined = [self.refine(anchor_audio, lag) for lag in self.coarse_lags(anchor_audio, first, last)]
+        refined = [r for r in refined if r is not None]
+        if not refined:
+            return None
+        
+        match_time_in_rec, confidence = max(refined, key=lambda r: r[1])
+        
+        # The moment 'match_time_in_rec' in recorded video corresponds to 'anchor_time' in original.
+        # So, Offset = anchor_time - match_time_in_rec
+        # Example: Anchor is at 100s. We find it at 10s in recorded video.
+        # It means recorded video starts at 90s of original.
+        # offset = 100 - 10 = 90.
+        return anchor_time - match_time_in_rec, confidence
+
+
+def find_offset(ref_path, rec_path, anchor_time, window=None, anchor_duration=10, correlator=None):
     """
     Find the time offset of the recorded video relative to the reference.
     
@@ -29,107 +199,275 @@ def find_offset(ref_path, rec_path, anchor_time, window=60, anchor_duration=10):
         ref_path: Path to original video/audio
         rec_path: Path to recorded video
         anchor_time: Time in original video to use as anchor
-        window: Search window size in seconds (defines search range in recorded video)
+        window: Limit the search to +/- this many seconds around anchor_time
+                (None searches the whole recorded track)
         anchor_duration: Duration of the anchor clip
+        correlator: Prepared TrackCorrelator of rec_path (shared between anchors)
         
     Returns:
+        Tuple of (offset, confidence), or None if no good match found.
         offset (float): deduced *start time* of the recorded video relative to original.
                         e.g., if offset is 10.0, the recorded video starts at 10.0s of original.
-                        Returns None if no good match found.
+        confidence (float): correlation coefficient of the match (-1 to 1)
     """
     # 1. Load Anchor from Reference (small clip)
     ref_audio = load_audio_segment(ref_path, anchor_time, anchor_duration)
     if ref_audio is None or len(ref_audio) == 0:
         return None
+    
+    # 2. Coarse search over the whole recorded track, refined at the sync sample rate
+    correlator = correlator or TrackCorrelator(rec_path)
+    return correlator.locate(ref_audio, anchor_time, window)
+
+def _landmark_points(landmark_index, rec_path):
+    """
+    (reference time, recorded time) pairs from landmark votes over short windows
+    of the recorded track
+    """
+    landmarks = audio_landmarks.video_landmarks(rec_path)
+    if landmarks is None or len(landmarks[0]) == 0:
+        return []
+    hashes, frames = landmarks
+    
+    frame_rate = config.SYNC_SAMPLE_RATE / config.LANDMARK_HOP
+    window = max(1, int(config.SYNC_MAP_WINDOW * frame_rate))
+    points = []
+    for start in range(0, int(frames.max()) + 1, window):
+        selected = (frames >= start) & (frames < start + window)
+        match = landmark_index.match(hashes[selected], frames[selected])
+        if match is not None and match[1] >= config.SYNC_MAP_MIN_VOTES:
+            rec_time = (start + window / 2) / frame_rate
+            points.append((rec_time + match[0], rec_time))
+    return points
+
 
-    # 2. Load Search Region from Recorded (larger clip)
-    # We look around the expected time. 
-    # If recorded video is roughly synced, anchor should be at 'anchor_time'.
-    # We search from [anchor_time - window] to [anchor_time + window].
-    # But since recorded video might start LATE (e.g. at 5min mark), we just search 
-    # the first few minutes OR a specific window if we have a guess.
+def _anchor_points(ref_path, rec_path, anchor_times, anchor_duration, correlator):
+    """(reference time, recorded time) pairs from confidently located anchor clips"""
+    results = utils.run_parallel([
+        partial(find_offset, ref_path, rec_path, anchor_time,
+                window=config.AUDIO_SEARCH_WINDOW,
+                anchor_duration=anchor_duration,
+                correlator=correlator)
+        for anchor_time in anchor_times
+    ])
+    return [
+        (anchor_time, anchor_time - result[0])
+        for anchor_time, result in zip(anchor_times, results)
+        if result and result[1] >= config.SYNC_MIN_CONFIDENCE
+    ]
+
+
+def fit_time_map(points):
+    """
+    Robustly fit reference_time = offset + rate * recorded_time
     
-    # Strategy: For piracy, we often don't know where it starts. 
-    # But if we assume the recorded video is a full movie, we search around the anchor time.
-    # If it's a clip, we might need a sliding search.
+    Every pair of points (and every single point at rate 1) proposes a line;
+    the one that most points agree with, within SYNC_MAP_TOLERANCE, wins and is
+    refined by least squares over those inliers.
     
-    # Simplified Strategy for Hackathon: 
-    # Assume recorded video is somewhat linear. We look for the anchor in the recorded video 
-    # roughly where it should be, +/- the window.
+    Args:
+        points: List of (reference time, recorded time)
+        
+    Returns:
+        Dict with "offset", "rate", "inliers", "points" and "confidence"
+        (fraction of points that are inliers)
+    """
+    if not points:
+        return {"offset": 0.0, "rate": 1.0, "inliers": 0, "points": 0, "confidence": 0.0}
     
-    search_start = max(0, anchor_time - window)
-    search_end = anchor_time + window
-    search_duration = search_end - search_start
+    ref = np.array([p[0] for p in points], dtype=np.float64)
+    rec = np.array([p[1] for p in points], dtype=np.float64)
     
-    rec_audio = load_audio_segment(rec_path, search_start, search_duration)
-    if rec_audio is None or len(rec_audio) < len(ref_audio):
-        return None
-
-    # 3. Cross-Correlate
-    # Normalize
-    ref_audio = (ref_audio - np.mean(ref_audio)) / (np.std(ref_audio) + 1e-6)
-    rec_audio = (rec_audio - np.mean(rec_audio)) / (np.std(rec_audio) + 1e-6)
+    proposals = [(float(r - c), 1.0) for r, c in zip(ref, rec)]
+    for i in range(len(points)):
+        for j in range(i + 1, len(points)):
+            if abs(rec[j] - rec[i]) < 1.0:
+                continue
+            rate = (ref[j] - ref[i]) / (rec[j] - rec[i])
+            if config.SYNC_MIN_RATE <= rate <= config.SYNC_MAX_RATE:
+                proposals.append((float(ref[i] - rate * rec[i]), float(rate)))
     
-    correlation = signal.correlate(rec_audio, ref_audio, mode='valid')
-    peak_index = np.argmax(correlation)
-    peak_value = correlation[peak_index]
+    def inliers_of(offset, rate):
+        return np.abs(ref - (offset + rate * rec)) <= config.SYNC_MAP_TOLERANCE
     
-    # 4. Calculate Offset
-    # peak_index is where the match starts in rec_audio
-    # time_in_rec_chunk = peak_index / sr
-    sr = 8000
-    match_time_in_rec = search_start + (peak_index / sr)
+    # Most inliers first; among equals, the rate closest to normal speed
+    offset, rate = max(proposals, key=lambda m: (int(np.sum(inliers_of(*m))), -abs(m[1] - 1.0)))
+    inliers = inliers_of(offset, rate)
     
-    # The moment 'match_time_in_rec' in recorded video corresponds to 'anchor_time' in original.
-    # So, Offset = anchor_time - match_time_in_rec
-    # Example: Anchor is at 100s. We find it at 10s in recorded video.
-    # It means recorded video starts at 90s of original.
-    # offset = 100 - 10 = 90.
+    # Least-squares refit when the inliers span enough of the recording to pin down the rate
+    if np.sum(inliers) >= 3 and np.ptp(rec[inliers]) >= config.SYNC_MAP_WINDOW:
+        fitted_rate, fitted_offset = np.polyfit(rec[inliers], ref[inliers], 1)
+        if config.SYNC_MIN_RATE <= fitted_rate <= config.SYNC_MAX_RATE:
+            offset, rate = float(fitted_offset), float(fitted_rate)
+    
+    count = int(np.sum(inliers))
+    return {
+        "offset": offset,
+        "rate": rate,
+        "inliers": count,
+        "points": len(points),
+        "confidence": count / len(points)
+    }
+
+
+def _clip_points(anchor_clips, correlator):
+    """(reference time, recorded time) pairs from confidently located stored anchor clips"""
+    results = utils.run_parallel([
+        partial(correlator.locate, audio, anchor_time, config.AUDIO_SEARCH_WINDOW)
+        for anchor_time, audio in anchor_clips
+    ])
+    return [
+        (anchor_time, anchor_time - result[0])
+        for (anchor_time, _), result in zip(anchor_clips, results)
+        if result and result[1] >= config.SYNC_MIN_CONFIDENCE
+    ]
+
+
+def sync_anchor_times(duration):
+    """Start times of the short sync anchors spread evenly over a reference of this duration"""
+    if not duration or config.SYNC_MAP_ANCHORS <= 0:
+        return []
+    return [
+        round(float(t), 2) for t in
+        np.linspace(0.05 * duration, 0.95 * duration - config.SYNC_MAP_ANCHOR_DURATION, config.SYNC_MAP_ANCHORS)
+    ]
+
+
+def reference_anchor_clips(metadata, fp=None):
+    """
+    Sync-rate audio of every anchor stored with the reference (fingerprint arrays,
+    or anchor WAVs in the legacy format), so sync never decodes the original video
+    
+    Args:
+        metadata: Reference metadata
+        fp: The loaded fingerprint, if metadata has one
+        
+    Returns:
+        List of (reference time, audio), or None if the anchor audio wasn't stored
+    """
+    if fp is None and metadata.get("fingerprint"):
+        fp = fingerprint.load_fingerprint(metadata["fingerprint"])
     
-    offset = anchor_time - match_time_in_rec
+    clips = []
+    if fp is not None:
+        for times_name, audio_name in (("anchor_times", "anchor_audio"), ("sync_anchor_times", "sync_anchor_audio")):
+            if times_name not in fp:
+                continue
+            for anchor_time, audio in zip(fp[times_name], fp[audio_name]):
+                # Clips near the end of the film are zero-padded in storage
+                clips.append((float(anchor_time), np.trim_zeros(np.asarray(audio, dtype=np.float32), 'b')))
+        return clips or None
     
-    return offset, peak_value
+    anchors = metadata.get("anchors", []) + metadata.get("sync_anchors", [])
+    if not anchors or not all(a.get("path") and os.path.exists(a["path"]) for a in anchors):
+        return None
+    for anchor in anchors:
+        audio, _ = librosa.load(anchor["path"], sr=config.SYNC_SAMPLE_RATE)
+        clips.append((float(anchor["timestamp"]), audio))
+    return clips
+
 
-def get_consensus_offset(ref_path, rec_path, anchors=None):
+def _reference_digest(anchor_clips, landmark_index):
+    """Identify stored reference sync data (for the artifact cache key)"""
+    digest = hashlib.sha1()
+    for anchor_time, audio in anchor_clips:
+        digest.update(np.float64(anchor_time).tobytes())
+        digest.update(np.ascontiguousarray(audio, dtype=np.float32).tobytes())
+    if landmark_index is not None:
+        digest.update(np.ascontiguousarray(landmark_index.hashes).tobytes())
+        digest.update(np.ascontiguousarray(landmark_index.times).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def estimate_time_map(ref_path, rec_path, anchors=None, landmark_index=None, anchor_clips=None):
     """
-    Find offset using multiple anchors and take consensus.
+    Find where every moment of the recorded video is in the reference:
+    reference_time = offset + rate * recorded_time
+    
+    Many cheap alignment points are gathered in one pass (landmark votes over
+    short windows of the recorded track, plus anchor clips spread over the
+    reference, all correlated against the same prepared track) and a robust
+    line is fitted through them, so sped-up or re-timed uploads stay aligned
+    to the end.
+    
     Args:
+        ref_path: Path to the original video (not opened when anchor_clips are given)
+        rec_path: Path to the recorded video
         anchors: List of dicts [{"timestamp": 300, "path": "..."}] from metadata
+        landmark_index: Reference audio landmarks (from the fingerprint)
+        anchor_clips: Stored anchor audio (see reference_anchor_clips); without it
+                      anchors are decoded from ref_path
+        
+    Returns:
+        Time map dict (see fit_time_map)
     """
-    offsets = []
+    target_times, short_times = [], []
+    if anchor_clips is None:
+        # If no anchors provided, try config (fallback)
+        if not anchors:
+            print("⚠ No anchors found in metadata. Checking config...")
+            target_times = config.ANCHOR_AUDIO_TIMES
+        else:
+            # `find_offset` loads the anchor from ref_path using the timestamp,
+            # so we just need the timestamps list.
+            target_times = [a['timestamp'] for a in anchors]
+        
+        # Short anchors spread evenly over the reference
+        short_times = sync_anchor_times(utils.get_video_duration(ref_path) if os.path.exists(ref_path) else None)
     
-    # If no anchors provided, try config (fallback)
-    if not anchors:
-        print("⚠ No anchors found in metadata. Checking config...")
-        target_times = config.ANCHOR_AUDIO_TIMES
-    else:
-        # We just need the timestamps for logic, but wait..
-        # `find_offset` loads the anchor from ref_path using the timestamp.
-        # So we just need the timestamps list.
-        target_times = [a['timestamp'] for a in anchors]
-
-    print(f"🔄 Syncing Audio (Anchors: {target_times})...")
-    
-    for anchor_time in target_times:
-        result = find_offset(ref_path, rec_path, anchor_time, 
-                             window=config.AUDIO_SEARCH_WINDOW,
-                             anchor_duration=config.ANCHOR_DURATION)
-        
-        if result:
-            offset, peaks = result
-            # Arbitrary threshold for correlation peak - in real world would need tuning
-            offsets.append(offset)
-            print(f"  - Anchor {anchor_time}s found offset: {offset:.2f}s (Confidence: {peaks:.4f})")
-            if peaks < 0.1:
-                print("    ⚠ Low confidence! This might be a false match.")
+    def compute():
+        points = []
+        
+        # Landmark votes per window of the recorded track
+        if landmark_index is not None and config.LANDMARK_SYNC:
+            landmark_points = _landmark_points(landmark_index, rec_path)
+            print(f"  - Landmarks: {len(landmark_points)} aligned windows")
+            points.extend(landmark_points)
+        
+        # Anchor clips, all correlated against the one prepared recorded track
+        correlator = TrackCorrelator(rec_path)
+        if anchor_clips is not None:
+            clip_points = _clip_points(anchor_clips, correlator)
+            print(f"  - Stored anchors: {len(clip_points)} / {len(anchor_clips)} located")
+            points.extend(clip_points)
         else:
-            print(f"  - Anchor {anchor_time}s not found.")
-            
-    if not offsets:
-        print("❌ No audio sync found. Assuming 0 offset.")
-        return 0.0
+            anchor_points = _anchor_points(ref_path, rec_path, target_times, config.ANCHOR_DURATION, correlator)
+            print(f"  - Anchors {target_times}: {len(anchor_points)} located")
+            short_points = _anchor_points(ref_path, rec_path, short_times, config.SYNC_MAP_ANCHOR_DURATION, correlator)
+            if short_times:
+                print(f"  - Short anchors: {len(short_points)} / {len(short_times)} located")
+            points.extend(anchor_points + short_points)
         
-    # Consensus: Median
-    final_offset = np.median(offsets)
-    print(f"✅ Final Consensus Offset: {final_offset:.2f}s")
-    return final_offset
+        return fit_time_map(points)
+    
+    print("🔄 Syncing Audio...")
+    
+    # The same pair of inputs always syncs the same way
+    params = {
+        "anchors": target_times,
+        "short_anchors": short_times,
+        "short_duration": config.SYNC_MAP_ANCHOR_DURATION,
+        "window": config.AUDIO_SEARCH_WINDOW,
+        "duration": config.ANCHOR_DURATION,
+        "sr": config.SYNC_SAMPLE_RATE,
+        "envelope_rate": config.SYNC_ENVELOPE_RATE,
+        "candidates": config.SYNC_COARSE_CANDIDATES,
+        "margin": config.SYNC_REFINE_MARGIN,
+        "min_confidence": config.SYNC_MIN_CONFIDENCE,
+        "landmarks": audio_landmarks.landmark_params() if landmark_index is not None and config.LANDMARK_SYNC else None,
+        "map": [config.SYNC_MAP_WINDOW, config.SYNC_MAP_MIN_VOTES, config.SYNC_MAP_TOLERANCE,
+                config.SYNC_MIN_RATE, config.SYNC_MAX_RATE]
+    }
+    if anchor_clips is not None:
+        sources = [rec_path]
+        params["reference"] = _reference_digest(anchor_clips, landmark_index)
+    else:
+        sources = [ref_path, rec_path]
+    time_map = artifact_cache.cached_json("timemap", sources, params, compute)
+    
+    if time_map["inliers"] == 0:
+        print("❌ No audio sync found. Assuming 0 offset.")
+    else:
+        print(f"✅ Time Map: offset {time_map['offset']:.2f}s, rate {time_map['rate']:.4f} "
+              f"({time_map['inliers']}/{time_map['points']} points agree)")
+    return time_map
@@ -0,0 +1,258 @@
+"""
+Catalog Module
+Fingerprints for many titles plus a multi-index hash over their frame hashes, used
+to work out which movie a suspect upload is before the full comparison runs
+"""
+
+import os
+import sys
+import json
+from functools import lru_cache
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import config
+import utils
+import hashing
+import hash_index
+import video_source
+import fingerprint
+
+
+class Catalog:
+    """
+    A set of titles, each with its own binary fingerprint
+
+    Every 64-bit frame hash of every title is split into bands of
+    CATALOG_BAND_BITS bits, and for each band the catalog keeps the band values
+    in sorted order (multi-index hashing). Two hashes within
+    CATALOG_MATCH_DISTANCE of each other differ in at most
+    CATALOG_MATCH_DISTANCE // bands bits of some band, so looking up every band
+    value that close to the suspect's by binary search finds every true match,
+    and only those candidates get a full Hamming check.
+    """
+
+    def __init__(self, catalog_dir: str = config.CATALOG_DIR):
+        self.catalog_dir = catalog_dir
+        self.catalog_file = os.path.join(catalog_dir, "catalog.json")
+        self.index_file = os.path.join(catalog_dir, "index.npz")
+        self.titles: Dict[str, Dict] = {}
+        self._index = None
+
+        if os.path.exists(self.catalog_file):
+            with open(self.catalog_file, 'r') as f:
+                self.titles = json.load(f)
+
+    def _save(self) -> None:
+        utils.ensure_directory(self.catalog_dir)
+        with open(self.catalog_file, 'w') as f:
+            json.dump(self.titles, f, indent=2)
+
+    def add_title(self, title_id: str, video_path: str, name: Optional[str] = None) -> Dict:
+        """
+        Fingerprint an original video and add it to the catalog
+
+        Args:
+            title_id: Short unique id (used as the directory name)
+            video_path: Path to the original video
+            name: Display name (defaults to title_id)
+
+        Returns:
+            Reference metadata of the new title
+        """
+        import reference_extractor
+
+        fingerprint_path = os.path.join(self.catalog_dir, title_id, "reference.mpfp")
+        metadata = reference_extractor.extract_reference_data(video_path, fingerprint_path=fingerprint_path)
+
+        self.titles[title_id] = {"name": name or title_id, "fingerprint": fingerprint_path}
+        self._save()
+        self.build_index()
+        return metadata
+
+    def load_title(self, title_id: str) -> Dict:
+        """Reference metadata for one title"""
+        return fingerprint.to_metadata(fingerprint.load_fingerprint(self.titles[title_id]["fingerprint"]))
+
+    def build_index(self) -> None:
+        """Rebuild the band index over the frame hashes of all titles"""
+        title_ids = sorted(self.titles)
+        hashes, owners = [], []
+        for number, title_id in enumerate(title_ids):
+            fp = fingerprint.load_fingerprint(self.titles[title_id]["fingerprint"])
+            if "dense_hashes" in fp and len(fp["dense_hashes"]) > 0:
+                title_hashes = np.asarray(fp["dense_hashes"])
+            else:
+                title_hashes = np.asarray(fp["phashes"])[np.asarray(fp["sample_valid"]) > 0]
+            hashes.append(title_hashes.astype(np.uint64))
+            owners.append(np.full(len(title_hashes), number, dtype=np.int32))
+
+        hashes = np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64)
+        owners = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int32)
+
+        index = {"hashes": hashes, "owners": owners, "band_bits": np.int64(config.CATALOG_BAND_BITS)}
+        for band, keys in enumerate(self._band_keys(hashes)):
+            order = np.argsort(keys, kind='stable')
+            index[f"keys_{band}"] = keys[order]
+            index[f"order_{band}"] = order.astype(np.int64)
+
+        utils.ensure_directory(self.catalog_dir)
+        np.savez(self.index_file, title_ids=np.array(title_ids), **index)
+        self._index = None
+
+    def _band_keys(self, hashes: np.ndarray) -> List[np.ndarray]:
+        bits = config.CATALOG_BAND_BITS
+        mask = np.uint64((1 << bits) - 1)
+        return [(hashes >> np.uint64(band * bits)) & mask for band in range(64 // bits)]
+
+    def _load_index(self) -> Dict:
+        if self._index is None:
+            if not os.path.exists(self.index_file):
+                self.build_index()
+            with np.load(self.index_file) as data:
+                self._index = {key: data[key] for key in data.files}
+            # Indexes built with another band width can't be searched with this one
+            if int(self._index.get("band_bits", -1)) != config.CATALOG_BAND_BITS:
+                self.build_index()
+                return self._load_index()
+        return self._index
+
+    def _candidates(self, index: Dict, value: np.uint64) -> np.ndarray:
+        """Positions of the indexed hashes within CATALOG_MATCH_DISTANCE // bands of a hash in some band"""
+        bands = self._band_keys(np.array([value], dtype=np.uint64))
+        flips = _band_flips(config.CATALOG_BAND_BITS, config.CATALOG_MATCH_DISTANCE // len(bands))
+        candidates = []
+        for band, key in enumerate(bands):
+            keys = index[f"keys_{band}"]
+            # Every band value within the per-band radius, looked up in one batch
+            near = np.unique(np.bitwise_xor(flips, key[0]))
+            lo = np.searchsorted(keys, near, side='left')
+            hi = np.searchsorted(keys, near, side='right')
+            order = index[f"order_{band}"]
+            candidates.extend(order[start:end] for start, end in zip(lo, hi) if end > start)
+        return np.unique(np.concatenate(candidates)) if candidates else np.zeros(0, dtype=np.int64)
+
+    def identify(self, video_path: str, top_k: int = config.CATALOG_TOP_K) -> List[Tuple[str, int, float]]:
+        """
+        Find the catalog titles a suspect video most likely comes from
+
+        Args:
+            video_path: Path to the suspect video
+            top_k: Number of titles to return
+
+        Returns:
+            List of (title_id, frames matched, mean best distance), best first
+        """
+        index = self._load_index()
+        title_ids = [str(t) for t in index["title_ids"]]
+        if len(index["hashes"]) == 0:
+            return []
+
+        duration = utils.get_video_duration(video_path)
+        if duration is None:
+            return []
+
+        # Probe frames spread over the upload (skipping the very start and end)
+        probes = np.linspace(duration * 0.05, duration * 0.95, config.CATALOG_PROBE_FRAMES)
+        try:
+            probe_hashes = [h for h in hashing.hash_video_frames(video_path, list(probes)) if h is not None]
+        finally:
+            video_source.close_video(video_path)
+        print(f"🔍 Identifying title from {len(probe_hashes)} frames across {len(title_ids)} catalog titles...")
+
+        votes = np.zeros(len(title_ids), dtype=np.int32)
+        distance_sum = np.zeros(len(title_ids), dtype=np.float64)
+
+        for probe in probe_hashes:
+            value = np.uint64(int(probe, 16))
+
+            # Candidates: reference hashes close to the probe in at least one band
+            candidates = self._candidates(index, value)
+            if len(candidates) == 0:
+                continue
+
+            # Verify candidates with the full Hamming distance; one vote per title per probe
+            distances = hash_index.hamming_many(int(value), index["hashes"][candidates])
+            owners = index["owners"][candidates]
+            close = distances <= config.CATALOG_MATCH_DISTANCE
+            for owner in np.unique(owners[close]):
+                votes[owner] += 1
+                distance_sum[owner] += distances[close & (owners == owner)].min()
+
+        ranked = sorted(
+            (i for i in range(len(title_ids)) if votes[i] > 0),
+            key=lambda i: (-votes[i], distance_sum[i] / votes[i])
+        )
+        return [(title_ids[i], int(votes[i]), float(distance_sum[i] / votes[i])) for i in ranked[:top_k]]
+
+
+@lru_cache(maxsize=8)
+def _band_flips(bits: int, radius: int) -> np.ndarray:
+    """Every bits-wide XOR mask with at most radius bits set"""
+    masks = [sum(1 << b for b in positions)
+             for r in range(radius + 1) for positions in combinations(range(bits), r)]
+    return np.array(masks, dtype=np.uint64)
+
+
+def _empty_results(reason: str) -> Dict:
+    """Results for an upload that couldn't be compared against any title"""
+    return {
+        "total_samples": 0,
+        "image_match_count": 0,
+        "image_match_percentage": 0,
+        "avg_image_distance": 999,
+        "avg_audio_similarity": 0,
+        "is_pirated": False,
+        "reason": reason,
+        "matched_timestamps": [],
+        "matched_audio_timestamps": []
+    }
+
+
+def detect_title(video_path: str, catalog: Optional[Catalog] = None) -> Dict:
+    """
+    Identify the title of a suspect upload and run the full comparison against
+    the top catalog hits only
+
+    Returns:
+        Comparison results (with "title_id" and "title_name" when a title matched)
+    """
+    import detection
+
+    catalog = catalog or Catalog()
+    candidates = catalog.identify(video_path)
+
+    if not candidates:
+        print("ℹ No catalog title matches this upload.")
+        return _empty_results("No catalog title matched the upload")
+
+    best = None
+    for title_id, votes, distance in candidates:
+        name = catalog.titles[title_id]["name"]
+        print(f"\n🎬 Candidate: {name} ({votes} frames, avg distance {distance:.1f})")
+
+        results = detection.detect(video_path, catalog.load_title(title_id))
+        if results is None:
+            print("  ⚠ No recorded samples were extracted")
+            continue
+        results["title_id"] = title_id
+        results["title_name"] = name
+
+        if results["is_pirated"]:
+            return results
+        if best is None:
+            best = results
+    return best if best is not None else _empty_results("No recorded samples were extracted")
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python catalog.py add <title_id> <original_video> [display name]
+    #   python catalog.py identify <suspect_video>
+    if len(sys.argv) >= 4 and sys.argv[1] == "add":
+        Catalog().add_title(sys.argv[2], sys.argv[3], " ".join(sys.argv[4:]) or None)
+    elif len(sys.argv) == 3 and sys.argv[1] == "identify":
+        for title_id, votes, distance in Catalog().identify(sys.argv[2]):
+            print(f"  {title_id}: {votes} frames (avg distance {distance:.1f})")
+    else:
+        print(__doc__)
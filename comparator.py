@@ -3,185 +3,410 @@ Phase 3: Comparison and Decision Module
 Compares extracted data using perceptual hashing and audio similarity
 """
 
-import os
-from typing import Dict, Tuple, List
+from functools import partial
+from typing import Dict, Tuple, List, Optional
 import numpy as np
-from PIL import Image
-import imagehash
-import librosa
 import config
+import utils
+import hashing
+import audio_features
+import fingerprint
+import hash_index
 
 
-def compare_images(img1_path: str, img2_path: str) -> Tuple[bool, int]:
+def _sample_hashes(samples: List[Dict]) -> List[Optional[int]]:
+    """Integer pHash per sample: precomputed ones, the rest hashed from screenshots in one batch"""
+    hashes = [int(s["phash"], 16) if s.get("phash") else None for s in samples]
+    missing = [i for i, s in enumerate(samples) if hashes[i] is None and s.get("screenshot")]
+    for i, value in zip(missing, hashing.phash_files([samples[i]["screenshot"] for i in missing])):
+        hashes[i] = value
+    return hashes
+
+
+def _sample_strips(samples: List[Dict], metadata: Dict,
+                   fp: Optional[fingerprint.Fingerprint]) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Reference frame strips of the samples (offsets, (N, M) hashes, (N, M) valid), if they were extracted"""
+    if fp is not None:
+        if "strip_hashes" not in fp:
+            return None
+        indexes = [s["index"] for s in samples]
+        return fp["strip_offsets"], fp["strip_hashes"][indexes], fp["strip_valid"][indexes].astype(bool)
+    
+    if "strip_offsets" not in metadata or not all(s.get("strip") for s in samples):
+        return None
+    hashes = np.array([[int(h, 16) if h else 0 for h in s["strip"]] for s in samples], dtype=np.uint64)
+    valid = np.array([[h is not None for h in s["strip"]] for s in samples], dtype=bool)
+    return np.asarray(metadata["strip_offsets"], dtype=np.float64), hashes, valid
+
+
+def bank_votes(ref_banks: List[Optional[Dict]], rec_banks: List[Optional[Dict]],
+               phash_distances: np.ndarray) -> np.ndarray:
     """
-    Compare two images using perceptual hashing with normalization
+    Count how many hashes of the bank agree for each pair of frames
     
     Args:
-        img1_path: Path to first image
-        img2_path: Path to second image
+        ref_banks: Reference sample banks (None where missing)
+        rec_banks: Recorded sample banks (None where missing)
+        phash_distances: pHash distance per pair
         
     Returns:
-        Tuple of (is_match, hamming_distance)
+        (N,) votes out of 4 (pHash, dHash, wHash, colour), -1 where either bank is missing
     """
-    try:
-        # Load images
-        img1 = Image.open(img1_path)
-        img2 = Image.open(img2_path)
-        
-        # Normalize images for better comparison
-        # 1. Resize to consistent dimensions (reduces resolution differences)
-        target_size = (512, 512)
-        img1 = img1.resize(target_size, Image.Resampling.LANCZOS)
-        img2 = img2.resize(target_size, Image.Resampling.LANCZOS)
-        
-        # 2. Convert to grayscale (removes color variations)
-        img1 = img1.convert('L')
-        img2 = img2.convert('L')
-        
-        # Calculate perceptual hashes
-        hash1 = imagehash.phash(img1)
-        hash2 = imagehash.phash(img2)
-        
-        # Calculate Hamming distance
-        distance = hash1 - hash2
-        
-        # Determine if match
-        is_match = distance <= config.IMAGE_HASH_THRESHOLD
+    has_bank = np.array([a is not None and b is not None for a, b in zip(ref_banks, rec_banks)], dtype=bool)
+    votes = np.full(len(has_bank), -1, dtype=np.int64)
+    if not np.any(has_bank):
+        return votes
+    
+    pairs = [(a, b) for a, b, ok in zip(ref_banks, rec_banks, has_bank) if ok]
+    def hashes(name, side):
+        return np.array([int(pair[side][name], 16) for pair in pairs], dtype=np.uint64)
+    
+    dhash = hash_index.hamming_pairs(hashes("dhash", 0), hashes("dhash", 1))
+    whash = hash_index.hamming_pairs(hashes("whash", 0), hashes("whash", 1))
+    color = np.abs(
+        np.array([a["color"] for a, _ in pairs], dtype=np.float64) - np.array([b["color"] for _, b in pairs], dtype=np.float64)
+    ).mean(axis=1)
+    
+    votes[has_bank] = (
+        (phash_distances[has_bank] <= config.IMAGE_HASH_THRESHOLD).astype(np.int64)
+        + (dhash <= config.DHASH_THRESHOLD)
+        + (whash <= config.WHASH_THRESHOLD)
+        + (color <= config.COLOR_MOMENT_THRESHOLD)
+    )
+    return votes
+
+
+def compare_sample_hashes(ref_samples: List[Dict], rec_samples: List[Dict],
+                          strips: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> List[Tuple[bool, int, float]]:
+    """
+    Compare paired reference/recorded samples all at once (XOR + popcount over arrays)
+    
+    With reference strips, each recorded frame is also compared against every
+    strip frame around its sample and keeps the closest, so a sync error of up
+    to TEMPORAL_MATCH_WINDOW doesn't lose the sample. Paired frames that both
+    carry a hash bank are decided by HASH_BANK_RULE; strip frames by pHash.
+    
+    Args:
+        ref_samples: Reference samples
+        rec_samples: Recorded sample paired with each reference sample
+        strips: Optional (offsets, (N, M) hashes, (N, M) valid) reference strips per pair
         
-        return is_match, distance
-    except Exception as e:
-        print(f"  ⚠ Error comparing images: {e}")
-        return False, 999
+    Returns:
+        List of (is_match, hamming_distance, offset of the best reference frame) per pair
+        (distance 999 if a frame couldn't be hashed)
+    """
+    ref_hashes = _sample_hashes(ref_samples)
+    rec_hashes = _sample_hashes(rec_samples)
+    rec_valid = np.array([h is not None for h in rec_hashes], dtype=bool)
+    rec_array = np.array([h if h is not None else 0 for h in rec_hashes], dtype=np.uint64)
+    
+    # Paired frames: one distance per sample
+    ref_valid = np.array([h is not None for h in ref_hashes], dtype=bool)
+    distances = hash_index.hamming_pairs(
+        np.array([h if h is not None else 0 for h in ref_hashes], dtype=np.uint64), rec_array
+    )
+    distances[~(ref_valid & rec_valid)] = 999
+    offsets = np.zeros(len(distances))
+    matches = distances <= config.IMAGE_HASH_THRESHOLD
+    
+    # Hash bank: dHash, wHash and colour vote alongside pHash on the paired frames
+    if config.HASH_BANK_RULE == "vote":
+        votes = bank_votes([s.get("bank") for s in ref_samples], [s.get("bank") for s in rec_samples], distances)
+        matches = np.where(votes >= 0, votes >= config.HASH_BANK_MIN_VOTES, matches)
+    
+    # Strips: (N, M) distances, best per row
+    if strips is not None and len(distances) > 0:
+        strip_offsets, strip_hashes, strip_valid = strips
+        strip_distances = hash_index.popcount(np.bitwise_xor(strip_hashes, rec_array[:, np.newaxis]))
+        strip_distances[~(strip_valid & rec_valid[:, np.newaxis])] = 999
+        best = np.argmin(strip_distances, axis=1)
+        best_distances = strip_distances[np.arange(len(best)), best]
+        better = (best_distances < distances) & ~matches
+        distances = np.where(better, best_distances, distances)
+        offsets = np.where(better, strip_offsets[best], offsets)
+        matches = np.where(better, best_distances <= config.IMAGE_HASH_THRESHOLD, matches)
+    
+    return [
+        (bool(match), int(d), float(offset))
+        for match, d, offset in zip(matches, distances, offsets)
+    ]
 
 
-def compare_audio(audio1_path: str, audio2_path: str) -> Tuple[bool, float]:
+def compare_hash_to_index(rec_hash: str, index: hash_index.HashIndex) -> List[Tuple[int, float]]:
     """
-    Compare two audio clips using spectrogram-based similarity with normalization
+    Find the reference frames close to a recorded frame hash (no sync needed)
     
     Args:
-        audio1_path: Path to first audio file
-        audio2_path: Path to second audio file
+        rec_hash: Hex pHash of the recorded frame
+        index: Dense reference hash index
         
     Returns:
-        Tuple of (is_match, similarity_score)
+        Up to CASCADE_MAX_CANDIDATES (hamming_distance, reference_time) within
+        DENSE_INDEX_MATCH_DISTANCE, closest first
     """
     try:
-        # Load audio files
-        y1, sr1 = librosa.load(audio1_path, sr=config.AUDIO_SAMPLE_RATE)
-        y2, sr2 = librosa.load(audio2_path, sr=config.AUDIO_SAMPLE_RATE)
-        
-        # Normalize audio amplitude (removes volume differences)
-        # RMS normalization: scale to consistent energy level
-        def normalize_audio(audio):
-            rms = np.sqrt(np.mean(audio**2))
-            if rms > 0:
-                return audio / rms
-            return audio
-        
-        y1 = normalize_audio(y1)
-        y2 = normalize_audio(y2)
-        
-        # Ensure same length (pad shorter one)
-        max_len = max(len(y1), len(y2))
-        y1 = np.pad(y1, (0, max_len - len(y1)), mode='constant')
-        y2 = np.pad(y2, (0, max_len - len(y2)), mode='constant')
-        
-        # Generate mel spectrograms
-        spec1 = librosa.feature.melspectrogram(y=y1, sr=sr1)
-        spec2 = librosa.feature.melspectrogram(y=y2, sr=sr2)
-        
-        # Flatten spectrograms
-        spec1_flat = spec1.flatten()
-        spec2_flat = spec2.flatten()
-        
-        # Ensure same length
-        min_len = min(len(spec1_flat), len(spec2_flat))
-        spec1_flat = spec1_flat[:min_len]
-        spec2_flat = spec2_flat[:min_len]
-        
-        # Calculate cosine similarity
-        dot_product = np.dot(spec1_flat, spec2_flat)
-        norm1 = np.linalg.norm(spec1_flat)
-        norm2 = np.linalg.norm(spec2_flat)
-        
-        if norm1 == 0 or norm2 == 0:
-            similarity = 0.0
-        else:
-            similarity = dot_product / (norm1 * norm2)
+        return index.within(int(rec_hash, 16), config.DENSE_INDEX_MATCH_DISTANCE)[:config.CASCADE_MAX_CANDIDATES]
+    except Exception as e:
+        print(f"  ⚠ Error searching hash index: {e}")
+        return []
+
+
+def index_fallback(pairs: List[Tuple[Dict, Dict]], pair_results: List[Tuple[bool, int, float]],
+                   index: hash_index.HashIndex) -> List[Optional[Tuple[int, float]]]:
+    """
+    Dense-index matches for the samples whose paired frame didn't match
+    
+    A close reference frame only counts if it lies on one time line with
+    the other samples' matches (paired matches anchor the line), and that
+    line holds at least DENSE_INDEX_MIN_INLIERS samples: repetitive or
+    unrelated footage matches frames scattered across the film instead.
+    
+    Args:
+        pairs: (reference sample, recorded sample) pairs
+        pair_results: (is_match, distance, strip_offset) per pair
+        index: Dense reference hash index
         
-        # Determine if match
-        is_match = similarity >= config.AUDIO_SIMILARITY_THRESHOLD
+    Returns:
+        Per pair, (hamming_distance, reference_time) of the index match, or None
+    """
+    rec_times, candidates, lookups = [], [], []
+    for (ref_sample, rec_sample), (is_match, _, strip_offset) in zip(pairs, pair_results):
+        matches = []
+        if not is_match and rec_sample.get("phash"):
+            matches = compare_hash_to_index(rec_sample["phash"], index)
+        rec_times.append(rec_sample["timestamp"])
+        candidates.append([ref_sample["timestamp"] + strip_offset] if is_match else [t for _, t in matches])
+        lookups.append(matches)
+    
+    on_line, rate, offset = hash_index.fit_time_line(rec_times, candidates, config.CASCADE_TIME_TOLERANCE)
+    if rate is None or sum(on_line) < config.DENSE_INDEX_MIN_INLIERS:
+        return [None] * len(pairs)
+    
+    fallback = []
+    for rec_time, matches, (is_match, _, _), line in zip(rec_times, lookups, pair_results, on_line):
+        expected = offset + rate * rec_time
+        close = [(d, t) for d, t in matches if abs(t - expected) <= config.CASCADE_TIME_TOLERANCE]
+        fallback.append(close[0] if line and not is_match and close else None)
+    return fallback
+
+
+def compare_audio_progressive(ref_descriptor: np.ndarray, audio_path: str,
+                              rate: float = 1.0) -> Tuple[bool, float, float]:
+    """
+    Compare a recorded clip against a reference descriptor on growing prefixes
+    
+    Each AUDIO_PROGRESSIVE_STAGES prefix is scored in turn; once the similarity
+    is AUDIO_PROGRESSIVE_MARGIN above the threshold the rest of the clip is
+    never read. A low score only ends the clip early once the reference span
+    compared so far holds AUDIO_PROGRESSIVE_MIN_ACTIVE seconds of audible
+    blocks: a quiet or silent intro carries no evidence either way. (The
+    recorded side needs no such check, since descriptor similarity ignores
+    its volume.)
+    
+    Args:
+        ref_descriptor: Reference block descriptor (from the fingerprint or cache)
+        audio_path: Path to the recorded audio file
+        rate: Playback rate from the time map (reference seconds per recorded second)
         
-        return is_match, similarity
+    Returns:
+        Tuple of (is_match, similarity_score, seconds of recorded audio used)
+    """
+    try:
+        # Reference blocks within AUDIO_PROGRESSIVE_QUIET_DB of the clip's median level
+        levels = audio_features.block_levels(ref_descriptor)
+        audible = levels >= np.median(levels) - config.AUDIO_PROGRESSIVE_QUIET_DB if len(levels) else levels > 0
+        for seconds, descriptor, finished in audio_features.progressive_descriptors(
+                audio_path, config.AUDIO_PROGRESSIVE_STAGES):
+            similarity = audio_features.descriptor_similarity(ref_descriptor, descriptor, rate)
+            audible_seconds = audible[:int(len(descriptor) * rate)].sum() * config.DESCRIPTOR_BLOCK
+            decisive_match = similarity >= config.AUDIO_SIMILARITY_THRESHOLD + config.AUDIO_PROGRESSIVE_MARGIN
+            decisive_mismatch = (similarity <= config.AUDIO_SIMILARITY_THRESHOLD - config.AUDIO_PROGRESSIVE_MARGIN
+                                 and audible_seconds >= config.AUDIO_PROGRESSIVE_MIN_ACTIVE)
+            if finished or decisive_match or decisive_mismatch:
+                return similarity >= config.AUDIO_SIMILARITY_THRESHOLD, similarity, seconds
+        return False, 0.0, 0.0
     except Exception as e:
         print(f"  ⚠ Error comparing audio: {e}")
-        return False, 0.0
+        return False, 0.0, 0.0
 
 
-def compare_and_decide(metadata: Dict) -> Dict:
+def _load_audio(audio_path: Optional[str], descriptors: bool) -> Optional[np.ndarray]:
+    """Cached descriptor or mel spectrogram of one clip (None if it can't be read)"""
+    if not audio_path:
+        return None
+    try:
+        if descriptors:
+            return audio_features.load_descriptor(audio_path)
+        return audio_features.load_mel_spectrogram(audio_path)
+    except Exception as e:
+        print(f"  ⚠ Error comparing audio: {e}")
+        return None
+
+
+def compare_sample_audio(ref_samples: List[Dict], rec_samples: List[Dict],
+                         fp: Optional[fingerprint.Fingerprint] = None,
+                         rate: float = 1.0) -> List[Tuple[bool, float, Optional[float]]]:
     """
-    Compare all extracted data and make piracy decision
+    Compare paired reference/recorded audio clips all at once
+    
+    Clips are decoded and turned into features concurrently (each cached per
+    file content), then every pair is scored in one vectorized pass. With
+    AUDIO_PROGRESSIVE, each recorded clip is instead read only as far as its
+    score needs (see compare_audio_progressive).
     
     Args:
-        metadata: Metadata containing all sample information
+        ref_samples: Reference samples
+        rec_samples: Recorded sample paired with each reference sample
+        fp: Binary fingerprint holding the reference features (None = reference WAVs)
+        rate: Playback rate from the time map
         
     Returns:
-        Dictionary containing comparison results and decision
+        List of (is_match, similarity_score, seconds of recorded audio used) per pair
+        (0.0 if a clip couldn't be read; seconds are None for mel spectrograms)
     """
-    print(f"\nPhase 3: Comparing content...")
+    # Block descriptors unless the fingerprint predates them (or they're switched off)
+    descriptors = "audio_descriptors" in fp if fp is not None else config.AUDIO_DESCRIPTORS
+    progressive = descriptors and config.AUDIO_PROGRESSIVE
+    
+    # Progressive comparison reads the recorded clips itself
+    rec_tasks = [] if progressive else [partial(_load_audio, s["audio"], descriptors) for s in rec_samples]
+    ref_tasks = [partial(_load_audio, s["audio"], descriptors) for s in ref_samples] if fp is None else []
+    loaded = utils.run_parallel(rec_tasks + ref_tasks)
+    rec_features = loaded[:len(rec_tasks)]
+    if fp is None:
+        ref_features = loaded[len(rec_tasks):]
+    elif descriptors:
+        ref_features = [fp["audio_descriptors"][s["index"], :fp["audio_blocks"][s["index"]]] for s in ref_samples]
+    else:
+        ref_features = [fp["audio_features"][s["index"], :, :fp["audio_frames"][s["index"]]] for s in ref_samples]
+    
+    if progressive:
+        return utils.run_parallel([
+            partial(compare_audio_progressive, ref, rec["audio"], rate) if ref is not None and rec["audio"]
+            else (lambda: (False, 0.0, 0.0))
+            for ref, rec in zip(ref_features, rec_samples)
+        ])
+    
+    ok = [i for i, (ref, rec) in enumerate(zip(ref_features, rec_features)) if ref is not None and rec is not None]
+    similarities = np.zeros(len(rec_samples))
+    if ok:
+        refs = [ref_features[i] for i in ok]
+        recs = [rec_features[i] for i in ok]
+        if descriptors:
+            similarities[ok] = audio_features.descriptor_similarities(refs, recs, rate)
+        else:
+            similarities[ok] = audio_features.spectral_similarities(refs, recs)
+    
+    seconds = [len(rec) * config.DESCRIPTOR_BLOCK if descriptors and rec is not None else None for rec in rec_features]
+    return [(bool(s >= config.AUDIO_SIMILARITY_THRESHOLD), float(s), used) for s, used in zip(similarities, seconds)]
+
+
+def compare_samples(metadata: Dict) -> List[Dict]:
+    """
+    Compare every recorded sample with its reference sample, printing the details
     
+    Args:
+        metadata: Metadata containing reference and recorded samples
+        
+    Returns:
+        One result per compared sample (index, timestamp, image and audio outcomes)
+    """
     reference_samples = metadata["samples"]
     recorded_samples = metadata["recorded_samples"]
     
+    # Binary fingerprint: reference audio features are precomputed
+    fp = fingerprint.load_fingerprint(metadata["fingerprint"]) if metadata.get("fingerprint") else None
+    
+    # Dense reference index: fallback for recorded frames that miss their paired reference frame
+    dense_index = hash_index.load_dense_index(fp) if fp is not None and config.DENSE_INDEX_MATCHING else None
+    
+    # Recorded audio clips run at the upload's playback rate
+    rate = metadata.get("time_map", {}).get("rate", 1.0)
+    
     # Match samples by index
-    image_matches = []
-    image_distances = []
-    audio_similarities = []
-    matched_timestamps = []  # List to store timestamps of confirmed matches
-    matched_audio_timestamps = [] # List to store timestamps of audio matches
+    sample_results = []
     
-    print(f"\n{'='*60}")
-    print(f"DETAILED COMPARISON RESULTS")
-    print(f"{'='*60}")
+    # Find corresponding recorded samples
+    recorded_by_index = {s["index"]: s for s in recorded_samples}
+    pairs = [
+        (ref_sample, recorded_by_index[ref_sample["index"]])
+        for ref_sample in reference_samples
+        if ref_sample["index"] in recorded_by_index
+    ]
     
-    for ref_sample in reference_samples:
-        # Find corresponding recorded sample
-        rec_sample = next(
-            (s for s in recorded_samples if s["index"] == ref_sample["index"]),
-            None
-        )
-        
-        if rec_sample is None:
-            continue
-        
-        # Compare images
-        is_img_match, img_distance = compare_images(
-            ref_sample["screenshot"],
-            rec_sample["screenshot"]
-        )
-        image_matches.append(is_img_match)
-        image_distances.append(img_distance)
-        
-        if is_img_match:
-            matched_timestamps.append(int(ref_sample['timestamp']))
-        
-        # Compare audio
-        is_audio_match, audio_similarity = compare_audio(
-            ref_sample["audio"],
-            rec_sample["audio"]
-        )
-        
-        if is_audio_match:
-            matched_audio_timestamps.append(int(ref_sample['timestamp']))
-        
-        audio_similarities.append(audio_similarity)
+    # Compare images: all sample pairs (and their reference strips) hashed and compared in one batch
+    ref_pairs = [ref for ref, _ in pairs]
+    pair_results = compare_sample_hashes(ref_pairs, [rec for _, rec in pairs], _sample_strips(ref_pairs, metadata, fp))
+    
+    # Compare audio: all clips loaded concurrently and scored in one batch
+    audio_results = compare_sample_audio(ref_pairs, [rec for _, rec in pairs], fp, rate)
+    
+    index_results = index_fallback(pairs, pair_results, dense_index) if dense_index is not None else [None] * len(pairs)
+    
+    for (ref_sample, rec_sample), (is_img_match, img_distance, strip_offset), (is_audio_match, audio_similarity, audio_used), index_match in zip(
+            pairs, pair_results, audio_results, index_results):
+        index_time = None
+        if index_match is not None:
+            img_distance, index_time = index_match
+            is_img_match = True
+        sample_results.append({
+            "index": ref_sample["index"],
+            "timestamp": ref_sample["timestamp"],
+            "image_match": is_img_match,
+            "image_distance": img_distance,
+            "audio_match": is_audio_match,
+            "audio_similarity": audio_similarity,
+            "audio_seconds": audio_used,
+            "audio_available": rec_sample["audio"] is not None
+        })
         
         # Print detailed results for each sample
         print(f"\nSample {ref_sample['index']} @ {int(ref_sample['timestamp'])}s:")
         print(f"  Image Hash Distance: {img_distance} (threshold: {config.IMAGE_HASH_THRESHOLD}) - {'✓ MATCH' if is_img_match else '✗ NO MATCH'}")
-        print(f"  Audio Similarity: {audio_similarity:.3f} (threshold: {config.AUDIO_SIMILARITY_THRESHOLD}) - {'✓ MATCH' if is_audio_match else '✗ NO MATCH'}")
+        if index_time is not None:
+            print(f"  Reference Frame (dense index): {int(index_time)}s")
+        elif strip_offset:
+            print(f"  Best Reference Frame: {strip_offset:+.2f}s from sample")
+        if rec_sample["audio"] is None:
+            print("  Audio Similarity: - (no audio in the upload here)")
+        else:
+            print(f"  Audio Similarity: {audio_similarity:.3f} (threshold: {config.AUDIO_SIMILARITY_THRESHOLD}) - {'✓ MATCH' if is_audio_match else '✗ NO MATCH'}")
+            if audio_used is not None:
+                print(f"  Audio Used: {audio_used:.0f}s")
     
-    print(f"\n{'='*60}")
+    return sample_results
+
+
+def sample_evidence(result: Dict) -> bool:
+    """
+    Whether one compared sample supports piracy on the evidence decide() relies on:
+    a visual match with audio that isn't completely different (when audio
+    confirmation is required and the upload has audio there)
+    """
+    audio_reasonable = result["audio_similarity"] >= config.AUDIO_MIN_SIMILARITY
+    return bool(result["image_match"] and (audio_reasonable or not result["audio_available"]
+                                           or not config.REQUIRE_AUDIO_CONFIRMATION))
+
+
+def evaluate(sample_results: List[Dict]) -> Dict:
+    """
+    Make the piracy decision from per-sample comparison results (no output)
+    
+    Audio is averaged over the samples that have it; an upload with no audio
+    at all is judged on a strong visual match alone.
+    
+    Args:
+        sample_results: Results from compare_samples (possibly several batches)
+        
+    Returns:
+        Dictionary containing comparison results and decision
+    """
+    image_matches = [r["image_match"] for r in sample_results]
+    image_distances = [r["image_distance"] for r in sample_results]
+    audio_similarities = [r["audio_similarity"] for r in sample_results if r["audio_available"]]
+    audio_seconds = [r["audio_seconds"] for r in sample_results if r["audio_seconds"] is not None]
+    matched_timestamps = [int(r["timestamp"]) for r in sample_results if r["image_match"]]
+    matched_audio_timestamps = [int(r["timestamp"]) for r in sample_results if r["audio_match"]]
     
     # Calculate statistics
     total_samples = len(image_matches)
@@ -190,14 +415,6 @@ def compare_and_decide(metadata: Dict) -> Dict:
     avg_audio_similarity = np.mean(audio_similarities) if audio_similarities else 0
     avg_image_distance = np.mean(image_distances) if image_distances else 999
     
-    # Display results
-    print(f"\n🖼️  Visual match: {image_match_count} / {total_samples} ({image_match_percentage*100:.1f}%)")
-    print(f"   Average hash distance: {avg_image_distance:.1f}")
-    
-    audio_level = "HIGH" if avg_audio_similarity >= config.AUDIO_SIMILARITY_THRESHOLD else "LOW"
-    print(f"🔊 Audio similarity: {audio_level} (avg: {avg_audio_similarity:.2f})")
-    
-    
     # Decision logic - optimized for screen-recorded piracy detection
     is_pirated = False
     reason = ""
@@ -208,8 +425,9 @@ def compare_and_decide(metadata: Dict) -> Dict:
     
     # Check if audio similarity is reasonable
     # Note: Screen recordings degrade audio significantly, so we're lenient here
-    audio_reasonable = avg_audio_similarity >= 0.02  # Very low bar - just checking it's not completely different
+    audio_reasonable = avg_audio_similarity >= config.AUDIO_MIN_SIMILARITY
     audio_strong = avg_audio_similarity >= config.AUDIO_SIMILARITY_THRESHOLD
+    has_audio = bool(audio_similarities)
     
     # Decision tree optimized for screen-recorded content
     if visual_strong and audio_reasonable:
@@ -217,6 +435,10 @@ def compare_and_decide(metadata: Dict) -> Dict:
         # This is the PRIMARY detection path for screen recordings
         is_pirated = True
         reason = f"Strong visual match: {image_match_percentage*100:.1f}% (threshold: {config.SCREENSHOT_MATCH_PERCENTAGE*100:.1f}%) with audio correlation {avg_audio_similarity:.3f}"
+    elif visual_strong and not has_audio:
+        # Muted upload: nothing to confirm with, so only a strong visual match counts
+        is_pirated = True
+        reason = f"Strong visual match: {image_match_percentage*100:.1f}% (threshold: {config.SCREENSHOT_MATCH_PERCENTAGE*100:.1f}%), upload has no audio"
     elif visual_match and audio_strong:
         # Good visual match with strong audio match
         is_pirated = True
@@ -232,7 +454,9 @@ def compare_and_decide(metadata: Dict) -> Dict:
     else:
         # Insufficient evidence
         is_pirated = False
-        if visual_match and not audio_reasonable:
+        if visual_match and not has_audio:
+            reason = f"Visual match {image_match_percentage*100:.1f}% below 80% and the upload has no audio to confirm it"
+        elif visual_match and not audio_reasonable:
             reason = f"Visual match {image_match_percentage*100:.1f}% but audio completely different ({avg_audio_similarity:.3f}) - likely false positive"
         else:
             reason = "Neither visual nor audio similarity thresholds met"
@@ -244,6 +468,7 @@ def compare_and_decide(metadata: Dict) -> Dict:
         "image_match_percentage": image_match_percentage,
         "avg_image_distance": avg_image_distance,
         "avg_audio_similarity": avg_audio_similarity,
+        "audio_seconds_used": float(sum(audio_seconds)),
         "is_pirated": is_pirated,
         "reason": reason,
         "matched_timestamps": matched_timestamps,
@@ -253,6 +478,52 @@ def compare_and_decide(metadata: Dict) -> Dict:
     return results
 
 
+def decide(sample_results: List[Dict]) -> Dict:
+    """
+    Make the piracy decision from per-sample comparison results, printing the statistics
+    
+    Args:
+        sample_results: Results from compare_samples (possibly several batches)
+        
+    Returns:
+        Dictionary containing comparison results and decision
+    """
+    results = evaluate(sample_results)
+    audio_seconds = [r["audio_seconds"] for r in sample_results if r["audio_seconds"] is not None]
+    
+    print(f"\n{'='*60}")
+    
+    # Display results
+    print(f"\n🖼️  Visual match: {results['image_match_count']} / {results['total_samples']} ({results['image_match_percentage']*100:.1f}%)")
+    print(f"   Average hash distance: {results['avg_image_distance']:.1f}")
+    
+    audio_level = "HIGH" if results["avg_audio_similarity"] >= config.AUDIO_SIMILARITY_THRESHOLD else "LOW"
+    print(f"🔊 Audio similarity: {audio_level} (avg: {results['avg_audio_similarity']:.2f})")
+    if audio_seconds:
+        print(f"   Audio compared: {sum(audio_seconds):.0f}s over {len(audio_seconds)} clips")
+    
+    return results
+
+
+def compare_and_decide(metadata: Dict) -> Dict:
+    """
+    Compare all extracted data and make piracy decision
+    
+    Args:
+        metadata: Metadata containing all sample information
+        
+    Returns:
+        Dictionary containing comparison results and decision
+    """
+    print(f"\nPhase 3: Comparing content...")
+    
+    print(f"\n{'='*60}")
+    print(f"DETAILED COMPARISON RESULTS")
+    print(f"{'='*60}")
+    
+    return decide(compare_samples(metadata))
+
+
 if __name__ == "__main__":
     # For testing this module independently
     import json
@@ -10,6 +10,11 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "output")
 REFERENCE_DIR = os.path.join(OUTPUT_DIR, "reference")
 RECORDED_DIR = os.path.join(OUTPUT_DIR, "recorded")
 METADATA_FILE = os.path.join(OUTPUT_DIR, "metadata.json")
+FINGERPRINT_FILE = os.path.join(OUTPUT_DIR, "reference.mpfp")  # Binary reference fingerprint
+CACHE_DIR = os.path.join(OUTPUT_DIR, "cache")
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, "audio")  # Decoded PCM tracks
+PROBE_CACHE_DIR = os.path.join(CACHE_DIR, "probe")  # FFprobe results + keyframe index
+ARTIFACT_CACHE_DIR = os.path.join(CACHE_DIR, "artifacts")  # Hashes, clips, features, sync offsets
 
 # Demo Directories
 OFFLINE_DIR = os.path.join(BASE_DIR, "Offline")
@@ -21,19 +26,58 @@ NUM_SAMPLES = 15  # Number of random timestamps to sample
 AUDIO_DURATION = 180  # Duration of audio clips for comparison
 MIN_TIMESTAMP_OFFSET = 60  # Skip first minute
 MAX_TIMESTAMP_OFFSET = 60  # Skip last minute
+TIMESTAMP_SAMPLING = "keyframe"  # "keyframe" (stratified, snapped to keyframes) or "random"
+SAMPLING_SEED = None  # Fixed seed for keyframe sampling (None = derive from the file)
+KEYFRAME_SNAP_WINDOW = 2.0  # Max seconds a timestamp may move to reach a keyframe
 
 # ==================== AUDIO SYNC (NEW) ====================
 # Anchors for aligning the recorded video with original
 ANCHOR_AUDIO_TIMES = [300, 600, 900]  # Take anchors at 5m, 10m, 15m
 ANCHOR_DURATION = 10  # 10 second clips for sync
-AUDIO_SEARCH_WINDOW = 60  # Look +/- 60 seconds in recorded video
+AUDIO_SEARCH_WINDOW = None  # Look +/- this many seconds around each anchor (None = whole recorded track)
+SYNC_SAMPLE_RATE = 8000  # Low sample rate used for cross-correlation
+SYNC_ENVELOPE_RATE = 100  # Energy-envelope frames per second for the coarse whole-track search
+SYNC_COARSE_CANDIDATES = 3  # Coarse lags per anchor that are refined at SYNC_SAMPLE_RATE
+SYNC_REFINE_MARGIN = 0.5  # Seconds searched either side of a coarse lag
+SYNC_MIN_CONFIDENCE = 0.1  # Anchor matches below this correlation are not used
+SYNC_MAP_ANCHORS = 16  # Short anchors spread over the reference for the time map
+SYNC_MAP_ANCHOR_DURATION = 3.0  # Seconds per short anchor (short clips tolerate speed changes)
+SYNC_MAP_WINDOW = 20.0  # Seconds of recorded audio per landmark vote
+SYNC_MAP_MIN_VOTES = 8  # Landmark votes a window needs to count as an alignment point
+SYNC_MAP_TOLERANCE = 0.5  # Seconds a point may be off the fitted line and still agree
+SYNC_MIN_RATE = 0.9  # Plausible playback speed range of uploads
+SYNC_MAX_RATE = 1.1
+SYNC_FROM_STORED_ANCHORS = True  # Sync from anchor audio stored with the reference (original video not needed)
 
 # ==================== COMPARISON THRESHOLDS ====================
 IMAGE_HASH_THRESHOLD = 25
 AUDIO_SIMILARITY_THRESHOLD = 0.30
+AUDIO_MIN_SIMILARITY = 0.02  # Below this, audio is completely different (visual matches are then not trusted)
 SCREENSHOT_MATCH_PERCENTAGE = 0.35
 REQUIRE_AUDIO_CONFIRMATION = True
 
+# ==================== ADAPTIVE SAMPLING ====================
+ADAPTIVE_SAMPLING = True  # Draw samples a few at a time and stop once a sequential test settles the verdict
+SPRT_BATCH = 3  # Samples extracted and compared per step
+SPRT_MIN_SAMPLES = 3  # Samples compared before the test may stop
+SPRT_MATCH_RATE_PIRATED = 0.8  # Expected fraction of samples supporting piracy (visual match + audio) for a pirated upload
+SPRT_MATCH_RATE_CLEAN = 0.1  # ... and for an unrelated one
+SPRT_FALSE_POSITIVE = 0.01  # Target rate of stopping on "pirated" for an unrelated upload
+SPRT_FALSE_NEGATIVE = 0.05  # Target rate of stopping on "clean" for a pirated upload
+
+# ==================== DETECTION CASCADE ====================
+CASCADE = True  # Try cheap tiers before audio sync and full sample comparison
+CASCADE_TIERS = ["metadata", "frames", "full"]  # Tier order ("full" always runs last if nothing decided earlier)
+CASCADE_MIN_DURATION = 10.0  # Uploads shorter than this (seconds) are not compared
+CASCADE_PROBE_FRAMES = 8  # Upload frames looked up in the dense reference index
+CASCADE_MATCH_DISTANCE = 10  # Hamming distance of a close probe match (stricter than IMAGE_HASH_THRESHOLD)
+CASCADE_MAX_CANDIDATES = 20  # Closest reference frames kept per probe (repetitive content matches many)
+CASCADE_TIME_TOLERANCE = 2.0  # Seconds a frame match may be off the fitted time line
+CASCADE_COPY_FRACTION = 0.75  # Probe frames on one time line that decide a copy
+CASCADE_MIN_INLIERS = 3  # ... and never fewer than this many
+CASCADE_STRONG_DISTANCE = 6  # Mean distance of the line's matches that decides a copy without audio (looser fits need REQUIRE_AUDIO_CONFIRMATION off)
+CASCADE_AUDIO_PROBES = 3  # SYNC_MAP_WINDOW-long upload clips voted against the reference landmarks before clearing an upload
+
 # ==================== MONITORING ====================
 USE_EVENT_LISTENER = True  # True=Watchdog, False=Loop
 MIN_FILE_SIZE_MB = 10      # Ignore tiny files
@@ -44,6 +88,12 @@ API_HASH = ""
 SESSION_NAME = ""
 TARGET_CHANNELS = []  # List of Channel IDs to monitor
 
+# Streaming ingest: analyse uploads while they are still downloading
+STREAMING_INGEST = True
+STREAM_CHECKPOINTS = [0.25, 0.5, 0.75]  # Download fractions at which to analyse the prefix
+STREAM_MIN_SAMPLES = 5  # Samples a partial verdict needs before the download is cancelled
+STREAM_SAFETY_MARGIN = 0.9  # Only trust this fraction of the estimated downloaded duration
+
 # ==================== REPORTING (NEW) ====================
 ENABLE_REPORTING = True
 # GOOGLE_SHEETS_URL = ""
@@ -62,3 +112,81 @@ SCREENSHOT_FORMAT = "png"
 AUDIO_FORMAT = "wav"
 AUDIO_SAMPLE_RATE = 22050
 VERBOSE = True
+SCREENSHOT_BATCH_SIZE = 16  # Screenshots extracted per FFmpeg process
+EXTRACTION_WORKERS = os.cpu_count() or 4  # Max concurrent extraction tasks (1 = sequential)
+VIDEO_SEEK_THRESHOLD = 5.0  # Decode forward instead of seeking for gaps up to this (s); needs PyAV
+
+# ==================== GEOMETRY NORMALIZATION ====================
+AUTO_CROP = True  # Detect each video's picture area once and crop every extracted frame to it
+CROP_DETECT_FRAMES = 12  # Frames spread over the video used to find the picture area
+CROP_DETECT_SIZE = 128  # Gray frame size for detection
+CROP_MIN_ACTIVITY = 2.0  # Gray-level std across those frames for a row/column to count as picture
+CROP_MIN_AREA = 0.1  # Smaller detected areas are not trusted (mostly static or dark samples)
+
+# ==================== ARTIFACT CACHE ====================
+USE_ARTIFACT_CACHE = True  # Reuse intermediate results for inputs that were processed before
+ARTIFACT_CACHE_MAX_MB = 2048  # Least recently used artifacts are evicted beyond this size
+AUDIO_CACHE_MAX_MB = 4096  # Least recently used decoded PCM tracks are deleted beyond this size
+AUDIO_CACHE_MAX_OPEN = 8  # Decoded tracks kept memory-mapped at once
+
+# ==================== HASH-AT-DECODE ====================
+HASH_AT_DECODE = True  # Pipe small gray frames from FFmpeg and hash them in memory
+HASH_FRAME_SIZE = 32  # Frame size FFmpeg scales to (pHash works on 32x32)
+SAVE_EVIDENCE_FRAMES = False  # Also write full-size PNG screenshots for evidence
+
+# ==================== HASH BANK ====================
+HASH_BANK = True  # pHash, dHash, wHash and colour moments from one small RGB decode per sample frame
+HASH_BANK_RULE = "vote"  # "vote": HASH_BANK_MIN_VOTES of the bank must agree; "phash": pHash only
+HASH_BANK_MIN_VOTES = 3  # Of 4 (pHash, dHash, wHash, colour)
+DHASH_THRESHOLD = 16  # Max Hamming distance for dHash to agree
+WHASH_THRESHOLD = 14  # Max Hamming distance for wHash to agree
+COLOR_MOMENT_THRESHOLD = 0.06  # Max mean absolute difference of colour moments to agree
+
+# ==================== FINGERPRINT STORAGE ====================
+# "binary": one memory-mappable FINGERPRINT_FILE with hashes + audio features
+# "legacy": metadata.json pointing at reference PNG/WAV files
+FINGERPRINT_FORMAT = "binary"
+
+# ==================== DENSE REFERENCE INDEX ====================
+DENSE_INDEX_FPS = 1.0  # Hash the original at this rate into the fingerprint (0 = off)
+DENSE_INDEX_MATCHING = True  # Look up recorded frames that miss their paired reference frame in the dense index
+DENSE_INDEX_MATCH_DISTANCE = 10  # Hamming distance of a dense-index match (stricter than IMAGE_HASH_THRESHOLD)
+DENSE_INDEX_MIN_INLIERS = 3  # Samples on one time line before dense-index matches count
+TIME_LINE_MIN_FRAMES = 3  # Frames a fitted time line must hold (any two frames fit one)
+TEMPORAL_MATCH_WINDOW = 1.5  # Seconds either side of each sample hashed into a reference strip (0 = off)
+TEMPORAL_STRIP_FPS = 4.0  # Strip frames per second; each recorded frame keeps its best match in the strip
+
+# ==================== AUDIO LANDMARKS ====================
+LANDMARK_INDEX = True  # Store spectral-peak landmarks of the whole reference audio in the fingerprint
+LANDMARK_SYNC = True  # Sync by landmark offset voting when the fingerprint has landmarks (anchors are the fallback)
+LANDMARK_FFT_SIZE = 512  # At SYNC_SAMPLE_RATE
+LANDMARK_HOP = 256  # 32 ms frames at SYNC_SAMPLE_RATE
+LANDMARK_PEAKS_PER_SECOND = 20
+LANDMARK_FAN_OUT = 5  # Later peaks each peak is paired with
+LANDMARK_MAX_DT = 63  # Max frames between paired peaks (6 bits of the hash)
+LANDMARK_MAX_HITS = 200  # Ignore hashes that occur more often than this in the reference
+LANDMARK_MIN_VOTES = 20  # Votes the winning offset needs to be trusted
+
+# ==================== AUDIO DESCRIPTORS ====================
+AUDIO_DESCRIPTORS = True  # Compare audio by compact block descriptors instead of full mel spectrograms
+DESCRIPTOR_SAMPLE_RATE = SYNC_SAMPLE_RATE  # Reference descriptors come from the decoded-once sync track
+DESCRIPTOR_BANDS = 32  # Mel bands per block
+DESCRIPTOR_FMIN = 50
+DESCRIPTOR_FMAX = 3800  # Below Nyquist of DESCRIPTOR_SAMPLE_RATE, so every sample rate sees the same bands
+DESCRIPTOR_FRAME = 0.064  # STFT window (seconds)
+DESCRIPTOR_HOP = 0.032
+DESCRIPTOR_BLOCK = 0.5  # Seconds averaged into one descriptor row
+DESCRIPTOR_CHUNK = 10.0  # Seconds of audio processed at a time
+AUDIO_PROGRESSIVE = True  # Score growing prefixes of each recorded clip and stop once the result is clear
+AUDIO_PROGRESSIVE_STAGES = [5, 20, 60]  # Prefix lengths in seconds (the full clip follows)
+AUDIO_PROGRESSIVE_MARGIN = 0.2  # Distance from AUDIO_SIMILARITY_THRESHOLD that ends a clip early
+AUDIO_PROGRESSIVE_MIN_ACTIVE = 4.0  # Audible reference seconds a prefix needs before a low score ends a clip early
+AUDIO_PROGRESSIVE_QUIET_DB = 20.0  # Reference blocks this far below the clip's median level count as quiet
+
+# ==================== MULTI-TITLE CATALOG ====================
+USE_CATALOG = False  # Identify the title among all catalog fingerprints before comparing
+CATALOG_DIR = os.path.join(OUTPUT_DIR, "catalog")
+CATALOG_BAND_BITS = 16  # Multi-index band width over the 64-bit frame hash (must divide 64)
+CATALOG_PROBE_FRAMES = 24  # Suspect frames hashed for identification
+CATALOG_MATCH_DISTANCE = 10  # Max Hamming distance for a frame to vote for a title (each band is searched to distance // bands)
+CATALOG_TOP_K = 3  # Titles that go on to the full comparison
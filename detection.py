@@ -0,0 +1,332 @@
+"""
+Detection Module
+Runs Phases 2-3 on a recorded video as a cascade: cheap tiers (container
+metadata, a few frame hashes against the dense reference index) first, then
+the full pipeline over every sample, or adaptively, drawing a few samples at a
+time until a sequential probability ratio test settles the verdict
+"""
+
+import math
+import time
+import json
+import random
+import hashlib
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import config
+import utils
+import hashing
+import hash_index
+import fingerprint
+import audio_landmarks
+import video_source
+import recorded_extractor
+import comparator
+
+
+def sprt_bounds() -> Tuple[float, float]:
+    """
+    Wald's stopping bounds on the log-likelihood ratio
+
+    Returns:
+        Tuple of (clean bound, pirated bound) for SPRT_FALSE_POSITIVE / SPRT_FALSE_NEGATIVE
+    """
+    alpha, beta = config.SPRT_FALSE_POSITIVE, config.SPRT_FALSE_NEGATIVE
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def sequential_test(outcomes: List[bool]) -> Tuple[Optional[str], float, float]:
+    """
+    Sequential probability ratio test over per-sample match outcomes
+
+    Pirated uploads match each sample with probability SPRT_MATCH_RATE_PIRATED,
+    unrelated ones with SPRT_MATCH_RATE_CLEAN; every outcome moves the
+    log-likelihood ratio towards one of them until it crosses a bound.
+
+    Args:
+        outcomes: Per compared sample, in draw order, whether it supports
+                  piracy (see comparator.sample_evidence)
+
+    Returns:
+        Tuple of ("pirated", "clean" or None while undecided,
+        confidence in the leading hypothesis, log-likelihood ratio)
+    """
+    pirated, clean = config.SPRT_MATCH_RATE_PIRATED, config.SPRT_MATCH_RATE_CLEAN
+    llr = sum(
+        math.log(pirated / clean) if matched else math.log((1 - pirated) / (1 - clean))
+        for matched in outcomes
+    )
+
+    # Posterior of "pirated" with even prior odds
+    confidence = 1 / (1 + math.exp(-llr))
+    lower, upper = sprt_bounds()
+    decision = None
+    if len(outcomes) >= config.SPRT_MIN_SAMPLES:
+        if llr >= upper:
+            decision = "pirated"
+        elif llr <= lower:
+            decision = "clean"
+    return decision, max(confidence, 1 - confidence), llr
+
+
+def draw_order(metadata: Dict) -> List[int]:
+    """
+    Seeded random order to draw the reference samples in
+
+    The seed comes from the reference's sample timestamps, so every pass over
+    a growing download, and every copy of an upload, draws the same order.
+    """
+    if config.SAMPLING_SEED is not None:
+        seed = config.SAMPLING_SEED
+    else:
+        seed = int(hashlib.sha1(json.dumps(metadata["timestamps"]).encode()).hexdigest()[:16], 16)
+    order = [s["index"] for s in metadata["samples"]]
+    random.Random(seed).shuffle(order)
+    return order
+
+
+def detect_sequential(video_path: str, metadata: Dict, available_duration: Optional[float] = None) -> Optional[Dict]:
+    """
+    Extract and compare SPRT_BATCH samples at a time, stopping once the sequential test decides
+
+    Obvious piracy and obvious non-matches stop after a few samples; ambiguous
+    uploads keep drawing up to every reference sample. Each sample's outcome
+    uses the same visual and audio evidence as the decision rules, and the test
+    only stops early when those rules agree with it; the verdict itself comes
+    from the decision rules over the samples that were compared.
+
+    Args:
+        video_path: Path to the recorded video
+        metadata: Metadata from reference extraction
+        available_duration: Readable seconds of a file that is still downloading
+
+    Returns:
+        Results dictionary (with a "sequential" summary), or None if no sample could be extracted
+    """
+    order = draw_order(metadata)
+    print(f"\n🎯 Sequential sampling: {config.SPRT_BATCH} samples at a time, up to {len(order)}")
+
+    time_map = None
+    recorded_samples = []
+    sample_results = []
+    decision, confidence, llr = None, 0.5, 0.0
+
+    for start in range(0, len(order), config.SPRT_BATCH):
+        batch = set(order[start:start + config.SPRT_BATCH])
+        metadata = recorded_extractor.extract_recorded_data(video_path, metadata, available_duration,
+                                                            time_map=time_map, sample_indexes=batch)
+        time_map = metadata["time_map"]
+        if not metadata["recorded_samples"]:
+            continue  # Every sample of this batch falls outside the recorded video
+        recorded_samples.extend(metadata["recorded_samples"])
+        sample_results.extend(comparator.compare_samples(metadata))
+
+        decision, confidence, llr = sequential_test([comparator.sample_evidence(r) for r in sample_results])
+        print(f"\n📈 SPRT after {len(sample_results)} samples: LLR {llr:+.2f} "
+              f"({decision or 'undecided'}, confidence {confidence:.3f})")
+        # Stop only when the decision rules reach the same verdict on the samples so far
+        if decision is not None:
+            if (decision == "pirated") == comparator.evaluate(sample_results)["is_pirated"]:
+                break
+            print("  ⚠ Decision rules disagree with the sequential test, drawing more samples")
+            decision = None
+
+    metadata["recorded_samples"] = recorded_samples
+    if not sample_results:
+        return None
+
+    results = comparator.decide(sample_results)
+    results["sequential"] = {
+        "decision": decision,
+        # Confidence is only reported for a sequential decision that matches the verdict
+        "confidence": confidence if decision is not None else None,
+        "llr": llr,
+        "samples_drawn": len(sample_results),
+        "samples_available": len(order)
+    }
+    return results
+
+
+def _tier_results(is_pirated: bool, reason: str, total: int = 0, matched: int = 0,
+                  distance: float = 999) -> Dict:
+    """Results for an upload decided by a cheap tier (audio is never compared there)"""
+    return {
+        "total_samples": total,
+        "image_match_count": matched,
+        "image_match_percentage": matched / total if total else 0,
+        "avg_image_distance": distance,
+        "avg_audio_similarity": 0.0,
+        "is_pirated": is_pirated,
+        "reason": reason,
+        "matched_timestamps": [],
+        "matched_audio_timestamps": []
+    }
+
+
+def metadata_tier(video_path: str, metadata: Dict, available_duration: Optional[float]) -> Tuple[Optional[Dict], str]:
+    """
+    Container metadata: uploads that can't be read or are too short to hold a sample
+
+    Returns:
+        Tuple of (results if this tier decides, else None; reason)
+    """
+    duration = available_duration if available_duration is not None else utils.get_video_duration(video_path)
+    if duration is None:
+        return _tier_results(False, "Upload has no readable video stream"), "no readable video stream"
+    if duration < config.CASCADE_MIN_DURATION:
+        reason = f"Upload is {duration:.1f}s long (minimum {config.CASCADE_MIN_DURATION:.0f}s)"
+        return _tier_results(False, reason), "too short"
+    return None, f"{duration:.0f}s of video"
+
+
+def audio_probe(video_path: str, fp, duration: float) -> Optional[bool]:
+    """
+    Whether a few short upload clips align with the reference audio
+
+    Each clip is decoded on its own (no whole-track decode, no sync) and its
+    landmarks vote against the reference landmark index; one window with
+    SYNC_MAP_MIN_VOTES votes is enough.
+
+    Returns:
+        True or False, or None when there is no evidence either way (no landmark
+        index in the fingerprint, or no readable upload audio)
+    """
+    index = audio_landmarks.load_landmark_index(fp)
+    if index is None:
+        return None
+    window = min(config.SYNC_MAP_WINDOW, duration)
+    starts = np.linspace(0, duration - window, config.CASCADE_AUDIO_PROBES + 2)[1:-1]
+    heard = False
+    for start in starts:
+        audio = utils.decode_audio_segment(video_path, float(start), window)
+        if audio is None or len(audio) < config.LANDMARK_FFT_SIZE:
+            continue
+        heard = True
+        match = index.match(*audio_landmarks.clip_landmarks(audio))
+        if match is not None and match[1] >= config.SYNC_MAP_MIN_VOTES:
+            return True
+    return False if heard else None
+
+
+def frames_tier(video_path: str, metadata: Dict, available_duration: Optional[float]) -> Tuple[Optional[Dict], str]:
+    """
+    A few upload frames looked up in the dense reference index
+
+    Most frames on one time line with close matches decide a copy on their
+    own; a looser line fit only does when REQUIRE_AUDIO_CONFIRMATION is off
+    or the upload has no audio track to confirm it with.
+    No close match at all decides an unrelated upload, as long as a few short
+    audio clips don't match the reference landmarks either (degraded copies
+    can miss every frame). Anything else escalates.
+
+    Returns:
+        Tuple of (results if this tier decides, else None; reason)
+    """
+    fp = fingerprint.load_fingerprint(metadata["fingerprint"]) if metadata.get("fingerprint") else None
+    index = hash_index.load_dense_index(fp) if fp is not None else None
+    if index is None:
+        return None, "skipped (no dense reference index)"
+
+    duration = available_duration if available_duration is not None else utils.get_video_duration(video_path)
+    if duration is None:
+        return None, "no readable duration"
+    probes = list(np.linspace(duration * 0.05, duration * 0.95, config.CASCADE_PROBE_FRAMES))
+    rec_times, candidates, distances = [], [], []
+    for probe_time, probe_hash in zip(probes, hashing.hash_video_frames(video_path, probes)):
+        if probe_hash is None:
+            continue
+        matches = index.within(int(probe_hash, 16), config.CASCADE_MATCH_DISTANCE)
+        rec_times.append(probe_time)
+        candidates.append([ref_time for _, ref_time in matches[:config.CASCADE_MAX_CANDIDATES]])
+        distances.append(matches[0][0] if matches else None)
+    if not rec_times:
+        return None, "no frame could be hashed"
+
+    hashed = len(rec_times)
+    close = [d for d in distances if d is not None]
+    on_line, rate, _ = hash_index.fit_time_line(rec_times, candidates, config.CASCADE_TIME_TOLERANCE)
+    inliers = sum(on_line)
+    line_distance = float(np.mean([d for d, line in zip(distances, on_line) if line])) if inliers else 999
+    summary = f"{len(close)} / {hashed} frames close to the reference, {inliers} on one time line"
+    if rate is not None and inliers >= max(config.CASCADE_MIN_INLIERS, config.CASCADE_COPY_FRACTION * hashed):
+        strong = line_distance <= config.CASCADE_STRONG_DISTANCE
+        muted = not utils.has_audio(video_path)
+        if not strong and config.REQUIRE_AUDIO_CONFIRMATION and not muted:
+            return None, f"{summary} (mean distance {line_distance:.1f}); audio confirmation required"
+        reason = (f"Frame probe: {inliers} / {hashed} frames on one time line (rate {rate:.3f}, "
+                  f"mean distance {line_distance:.1f}); {'upload has no audio' if muted else 'audio not checked'}")
+        return _tier_results(True, reason, hashed, inliers, line_distance), summary
+    if not close:
+        heard = audio_probe(video_path, fp, duration)
+        if heard is None:
+            return None, f"{summary}; no audio evidence"
+        if heard:
+            return None, f"{summary}; audio matches the reference"
+        reason = f"Frame probe: none of {hashed} frames is close to any reference frame and the audio doesn't match"
+        return _tier_results(False, reason, hashed, 0), f"{summary}; audio doesn't match"
+    return None, summary
+
+
+def full_tier(video_path: str, metadata: Dict, available_duration: Optional[float]) -> Tuple[Optional[Dict], str]:
+    """
+    Audio sync, sample extraction, audio similarity and visual checks
+    (adaptively when ADAPTIVE_SAMPLING is on)
+
+    Returns:
+        Tuple of (results, or None if no recorded sample could be extracted; reason)
+    """
+    if config.ADAPTIVE_SAMPLING:
+        results = detect_sequential(video_path, metadata, available_duration)
+    else:
+        metadata = recorded_extractor.extract_recorded_data(video_path, metadata, available_duration)
+        results = comparator.compare_and_decide(metadata) if metadata["recorded_samples"] else None
+    return results, "no recorded samples" if results is None else f"{results['total_samples']} samples compared"
+
+
+# Cascade tiers by name (CASCADE_TIERS picks and orders them; "full" always ends the cascade)
+TIERS: Dict[str, Callable] = {
+    "metadata": metadata_tier,
+    "frames": frames_tier,
+    "full": full_tier
+}
+
+
+def detect(video_path: str, metadata: Dict, available_duration: Optional[float] = None) -> Optional[Dict]:
+    """
+    Run Phases 2-3 on a recorded video as a cascade, cheapest tier first
+
+    Each tier either decides the upload or escalates to the next; the time
+    and outcome of every tier that ran are recorded in results["cascade"].
+
+    Args:
+        video_path: Path to the recorded video
+        metadata: Metadata from reference extraction
+        available_duration: Readable seconds of a file that is still downloading
+
+    Returns:
+        Results dictionary, or None if no recorded sample could be extracted
+    """
+    names = [name for name in config.CASCADE_TIERS if name != "full"] if config.CASCADE else []
+    cascade = []
+    results = None
+    try:
+        for name in names + ["full"]:
+            start = time.time()
+            results, reason = TIERS[name](video_path, metadata, available_duration)
+            elapsed = time.time() - start
+            outcome = "exit" if results is not None else "escalate"
+            cascade.append({"tier": name, "seconds": round(elapsed, 3), "outcome": outcome, "reason": reason})
+            if names:
+                print(f"🪜 Tier {name}: {reason} ({elapsed:.2f}s) - {outcome.upper()}")
+            if results is not None:
+                break
+    finally:
+        # Sources stay open across tiers and sequential batches; the reference
+        # is only opened when sync had no stored anchors
+        video_source.close_video(video_path)
+        video_source.close_video(metadata["original_video"])
+
+    if results is not None:
+        results["cascade"] = cascade
+        results["exit_tier"] = cascade[-1]["tier"]
+    return results
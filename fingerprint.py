@@ -0,0 +1,159 @@
+"""
+Fingerprint Module
+Compact, versioned binary file holding everything detection needs from the
+original video (hashes, audio features, anchors), readable through np.memmap
+
+Layout:
+    magic (4 bytes) | version (uint16) | reserved (uint16) | header length (uint32)
+    JSON header (describes every array) | arrays, each aligned to ALIGNMENT bytes
+"""
+
+import os
+import json
+import struct
+from typing import Dict, Optional
+import numpy as np
+import utils
+
+
+MAGIC = b"MPFP"
+VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<4sHHI")
+
+
+class Fingerprint:
+    """A loaded fingerprint: JSON info plus read-only memory-mapped arrays"""
+
+    def __init__(self, path: str, info: Dict, arrays: Dict[str, np.ndarray]):
+        self.path = path
+        self.info = info
+        self.arrays = arrays
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.arrays
+
+    def get(self, name: str, default=None):
+        return self.arrays.get(name, default)
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_fingerprint(path: str, info: Dict, arrays: Dict[str, np.ndarray]) -> None:
+    """
+    Write a fingerprint file
+
+    Args:
+        path: Output path
+        info: JSON-serialisable description (title, source video, duration, ...)
+        arrays: Named numpy arrays to store
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # Offsets depend on the header length, which depends on the offsets: iterate until stable
+    header_len = 0
+    while True:
+        offset = _align(_PREAMBLE.size + header_len)
+        layout = {}
+        for name, array in arrays.items():
+            layout[name] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset
+            }
+            offset = _align(offset + array.nbytes)
+        header = json.dumps({"info": info, "arrays": layout}).encode("utf-8")
+        if len(header) == header_len:
+            break
+        header_len = len(header)
+
+    utils.ensure_directory(os.path.dirname(path) or ".")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, 0, header_len))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(layout[name]["offset"])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_fingerprint(path: str) -> Fingerprint:
+    """
+    Open a fingerprint file; arrays are memory-mapped read-only, so loading is
+    essentially free and the pages are shared between worker processes
+
+    Raises:
+        ValueError: If the file is not a fingerprint or has an unsupported version
+    """
+    with open(path, "rb") as f:
+        magic, version, _, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a fingerprint file: {path}")
+        if version > VERSION:
+            raise ValueError(f"Unsupported fingerprint version {version} (max {VERSION}): {path}")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        shape = tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=np.dtype(spec["dtype"]))
+        else:
+            arrays[name] = np.memmap(path, dtype=np.dtype(spec["dtype"]), mode="r",
+                                     offset=spec["offset"], shape=shape)
+    return Fingerprint(path, header["info"], arrays)
+
+
+def hex_to_uint64(hex_hash: Optional[str]) -> int:
+    """Pack a 64-bit hex hash into an integer (0 for missing hashes)"""
+    return int(hex_hash, 16) if hex_hash else 0
+
+
+def uint64_to_hex(value: int) -> str:
+    """Unpack an integer hash back into imagehash's hex format"""
+    return f"{int(value):016x}"
+
+
+def to_metadata(fp: Fingerprint) -> Dict:
+    """
+    Rebuild the metadata dict the extractors and comparator work with
+
+    Samples carry their pHash and refer to the fingerprint for audio features,
+    so no reference media files are needed.
+    """
+    info = fp.info
+    valid = fp["sample_valid"]
+    samples = []
+    for i, timestamp in enumerate(fp["timestamps"]):
+        if not valid[i]:
+            continue
+        samples.append({
+            "index": i,
+            "timestamp": float(timestamp),
+            "screenshot": None,
+            "phash": uint64_to_hex(fp["phashes"][i]),
+            "audio": None
+        })
+        if "bank_valid" in fp and fp["bank_valid"][i]:
+            samples[-1]["bank"] = {
+                "dhash": uint64_to_hex(fp["dhashes"][i]),
+                "whash": uint64_to_hex(fp["whashes"][i]),
+                "color": [float(v) for v in fp["color_moments"][i]]
+            }
+
+    return {
+        "original_video": info["original_video"],
+        "duration": info["duration"],
+        "timestamps": [float(t) for t in fp["timestamps"]],
+        "audio_duration": info["audio_duration"],
+        "samples": samples,
+        "anchors": [{"timestamp": float(t), "path": None} for t in fp["anchor_times"]],
+        "sync_anchors": [{"timestamp": float(t), "path": None} for t in fp.get("sync_anchor_times", [])],
+        "fingerprint": fp.path
+    }
@@ -0,0 +1,174 @@
+"""
+Hash Index Module
+BK-tree over 64-bit perceptual hashes for radius lookups in
+Hamming space, used to find where a recorded frame appears in the original
+"""
+
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import config
+
+
+# Set bits in every byte value, for vectorized popcounts
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Time line proposals closer than this (rate; offset as a fraction of the tolerance) are scored once
+_RATE_STEP = 1e-4
+_OFFSET_STEP = 0.1
+# Proposals scored per array pass (bounds the proposals x matches array)
+_PROPOSAL_BLOCK = 4096
+
+
+def hamming(a: int, b: int) -> int:
+    """Hamming distance between two integer hashes"""
+    return bin(a ^ b).count("1")
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Set bits of every element of a uint64 array (same shape)"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return _POPCOUNT8[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+
+def hamming_many(value: int, hashes: np.ndarray) -> np.ndarray:
+    """Hamming distances from one hash to an array of uint64 hashes"""
+    return popcount(np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(value)))
+
+
+def hamming_pairs(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Hamming distances between matching elements of two uint64 hash arrays"""
+    return popcount(np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64)))
+
+
+class HashIndex:
+    """
+    BK-tree of frame hashes and the reference times they were taken at
+
+    The triangle inequality lets a lookup skip every subtree whose edge
+    distance is outside [d - best, d + best], so only a small part of the
+    tree is visited for close matches.
+    """
+
+    def __init__(self, hashes: np.ndarray, times: np.ndarray):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.size = len(hashes)
+        # Node: [hash, [positions with this hash], {edge distance: child node}]
+        self._root = None
+        for position, value in enumerate(hashes):
+            self._add(int(value), position)
+
+    def _add(self, value: int, position: int) -> None:
+        if self._root is None:
+            self._root = [value, [position], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(position)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [position], {}]
+                return
+            node = child
+
+    def within(self, value: int, radius: int) -> List[Tuple[int, float]]:
+        """
+        All reference frames within radius of a hash
+
+        Returns:
+            List of (distance, reference time), closest first
+        """
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                matches.extend((distance, float(self.times[p])) for p in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return sorted(matches)
+
+
+# Indexes built from fingerprint files, keyed by path
+_indexes: Dict[str, HashIndex] = {}
+
+
+def load_dense_index(fp) -> Optional[HashIndex]:
+    """Build (once per fingerprint file) the index over its dense reference hashes"""
+    if "dense_hashes" not in fp or len(fp["dense_hashes"]) == 0:
+        return None
+    if fp.path not in _indexes:
+        _indexes[fp.path] = HashIndex(fp["dense_hashes"], fp["dense_times"])
+    return _indexes[fp.path]
+
+
+def fit_time_line(rec_times: List[float], candidates: List[List[float]],
+                  tolerance: float) -> Tuple[List[bool], Optional[float], Optional[float]]:
+    """
+    Plausible time line ref = offset + rate * rec through the most frame matches
+
+    Every pair of candidate matches from two frames proposes a line; only rates
+    within SYNC_MIN_RATE..SYNC_MAX_RATE count, so a still image matching one
+    reference frame everywhere never forms a line. Near-identical proposals
+    are scored once, all of them against every match in one array pass. A
+    frame is on a line if any of its candidate reference times is within
+    tolerance of it, and a line needs TIME_LINE_MIN_FRAMES frames (any two
+    frames fit one).
+
+    Args:
+        rec_times: Upload time of each frame
+        candidates: Reference times matching each frame (may be empty)
+        tolerance: Seconds a match may be off the line
+
+    Returns:
+        Tuple of (whether each frame is on the best line, its rate, its offset;
+        rate and offset are None and no frame is on a line if no line is found)
+    """
+    refs = [np.asarray(c, dtype=np.float64) for c in candidates]
+    frames = [i for i, r in enumerate(refs) if len(r)]
+    no_line = [False] * len(rec_times), None, None
+
+    rates, offsets = [], []
+    for k, i in enumerate(frames):
+        for j in frames[k + 1:]:
+            if rec_times[j] == rec_times[i]:
+                continue
+            pair_rates = (refs[j][np.newaxis, :] - refs[i][:, np.newaxis]).ravel() / (rec_times[j] - rec_times[i])
+            rates.append(pair_rates)
+            offsets.append(np.repeat(refs[i], len(refs[j])) - pair_rates * rec_times[i])
+    if not rates:
+        return no_line
+    rates, offsets = np.concatenate(rates), np.concatenate(offsets)
+    plausible = (rates >= config.SYNC_MIN_RATE) & (rates <= config.SYNC_MAX_RATE)
+    rates, offsets = rates[plausible], offsets[plausible]
+    if len(rates) == 0:
+        return no_line
+
+    # Repetitive footage proposes the same line from many pairs: keep the first of each
+    steps = np.round(np.stack([rates / _RATE_STEP, offsets / (tolerance * _OFFSET_STEP)], axis=1))
+    _, first = np.unique(steps, axis=0, return_index=True)
+    first = np.sort(first)
+    rates, offsets = rates[first], offsets[first]
+
+    # Every match flattened, grouped by frame, against each proposal
+    match_times = np.concatenate([refs[i] for i in frames])
+    match_rec = np.concatenate([np.full(len(refs[i]), rec_times[i], dtype=np.float64) for i in frames])
+    starts = np.cumsum([0] + [len(refs[i]) for i in frames[:-1]])
+    counts = np.empty(len(rates), dtype=np.int64)
+    for block in range(0, len(rates), _PROPOSAL_BLOCK):
+        r = rates[block:block + _PROPOSAL_BLOCK, np.newaxis]
+        o = offsets[block:block + _PROPOSAL_BLOCK, np.newaxis]
+        close = np.abs(o + r * match_rec - match_times) <= tolerance
+        counts[block:block + _PROPOSAL_BLOCK] = np.logical_or.reduceat(close, starts, axis=1).sum(axis=1)
+
+    best = int(np.argmax(counts))
+    if counts[best] < config.TIME_LINE_MIN_FRAMES:
+        return no_line
+    rate, offset = float(rates[best]), float(offsets[best])
+    on_line = [bool(len(r) and np.any(np.abs(offset + rate * t - r) <= tolerance)) for t, r in zip(rec_times, refs)]
+    return on_line, rate, offset
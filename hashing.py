@@ -0,0 +1,293 @@
+"""
+Perceptual Hashing Module
+Computes image hashes directly from decoded frame buffers (no image files)
+"""
+
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import scipy.fft
+from PIL import Image
+import config
+import video_source
+import artifact_cache
+
+
+def _bits_to_uint64(bits: np.ndarray) -> np.ndarray:
+    """Pack (N, 64) bools into uint64, first bit most significant (as in the hex form)"""
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def phash_batch(frames: np.ndarray) -> np.ndarray:
+    """
+    Compute the pHashes of a stack of downscaled grayscale frames at once
+
+    Uses the same DCT / median rule as imagehash.phash (one 2-D DCT over the
+    whole stack), but starts from the buffers FFmpeg already produced instead
+    of resizing PIL images.
+
+    Args:
+        frames: (N, H, W) uint8 grayscale frames, normally HASH_FRAME_SIZE square
+
+    Returns:
+        (N,) uint64 hashes, bit-for-bit the same as int(str(imagehash.phash(...)), 16)
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    if len(frames) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    dct_low = scipy.fft.dctn(frames, axes=(1, 2))[:, :8, :8].reshape(len(frames), 64)
+    return _bits_to_uint64(dct_low > np.median(dct_low, axis=1, keepdims=True))
+
+
+def _area_matrix(n_out: int, n_in: int) -> np.ndarray:
+    """(n_out, n_in) weights that average each output cell's share of the input (box resize)"""
+    edges = np.linspace(0, n_in, n_out + 1)
+    starts, ends = edges[:-1, np.newaxis], edges[1:, np.newaxis]
+    pixels = np.arange(n_in)[np.newaxis, :]
+    overlap = np.clip(np.minimum(ends, pixels + 1) - np.maximum(starts, pixels), 0, None)
+    return overlap / overlap.sum(axis=1, keepdims=True)
+
+
+def luma(frames: np.ndarray) -> np.ndarray:
+    """Gray levels of (N, H, W, 3) RGB frames, rounded like PIL's convert('L')"""
+    rgb = np.asarray(frames, dtype=np.uint32)
+    return ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+
+
+def dhash_batch(frames: np.ndarray) -> np.ndarray:
+    """
+    Difference hashes of (N, H, W) gray frames: 9x8 box-area thumbnail, left < right
+
+    The thumbnail is a box average, not imagehash's resize, so these hashes are
+    not interchangeable with imagehash.dhash: only compare them with hashes
+    made here.
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    if len(frames) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    small = _area_matrix(8, frames.shape[1]) @ frames @ _area_matrix(9, frames.shape[2]).T
+    return _bits_to_uint64((small[:, :, 1:] > small[:, :, :-1]).reshape(len(frames), 64))
+
+
+def whash_batch(frames: np.ndarray) -> np.ndarray:
+    """Wavelet hashes of (N, H, W) gray frames: Haar low band at 8x8 against its median"""
+    frames = np.asarray(frames, dtype=np.float64)
+    if len(frames) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    # Repeated Haar averaging down to 8x8 is a box average over equal blocks
+    low = (_area_matrix(8, frames.shape[1]) @ frames @ _area_matrix(8, frames.shape[2]).T).reshape(len(frames), 64)
+    return _bits_to_uint64(low > np.median(low, axis=1, keepdims=True))
+
+
+def color_moments(frames: np.ndarray) -> np.ndarray:
+    """(N, 9) mean, std and cube-rooted skew of each RGB channel, scaled to [0, 1]"""
+    pixels = np.asarray(frames, dtype=np.float64).reshape(len(frames), -1, 3) / 255.0
+    mean = pixels.mean(axis=1)
+    centered = pixels - mean[:, np.newaxis, :]
+    std = np.sqrt((centered ** 2).mean(axis=1))
+    skew = np.cbrt((centered ** 3).mean(axis=1))
+    return np.concatenate([mean, std, skew], axis=1).astype(np.float32)
+
+
+def hash_bank(frames: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Every hash of the bank from one stack of small RGB frames
+
+    Args:
+        frames: (N, H, W, 3) uint8 RGB frames, normally HASH_FRAME_SIZE square
+
+    Returns:
+        Dict of "phash", "dhash", "whash" ((N,) uint64) and "color" ((N, 9) float32)
+    """
+    gray = luma(frames)
+    return {
+        "phash": phash_batch(gray),
+        "dhash": dhash_batch(gray),
+        "whash": whash_batch(gray),
+        "color": color_moments(frames)
+    }
+
+
+def _load_hash_frame(image_path: str) -> np.ndarray:
+    """Screenshot normalized to 512x512 (LANCZOS) grayscale, at pHash size"""
+    img = Image.open(image_path)
+    img = img.resize((512, 512), Image.Resampling.LANCZOS).convert('L')
+    return np.asarray(img.resize((32, 32), Image.Resampling.LANCZOS))
+
+
+def phash_files(image_paths: List[str]) -> List[Optional[int]]:
+    """
+    Hash several screenshot files with one batched DCT
+
+    Returns:
+        Integer pHash per file (None if the file couldn't be read)
+    """
+    frames, hashes = [], []
+    for path in image_paths:
+        try:
+            frames.append(_load_hash_frame(path))
+            hashes.append(len(frames) - 1)
+        except (OSError, ValueError):
+            hashes.append(None)
+    values = phash_batch(np.stack(frames)) if frames else []
+    return [int(values[i]) if i is not None else None for i in hashes]
+
+
+def hash_video_bank(video_path: str, timestamps: List[float]) -> List[Optional[Dict]]:
+    """
+    Hash bank of frames at several timestamps, each decoded once as a small RGB buffer
+
+    Args:
+        video_path: Path to the video file
+        timestamps: Times in seconds
+
+    Returns:
+        List with a dict of hex "phash", "dhash", "whash" and a "color" moments list
+        (or None if the frame failed) per timestamp
+    """
+    def compute():
+        frames = video_source.open_video(video_path).frames_at(timestamps, color=True)
+        decoded = [i for i, frame in enumerate(frames) if frame is not None]
+        banks = [None] * len(frames)
+        if decoded:
+            bank = hash_bank(np.stack([frames[i] for i in decoded]))
+            for k, i in enumerate(decoded):
+                banks[i] = {
+                    "phash": f"{int(bank['phash'][k]):016x}",
+                    "dhash": f"{int(bank['dhash'][k]):016x}",
+                    "whash": f"{int(bank['whash'][k]):016x}",
+                    "color": [round(float(v), 5) for v in bank["color"][k]]
+                }
+        return banks
+
+    params = {"timestamps": list(timestamps), "size": config.HASH_FRAME_SIZE,
+              "crop": video_source.open_video(video_path).crop}
+    return artifact_cache.cached_json("bank", [video_path], params, compute)
+
+
+def hash_video_frames(video_path: str, timestamps: List[float]) -> List[Optional[str]]:
+    """
+    Hash frames at several timestamps straight from decoded gray buffers
+    (from the hash bank when HASH_BANK is set, so every hash shares one decode)
+
+    Args:
+        video_path: Path to the video file
+        timestamps: Times in seconds
+
+    Returns:
+        List with a hex pHash (or None if the frame failed) per timestamp
+    """
+    if config.HASH_BANK:
+        return [bank["phash"] if bank is not None else None for bank in hash_video_bank(video_path, timestamps)]
+
+    def compute():
+        frames = video_source.open_video(video_path).frames_at(timestamps)
+        decoded = [i for i, frame in enumerate(frames) if frame is not None]
+        hashes = [None] * len(frames)
+        if decoded:
+            for i, value in zip(decoded, phash_batch(np.stack([frames[i] for i in decoded]))):
+                hashes[i] = f"{int(value):016x}"
+        return hashes
+
+    params = {"timestamps": list(timestamps), "size": config.HASH_FRAME_SIZE,
+              "crop": video_source.open_video(video_path).crop}
+    return artifact_cache.cached_json("phashes", [video_path], params, compute)
+
+
+def strip_offsets() -> np.ndarray:
+    """Offsets (s) of the reference strip frames around each sample, 0 included"""
+    steps = int(config.TEMPORAL_MATCH_WINDOW * config.TEMPORAL_STRIP_FPS)
+    return np.round(np.arange(-steps, steps + 1) / config.TEMPORAL_STRIP_FPS, 3)
+
+
+def hash_strips(video_path: str, timestamps: List[float],
+                duration: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Hash a short strip of frames around each timestamp, so a recorded frame
+    can be matched to its best neighbour when sync is slightly off
+
+    Args:
+        video_path: Path to the video file
+        timestamps: Sample times in seconds
+        duration: Video duration (strip frames outside it are skipped)
+
+    Returns:
+        Tuple of ((M,) offsets, (N, M) uint64 hashes, (N, M) uint8 valid flags)
+    """
+    offsets = strip_offsets()
+    times = np.asarray(timestamps, dtype=np.float64)[:, np.newaxis] + offsets[np.newaxis, :]
+    inside = (times >= 0) & ((times < duration) if duration else True)
+    hashes = hash_video_frames(video_path, [round(float(t), 3) for t in times[inside]])
+
+    values = np.zeros(times.shape, dtype=np.uint64)
+    valid = np.zeros(times.shape, dtype=np.uint8)
+    values[inside] = [int(h, 16) if h is not None else 0 for h in hashes]
+    valid[inside] = [h is not None for h in hashes]
+    return offsets, values, valid
+
+
+def extract_sample_frames(video_path: str, timestamps: List[float], screenshot_paths: List[str],
+                          hash_at_decode: Optional[bool] = None
+                          ) -> Tuple[List[bool], List[Optional[str]], List[Optional[str]], List[Optional[Dict]]]:
+    """
+    Extract the frames of all samples in the configured mode
+
+    In hash-at-decode mode frames are hashed from decoded buffers and PNGs are only
+    written when SAVE_EVIDENCE_FRAMES is set; otherwise screenshots are written
+    and hashed later by the comparator.
+
+    Args:
+        video_path: Path to the video file
+        timestamps: Times in seconds
+        screenshot_paths: Where screenshots go (if written)
+        hash_at_decode: Override config.HASH_AT_DECODE
+
+    Returns:
+        Tuple of (success flags, hex pHashes or None, screenshot paths or None,
+        sample hash banks without the pHash or None)
+    """
+    if hash_at_decode is None:
+        hash_at_decode = config.HASH_AT_DECODE
+    
+    if hash_at_decode:
+        if config.HASH_BANK:
+            banks = hash_video_bank(video_path, timestamps)
+            phashes = [bank["phash"] if bank is not None else None for bank in banks]
+            banks = [{k: v for k, v in bank.items() if k != "phash"} if bank is not None else None for bank in banks]
+        else:
+            phashes = hash_video_frames(video_path, timestamps)
+            banks = [None] * len(timestamps)
+        if config.SAVE_EVIDENCE_FRAMES:
+            video_source.open_video(video_path).screenshots_at(timestamps, screenshot_paths)
+        else:
+            screenshot_paths = [None] * len(timestamps)
+        return [h is not None for h in phashes], phashes, screenshot_paths, banks
+
+    screenshot_ok = video_source.open_video(video_path).screenshots_at(timestamps, screenshot_paths)
+    return screenshot_ok, [None] * len(timestamps), screenshot_paths, [None] * len(timestamps)
+
+
+def hash_video_at_rate(video_path: str, fps: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hash the whole video at a fixed frame rate (dense reference index)
+
+    Args:
+        video_path: Path to the video file
+        fps: Hashes per second of video
+
+    Returns:
+        Tuple of ((N,) float64 times, (N,) uint64 hashes); empty if decoding failed
+    """
+    def compute():
+        frames = video_source.open_video(video_path).frames_at_rate(fps)
+        if frames is None:
+            return None
+        return {
+            "times": np.arange(len(frames), dtype=np.float64) / fps,
+            "hashes": phash_batch(frames)
+        }
+
+    params = {"fps": fps, "size": config.HASH_FRAME_SIZE, "crop": video_source.open_video(video_path).crop}
+    dense = artifact_cache.cached_arrays("dense", [video_path], params, compute)
+    if dense is None:
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.uint64)
+    return dense["times"], dense["hashes"]
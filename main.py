@@ -8,8 +8,9 @@ import sys
 import config
 import utils
 from reference_extractor import extract_reference_data
-from recorded_extractor import extract_recorded_data
-from comparator import compare_and_decide
+from recorded_extractor import load_metadata
+from detection import detect
+import catalog
 
 
 def print_banner():
@@ -28,9 +29,19 @@ def print_result(results: dict):
         print("✅ RESULT: NOT PIRATED")
     print("="*50)
     print(f"\nReason: {results['reason']}")
+    sequential = results.get("sequential")
+    if sequential and sequential["decision"]:
+        print(f"Confidence: {sequential['confidence']:.3f} after {sequential['samples_drawn']} of {sequential['samples_available']} samples")
     print()
 
 
+def has_stored_reference():
+    """Check if a previous Phase 1 left a reference that detection can run from"""
+    if config.FINGERPRINT_FORMAT == "binary":
+        return os.path.exists(config.FINGERPRINT_FILE)
+    return os.path.exists(config.METADATA_FILE)
+
+
 def check_prerequisites():
     """Check if all prerequisites are met"""
     # Check FFmpeg
@@ -39,8 +50,8 @@ def check_prerequisites():
         print("   Please install FFmpeg: https://ffmpeg.org/download.html")
         return False
     
-    # Check if video files exist
-    if not os.path.exists(config.ORIGINAL_VIDEO):
+    # Check if video files exist (the catalog and stored references don't need the original)
+    if not config.USE_CATALOG and not os.path.exists(config.ORIGINAL_VIDEO) and not has_stored_reference():
         print(f"❌ Error: Original video not found: {config.ORIGINAL_VIDEO}")
         return False
     
@@ -63,22 +74,27 @@ def main():
         # Create output directory
         utils.ensure_directory(config.OUTPUT_DIR)
         
-        # Phase 1: Extract reference data from original video
-        metadata = extract_reference_data(config.ORIGINAL_VIDEO)
-        
-        if not metadata["samples"]:
-            print("❌ Error: No reference samples were extracted")
-            sys.exit(1)
-        
-        # Phase 2: Extract data from recorded video
-        metadata = extract_recorded_data(config.RECORDED_VIDEO, metadata)
-        
-        if not metadata["recorded_samples"]:
-            print("❌ Error: No recorded samples were extracted")
-            sys.exit(1)
-        
-        # Phase 3: Compare and decide
-        results = compare_and_decide(metadata)
+        if config.USE_CATALOG:
+            # Identify the title among the catalog, then run Phases 2-3 against it
+            results = catalog.detect_title(config.RECORDED_VIDEO)
+        else:
+            # Phase 1: Extract reference data from original video
+            if os.path.exists(config.ORIGINAL_VIDEO):
+                metadata = extract_reference_data(config.ORIGINAL_VIDEO)
+            else:
+                print("ℹ Original video not available, using the stored reference")
+                metadata = load_metadata()
+            
+            if not metadata["samples"]:
+                print("❌ Error: No reference samples were extracted")
+                sys.exit(1)
+            
+            # Phases 2-3: Extract data from recorded video, compare and decide
+            results = detect(config.RECORDED_VIDEO, metadata)
+            
+            if results is None:
+                print("❌ Error: No recorded samples were extracted")
+                sys.exit(1)
         
         # Print final result
         print_result(results)
@@ -97,6 +113,14 @@ def main():
             "is_pirated": bool(results["is_pirated"]),
             "reason": str(results["reason"])
         }
+        if "sequential" in results:
+            json_results["sequential"] = results["sequential"]
+        if "cascade" in results:
+            json_results["cascade"] = results["cascade"]
+            json_results["exit_tier"] = results["exit_tier"]
+        if "title_id" in results:
+            json_results["title_id"] = results["title_id"]
+            json_results["title_name"] = results["title_name"]
         
         with open(results_file, 'w') as f:
             json.dump(json_results, f, indent=2)
@@ -5,27 +5,66 @@ Extracts screenshots and audio clips from the recorded video at the same timesta
 
 import os
 import json
-from typing import Dict
+from functools import partial
+from typing import Dict, List, Optional
 import config
 import utils
+import hashing
+import video_source
+import fingerprint
+import audio_landmarks
 
 
-def extract_recorded_data(video_path: str, metadata: Dict) -> Dict:
+def sync_recorded_audio(video_path: str, metadata: Dict) -> Dict:
+    """
+    Align the recorded video's audio with the reference
+    
+    Args:
+        video_path: Path to the recorded video
+        metadata: Metadata from reference extraction (anchors, fingerprint)
+        
+    Returns:
+        Time map dict (see audio_sync.fit_time_map); no inliers means no alignment was found
+    """
+    import audio_sync
+    # Pass extracted anchors (and the landmark index, if the fingerprint has one) from metadata
+    ref_anchors = metadata.get("anchors", [])
+    fp = fingerprint.load_fingerprint(metadata["fingerprint"]) if metadata.get("fingerprint") else None
+    landmark_index = audio_landmarks.load_landmark_index(fp) if fp is not None else None
+    # Anchor audio stored with the reference, so the original video is never opened here
+    anchor_clips = audio_sync.reference_anchor_clips(metadata, fp) if config.SYNC_FROM_STORED_ANCHORS else None
+    return audio_sync.estimate_time_map(metadata["original_video"], video_path, anchors=ref_anchors,
+                                        landmark_index=landmark_index, anchor_clips=anchor_clips)
+
+
+def extract_recorded_data(video_path: str, metadata: Dict, available_duration: Optional[float] = None,
+                          time_map: Optional[Dict] = None, sample_indexes: Optional[List[int]] = None) -> Dict:
     """
     Extract screenshots and audio clips from recorded video using reference timestamps
     
+    The recorded video (and the reference, when sync had no stored anchors) stays
+    open for later batches; the caller closes them with video_source.close_video.
+    
     Args:
         video_path: Path to the recorded video
         metadata: Metadata from reference extraction (contains timestamps)
+        available_duration: For a file that is still downloading, how many seconds
+                            of it are readable; samples past that point are skipped
+        time_map: Time map from an earlier call on the same video (skips audio sync)
+        sample_indexes: Only extract these samples (None = all of them)
         
     Returns:
         Updated metadata with recorded video information
     """
-    print(f"\nPhase 2: Extracting from recorded video...")
-    print(f"📂 Loaded {video_path}")
+    if time_map is None:
+        print(f"\nPhase 2: Extracting from recorded video...")
+        print(f"📂 Loaded {video_path}")
+    
+    # Keep the video open for sync, frames and audio clips
+    source = video_source.open_video(video_path)
     
-    # Get recorded video duration
-    duration = utils.get_video_duration(video_path)
+    # Get recorded video duration (a partial file can't be probed reliably)
+    duration = available_duration if available_duration is not None else source.duration
     if duration is None:
         raise ValueError(f"Failed to get duration for {video_path}")
     
@@ -35,18 +74,22 @@ def extract_recorded_data(video_path: str, metadata: Dict) -> Dict:
     # NEW: Audio Sync
     # We need to find the offset of recorded video relative to reference
     # using the anchors in metadata['anchors'] or if not present, assume 0.
-    import audio_sync
-    # Pass extracted anchors from metadata
-    ref_anchors = metadata.get("anchors", [])
-    offset = audio_sync.get_consensus_offset(metadata["original_video"], video_path, anchors=ref_anchors)
-    
-    print(f"⏱ Applying Time Offset: {offset:.2f}s")
+    if time_map is None:
+        time_map = sync_recorded_audio(video_path, metadata)
+        print(f"⏱ Applying Time Map: offset {time_map['offset']:.2f}s, rate {time_map['rate']:.4f}")
+    offset, rate = time_map["offset"], time_map["rate"]
     
     # Extract at the same timestamps (Adjusted by offset)
     timestamps = metadata["timestamps"]
     recorded_samples = []
     
+    # Resolve every recorded timestamp first so screenshots can be batched
+    planned = []
+    
     for i, ref_timestamp in enumerate(timestamps):
+        if sample_indexes is not None and i not in sample_indexes:
+            continue
+        
         # Calculate where this timestamp is in the recorded video
         # Rec_Time = Ref_Time - Offset
         # e.g. If Ref is 100s, and Offset is 10s (Recorded starts at 10s of Ref),
@@ -55,8 +98,9 @@ def extract_recorded_data(video_path: str, metadata: Dict) -> Dict:
         # Correction: 
         # offset = anchor_time_ref - match_time_rec
         # So match_time_rec = anchor_time_ref - offset
-        # This formula holds generally.
-        rec_timestamp = ref_timestamp - offset
+        # With a playback speed change, ref_time = offset + rate * rec_time,
+        # so rec_time = (ref_time - offset) / rate (rate is 1 for normal speed).
+        rec_timestamp = (ref_timestamp - offset) / rate
         
         if rec_timestamp < 0:
             print(f"  ⚠ Timestamp {int(ref_timestamp)}s is before start of recorded video (rec_time={int(rec_timestamp)}s)")
@@ -67,49 +111,78 @@ def extract_recorded_data(video_path: str, metadata: Dict) -> Dict:
             print(f"  ⚠ Skipping timestamp {int(ref_timestamp)}s (rec_time={int(rec_timestamp)}s > duration)")
             continue
         
-        # Define output paths
-        screenshot_path = os.path.join(
-            config.RECORDED_DIR,
-            f"screenshot_{i:02d}.{config.SCREENSHOT_FORMAT}"
-        )
-        audio_path = os.path.join(
-            config.RECORDED_DIR,
-            f"audio_{i:02d}.{config.AUDIO_FORMAT}"
-        )
+        planned.append((i, ref_timestamp, rec_timestamp))
+    
+    screenshot_paths = [
+        os.path.join(config.RECORDED_DIR, f"screenshot_{i:02d}.{config.SCREENSHOT_FORMAT}")
+        for i, _, _ in planned
+    ]
+    
+    audio_paths = [
+        os.path.join(config.RECORDED_DIR, f"audio_{i:02d}.{config.AUDIO_FORMAT}")
+        for i, _, _ in planned
+    ]
+    
+    rec_timestamps = [rec_timestamp for _, _, rec_timestamp in planned]
+    
+    def extract_audio():
+        # Clips cover the same content as the reference clips (shorter when sped up);
+        # adjust clip duration if near end of video
+        return utils.run_parallel([
+            partial(source.write_audio, rec_timestamp,
+                    min(config.AUDIO_DURATION / rate, duration - rec_timestamp), audio_path)
+            for rec_timestamp, audio_path in zip(rec_timestamps, audio_paths)
+        ])
+    
+    # Frames and audio clips are extracted concurrently; results are reported in sample order
+    (screenshot_ok, phashes, screenshot_paths, banks), audio_ok = utils.run_parallel([
+        partial(hashing.extract_sample_frames, video_path, rec_timestamps, screenshot_paths),
+        extract_audio
+    ])
+    
+    for k, (i, ref_timestamp, rec_timestamp) in enumerate(planned):
+        screenshot_path = screenshot_paths[k]
+        audio_path = audio_paths[k]
         
-        # Extract screenshot
-        if utils.extract_screenshot(video_path, rec_timestamp, screenshot_path):
+        # Check screenshot
+        if screenshot_ok[k]:
             print(f"  ✓ Screenshot at {int(rec_timestamp)}s (Ref: {int(ref_timestamp)}s)")
         else:
             print(f"  ✗ Failed to extract screenshot at {int(rec_timestamp)}s")
             continue
         
-        # Extract audio clip (adjust duration if near end of video)
-        audio_duration = min(config.AUDIO_DURATION, duration - rec_timestamp)
-        if utils.extract_audio_clip(video_path, rec_timestamp, audio_duration, audio_path):
+        # Check audio clip (a sample without one is still scored on its frame)
+        if audio_ok[k]:
             print(f"  ✓ Audio clip at {int(rec_timestamp)}s")
         else:
-            print(f"  ✗ Failed to extract audio at {int(rec_timestamp)}s")
-            continue
+            print(f"  ⚠ No audio at {int(rec_timestamp)}s, keeping the frame only")
+            audio_path = None
         
         # Add to recorded samples
         recorded_samples.append({
             "index": i,
             "timestamp": rec_timestamp,
             "screenshot": screenshot_path,
+            "phash": phashes[k],
             "audio": audio_path
         })
+        if banks[k] is not None:
+            recorded_samples[-1]["bank"] = banks[k]
     
     # Update metadata with recorded video info
     metadata["recorded_video"] = video_path
     metadata["recorded_duration"] = duration
+    metadata["time_map"] = time_map
     metadata["recorded_samples"] = recorded_samples
     
     return metadata
 
 
 def load_metadata() -> Dict:
-    """Load metadata from JSON file"""
+    """Load reference metadata (from the binary fingerprint, or the legacy JSON file)"""
+    if config.FINGERPRINT_FORMAT == "binary" and os.path.exists(config.FINGERPRINT_FILE):
+        return fingerprint.to_metadata(fingerprint.load_fingerprint(config.FINGERPRINT_FILE))
+    
     if not os.path.exists(config.METADATA_FILE):
         raise FileNotFoundError(f"Metadata file not found: {config.METADATA_FILE}")
     
@@ -120,7 +193,11 @@ def load_metadata() -> Dict:
 if __name__ == "__main__":
     # For testing this module independently
     metadata = load_metadata()
-    metadata = extract_recorded_data(config.RECORDED_VIDEO, metadata)
+    try:
+        metadata = extract_recorded_data(config.RECORDED_VIDEO, metadata)
+    finally:
+        video_source.close_video(config.RECORDED_VIDEO)
+        video_source.close_video(metadata["original_video"])
     
     # Save updated metadata
     with open(config.METADATA_FILE, 'w') as f:
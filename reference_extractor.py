@@ -6,9 +6,19 @@ Extracts screenshots and audio clips from the original video at random timestamp
 import os
 import json
 import random
-from typing import List, Dict
+import bisect
+from functools import partial
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 import config
 import utils
+import hashing
+import video_source
+import audio_features
+import fingerprint
+import artifact_cache
+import audio_landmarks
+import audio_sync
 
 
 def generate_random_timestamps(duration: float, num_samples: int) -> List[float]:
@@ -40,28 +50,219 @@ def generate_random_timestamps(duration: float, num_samples: int) -> List[float]
     return sorted(timestamps)
 
 
-def extract_reference_data(video_path: str) -> Dict:
+def generate_keyframe_timestamps(duration: float, num_samples: int, keyframes: List[float], seed: int) -> List[float]:
+    """
+    Generate seeded, stratified timestamps snapped to nearby keyframes
+    
+    The valid range is split into num_samples equal strata with one random
+    timestamp per stratum, so samples cover the whole film. Each timestamp is
+    moved to the closest keyframe within KEYFRAME_SNAP_WINDOW (and inside its
+    stratum), which lets FFmpeg's seek land on it without decoding a GOP.
+    
+    Args:
+        duration: Total video duration in seconds
+        num_samples: Number of timestamps to generate
+        keyframes: Sorted keyframe timestamps of the video
+        seed: Random seed (same seed -> same timestamps)
+        
+    Returns:
+        List of timestamps in seconds, sorted
+    """
+    min_time = config.MIN_TIMESTAMP_OFFSET
+    max_time = duration - config.MAX_TIMESTAMP_OFFSET
+    
+    if max_time <= min_time:
+        # Video too short, use full range
+        min_time = 0
+        max_time = duration
+    
+    rng = random.Random(seed)
+    stratum = (max_time - min_time) / num_samples
+    timestamps = []
+    
+    for i in range(num_samples):
+        low = min_time + i * stratum
+        high = low + stratum
+        timestamp = rng.uniform(low, high)
+        
+        # Closest keyframe to the timestamp
+        pos = bisect.bisect_left(keyframes, timestamp)
+        candidates = [k for k in keyframes[max(0, pos - 1):pos + 1] if low <= k < high]
+        if candidates:
+            nearest = min(candidates, key=lambda k: abs(k - timestamp))
+            if abs(nearest - timestamp) <= config.KEYFRAME_SNAP_WINDOW:
+                timestamp = nearest
+        
+        timestamps.append(round(timestamp, 3))
+    
+    return sorted(timestamps)
+
+
+def _reference_audio_features(source: video_source.VideoSource, timestamp: float) -> Optional[np.ndarray]:
+    """Mel spectrogram of one reference sample, computed from the decoded-once audio"""
+    def compute():
+        audio = source.audio(timestamp, config.AUDIO_DURATION)
+        if audio is None or len(audio) == 0:
+            return None
+        return {"spec": audio_features.mel_spectrogram(audio, config.AUDIO_SAMPLE_RATE)}
+
+    params = {"start": timestamp, "duration": config.AUDIO_DURATION, "sr": config.AUDIO_SAMPLE_RATE,
+              "version": audio_features.FEATURE_VERSION}
+    features = artifact_cache.cached_arrays("features", [source.video_path], params, compute)
+    return features["spec"] if features is not None else None
+
+
+def _reference_audio_descriptor(video_path: str, timestamp: float) -> Optional[np.ndarray]:
+    """Block descriptor of one reference sample, streamed from the decoded-once sync track"""
+    return audio_features.describe_video_segment(video_path, timestamp, config.AUDIO_DURATION)
+
+
+def _write_reference_audio(source: video_source.VideoSource, timestamp: float, audio_path: str) -> bool:
+    """Write one reference WAV and cache its audio features for later comparisons"""
+    if not source.write_audio(timestamp, config.AUDIO_DURATION, audio_path):
+        return False
+    if config.AUDIO_DESCRIPTORS:
+        audio_features.load_descriptor(audio_path)
+    else:
+        audio_features.load_mel_spectrogram(audio_path)
+    return True
+
+
+def _reference_anchor_audio(source: video_source.VideoSource, timestamp: float,
+                            duration: float = config.ANCHOR_DURATION) -> Optional[np.ndarray]:
+    """Anchor clip at the sync sample rate"""
+    def compute():
+        audio = source.audio(timestamp, duration, sr=config.SYNC_SAMPLE_RATE)
+        if audio is None or len(audio) == 0:
+            return None
+        return {"audio": audio}
+
+    params = {"start": timestamp, "duration": duration, "sr": config.SYNC_SAMPLE_RATE}
+    anchor = artifact_cache.cached_arrays("anchor", [source.video_path], params, compute)
+    return anchor["audio"] if anchor is not None else None
+
+
+def _pack_clips(clips: List[np.ndarray], duration: float) -> np.ndarray:
+    """Stack sync-rate clips into one zero-padded float16 array"""
+    length = int(duration * config.SYNC_SAMPLE_RATE)
+    packed = np.zeros((len(clips), length), dtype=np.float16)
+    for i, audio in enumerate(clips):
+        packed[i, :min(length, len(audio))] = audio[:length]
+    return packed
+
+
+def save_reference_fingerprint(metadata: Dict, phashes: List[Optional[str]], audio_specs: List, anchor_audio: List,
+                               dense_index: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                               fingerprint_path: str = config.FINGERPRINT_FILE,
+                               landmarks: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                               sync_anchor_audio: Optional[List] = None,
+                               strips: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> str:
+    """
+    Write the binary fingerprint for a reference extraction
+    
+    Args:
+        metadata: Metadata built by extract_reference_data
+        phashes: Hex pHash per timestamp (None if failed)
+        audio_specs: Block descriptor (AUDIO_DESCRIPTORS) or mel spectrogram per timestamp (None if failed)
+        anchor_audio: Sync-rate audio per extracted anchor
+        dense_index: Optional (times, hashes) of the whole film at DENSE_INDEX_FPS
+        fingerprint_path: Where to write the fingerprint
+        landmarks: Optional (hashes, frames) audio landmarks of the whole film
+        sync_anchor_audio: Sync-rate audio per extracted short sync anchor
+        strips: Optional (offsets, hashes, valid) frame strips around each timestamp
+        
+    Returns:
+        Path of the fingerprint file
+    """
+    valid = np.zeros(len(metadata["timestamps"]), dtype=np.uint8)
+    for sample in metadata["samples"]:
+        valid[sample["index"]] = 1
+    
+    audio_specs = [spec if valid[i] else None for i, spec in enumerate(audio_specs)]
+    
+    info = {
+        "original_video": metadata["original_video"],
+        "duration": metadata["duration"],
+        "audio_duration": metadata["audio_duration"],
+        "audio_sample_rate": config.AUDIO_SAMPLE_RATE,
+        "sync_sample_rate": config.SYNC_SAMPLE_RATE,
+        "anchor_duration": config.ANCHOR_DURATION
+    }
+    arrays = {
+        "timestamps": np.asarray(metadata["timestamps"], dtype=np.float64),
+        "sample_valid": valid,
+        "phashes": np.array([fingerprint.hex_to_uint64(h) for h in phashes], dtype=np.uint64),
+        "anchor_times": np.array([a["timestamp"] for a in metadata["anchors"]], dtype=np.float64),
+        "anchor_audio": _pack_clips(anchor_audio, config.ANCHOR_DURATION)
+    }
+    if config.AUDIO_DESCRIPTORS:
+        arrays["audio_descriptors"], arrays["audio_blocks"] = audio_features.pack_descriptors(audio_specs)
+        info["audio_descriptor"] = audio_features.descriptor_params()
+    else:
+        arrays["audio_features"], arrays["audio_frames"] = audio_features.pack_spectrograms(audio_specs)
+    if sync_anchor_audio:
+        arrays["sync_anchor_times"] = np.array([a["timestamp"] for a in metadata["sync_anchors"]], dtype=np.float64)
+        arrays["sync_anchor_audio"] = _pack_clips(sync_anchor_audio, config.SYNC_MAP_ANCHOR_DURATION)
+        info["sync_anchor_duration"] = config.SYNC_MAP_ANCHOR_DURATION
+    if strips is not None:
+        arrays["strip_offsets"], arrays["strip_hashes"], arrays["strip_valid"] = strips
+    if any(sample.get("bank") for sample in metadata["samples"]):
+        count = len(metadata["timestamps"])
+        arrays["bank_valid"] = np.zeros(count, dtype=np.uint8)
+        arrays["dhashes"] = np.zeros(count, dtype=np.uint64)
+        arrays["whashes"] = np.zeros(count, dtype=np.uint64)
+        arrays["color_moments"] = np.zeros((count, 9), dtype=np.float32)
+        for sample in metadata["samples"]:
+            bank = sample.get("bank")
+            if bank:
+                i = sample["index"]
+                arrays["bank_valid"][i] = 1
+                arrays["dhashes"][i] = fingerprint.hex_to_uint64(bank["dhash"])
+                arrays["whashes"][i] = fingerprint.hex_to_uint64(bank["whash"])
+                arrays["color_moments"][i] = bank["color"]
+    if dense_index is not None:
+        arrays["dense_times"], arrays["dense_hashes"] = dense_index
+        info["dense_index_fps"] = config.DENSE_INDEX_FPS
+    if landmarks is not None:
+        arrays["landmark_hashes"], arrays["landmark_times"] = audio_landmarks.sort_landmarks(*landmarks)
+        info["landmarks"] = audio_landmarks.landmark_params()
+    fingerprint.save_fingerprint(fingerprint_path, info, arrays)
+    return fingerprint_path
+
+
+def extract_reference_data(video_path: str, fingerprint_path: str = config.FINGERPRINT_FILE) -> Dict:
     """
     Extract reference screenshots and audio clips from original video
     
     Args:
         video_path: Path to the original video
+        fingerprint_path: Where to write the binary fingerprint (e.g. a catalog entry)
         
     Returns:
         Dictionary containing extraction metadata
     """
     print(f"\n📂 Loading {video_path}...")
     
-    # Get video duration
-    duration = utils.get_video_duration(video_path)
-    if duration is None:
+    # Keep the video open for every frame and audio request of this run
+    source = video_source.open_video(video_path)
+    
+    # Get video duration (and keyframe index for keyframe-aware sampling)
+    use_keyframes = config.TIMESTAMP_SAMPLING == "keyframe"
+    probe = utils.probe_video(video_path, keyframes=use_keyframes)
+    if probe is None:
         raise ValueError(f"Failed to get duration for {video_path}")
+    duration = probe["duration"]
     
     print(f"   Duration: {utils.format_timestamp(duration)} ({duration:.1f}s)")
     
-    # Generate random timestamps
-    timestamps = generate_random_timestamps(duration, config.NUM_SAMPLES)
-    print(f"🎲 Generated random timestamps: {[int(t) for t in timestamps]}")
+    # Generate timestamps
+    if use_keyframes and probe.get("keyframes"):
+        seed = config.SAMPLING_SEED if config.SAMPLING_SEED is not None else int(utils.file_key(video_path), 16)
+        timestamps = generate_keyframe_timestamps(duration, config.NUM_SAMPLES, probe["keyframes"], seed)
+        print(f"🎲 Generated keyframe-aligned timestamps: {[int(t) for t in timestamps]}")
+    else:
+        timestamps = generate_random_timestamps(duration, config.NUM_SAMPLES)
+        print(f"🎲 Generated random timestamps: {[int(t) for t in timestamps]}")
     
     # Create output directory
     utils.ensure_directory(config.REFERENCE_DIR)
@@ -75,31 +276,83 @@ def extract_reference_data(video_path: str) -> Dict:
         "timestamps": timestamps,
         "audio_duration": config.AUDIO_DURATION,
         "samples": [],
-        "anchors": []  # New: Store anchor info
+        "anchors": [],  # New: Store anchor info
+        "sync_anchors": []  # Short clips spread over the film, so sync never needs the original
     }
     
+    # Binary fingerprint: store hashes and audio features instead of PNG/WAV files
+    binary = config.FINGERPRINT_FORMAT == "binary"
+    
     # 1. Extract Random Samples (Fingerprint)
     print("  ► Extracting Random Samples (Fingerprint)...")
+    screenshot_paths = [
+        os.path.join(config.REFERENCE_DIR, f"screenshot_{i:02d}.{config.SCREENSHOT_FORMAT}")
+        for i in range(len(timestamps))
+    ]
+    
+    audio_paths = [
+        os.path.join(config.REFERENCE_DIR, f"audio_{i:02d}.{config.AUDIO_FORMAT}")
+        for i in range(len(timestamps))
+    ]
+    
+    def extract_audio():
+        if binary and config.AUDIO_DESCRIPTORS:
+            return utils.run_parallel([
+                partial(_reference_audio_descriptor, video_path, timestamp)
+                for timestamp in timestamps
+            ])
+        if binary:
+            return utils.run_parallel([
+                partial(_reference_audio_features, source, timestamp)
+                for timestamp in timestamps
+            ])
+        return utils.run_parallel([
+            partial(_write_reference_audio, source, timestamp, audio_path)
+            for timestamp, audio_path in zip(timestamps, audio_paths)
+        ])
+    
+    def extract_dense_index():
+        # Dense frame hashes over the whole film (binary fingerprint only)
+        if binary and config.DENSE_INDEX_FPS > 0:
+            return hashing.hash_video_at_rate(video_path, config.DENSE_INDEX_FPS)
+        return None
+    
+    def extract_landmarks():
+        # Audio landmarks of the whole film (binary fingerprint only)
+        if binary and config.LANDMARK_INDEX:
+            return audio_landmarks.video_landmarks(video_path)
+        return None
+    
+    def extract_strips():
+        # Frame hashes around each sample, for matching when sync is slightly off
+        if config.TEMPORAL_MATCH_WINDOW > 0:
+            return hashing.hash_strips(video_path, timestamps, duration)
+        return None
+    
+    # Frames, audio clips, the dense index, landmarks and strips are extracted concurrently; results are reported in sample order
+    (screenshot_ok, phashes, screenshot_paths, banks), audio_results, dense_index, landmarks, strips = utils.run_parallel([
+        partial(hashing.extract_sample_frames, video_path, timestamps, screenshot_paths,
+                hash_at_decode=config.HASH_AT_DECODE or binary),
+        extract_audio,
+        extract_dense_index,
+        extract_landmarks,
+        extract_strips
+    ])
+    audio_ok = [r is not None and r is not False for r in audio_results]
+    
     for i, timestamp in enumerate(timestamps):
-        # Define output paths
-        screenshot_path = os.path.join(
-            config.REFERENCE_DIR,
-            f"screenshot_{i:02d}.{config.SCREENSHOT_FORMAT}"
-        )
-        audio_path = os.path.join(
-            config.REFERENCE_DIR,
-            f"audio_{i:02d}.{config.AUDIO_FORMAT}"
-        )
+        screenshot_path = screenshot_paths[i]
+        audio_path = audio_paths[i] if not binary else None
         
-        # Extract screenshot
-        if utils.extract_screenshot(video_path, timestamp, screenshot_path):
+        # Check screenshot
+        if screenshot_ok[i]:
             pass # Suppress log spam
         else:
             print(f"  ✗ Failed to extract screenshot at {int(timestamp)}s")
             continue
         
-        # Extract audio clip
-        if utils.extract_audio_clip(video_path, timestamp, config.AUDIO_DURATION, audio_path):
+        # Check audio clip
+        if audio_ok[i]:
             print(f"    ✓ Sample {i}: {int(timestamp)}s")
         else:
             print(f"  ✗ Failed to extract audio at {int(timestamp)}s")
@@ -110,8 +363,18 @@ def extract_reference_data(video_path: str) -> Dict:
             "index": i,
             "timestamp": timestamp,
             "screenshot": screenshot_path,
+            "phash": phashes[i],
             "audio": audio_path
         })
+        if banks[i] is not None:
+            metadata["samples"][-1]["bank"] = banks[i]
+        if strips is not None and not binary:
+            _, strip_hashes, strip_valid = strips
+            metadata["samples"][-1]["strip"] = [
+                fingerprint.uint64_to_hex(h) if ok else None for h, ok in zip(strip_hashes[i], strip_valid[i])
+            ]
+    if strips is not None and not binary:
+        metadata["strip_offsets"] = strips[0].tolist()
 
     # 2. Extract Audio Anchors (Sync)
     print("  ► Extracting Audio Anchors (Sync)...")
@@ -128,26 +391,90 @@ def extract_reference_data(video_path: str) -> Dict:
         # Use standard Hackathon anchors
         anchor_times = config.ANCHOR_AUDIO_TIMES
 
+    anchor_paths = [
+        os.path.join(config.REFERENCE_DIR, f"anchor_{int(timestamp)}.wav")
+        for timestamp in anchor_times
+    ]
+    
+    # Extract 10s clips concurrently (anchors beyond the end are skipped below)
+    if binary:
+        anchor_results = utils.run_parallel([
+            partial(_reference_anchor_audio, source, timestamp)
+            for timestamp in anchor_times
+            if timestamp < duration
+        ])
+    else:
+        anchor_results = utils.run_parallel([
+            partial(source.write_audio, timestamp, config.ANCHOR_DURATION, anchor_path)
+            for timestamp, anchor_path in zip(anchor_times, anchor_paths)
+            if timestamp < duration
+        ])
+    anchor_results = iter(anchor_results)
+    anchor_audio = []
+
     for i, timestamp in enumerate(anchor_times):
         if timestamp >= duration:
             print(f"    ⚠ Skip anchor {timestamp}s (beyond duration)")
             continue
             
-        anchor_path = os.path.join(
-            config.REFERENCE_DIR,
-            f"anchor_{int(timestamp)}.wav"
-        )
+        anchor_path = anchor_paths[i] if not binary else None
+        result = next(anchor_results)
         
-        # Extract 10s clip
-        if utils.extract_audio_clip(video_path, timestamp, config.ANCHOR_DURATION, anchor_path):
+        if result is not None and result is not False:
             print(f"    ✓ Anchor {i}: {int(timestamp)}s")
             metadata["anchors"].append({
                 "timestamp": timestamp,
                 "path": anchor_path
             })
+            if binary:
+                anchor_audio.append(result)
         else:
             print(f"    ✗ Failed to extract anchor at {timestamp}s")
 
+    # Short sync anchors spread over the film, stored for time-map fitting at detection time
+    sync_times = audio_sync.sync_anchor_times(duration)
+    sync_paths = [
+        os.path.join(config.REFERENCE_DIR, f"sync_anchor_{i:02d}.wav")
+        for i in range(len(sync_times))
+    ]
+    if binary:
+        sync_results = utils.run_parallel([
+            partial(_reference_anchor_audio, source, timestamp, config.SYNC_MAP_ANCHOR_DURATION)
+            for timestamp in sync_times
+        ])
+    else:
+        sync_results = utils.run_parallel([
+            partial(source.write_audio, timestamp, config.SYNC_MAP_ANCHOR_DURATION, sync_path)
+            for timestamp, sync_path in zip(sync_times, sync_paths)
+        ])
+    sync_anchor_audio = []
+    for timestamp, sync_path, result in zip(sync_times, sync_paths, sync_results):
+        if result is None or result is False:
+            continue
+        metadata["sync_anchors"].append({
+            "timestamp": timestamp,
+            "path": sync_path if not binary else None
+        })
+        if binary:
+            sync_anchor_audio.append(result)
+    if sync_times:
+        print(f"    ✓ Sync anchors: {len(metadata['sync_anchors'])} / {len(sync_times)}")
+
+    video_source.close_video(video_path)
+    
+    if binary:
+        # Save fingerprint (replaces metadata.json + reference media)
+        if dense_index is not None:
+            print(f"  ► Dense index: {len(dense_index[1])} frame hashes at {config.DENSE_INDEX_FPS:g} fps")
+        if landmarks is not None:
+            print(f"  ► Audio landmarks: {len(landmarks[0])}")
+        metadata["fingerprint"] = save_reference_fingerprint(
+            metadata, phashes, audio_results, anchor_audio, dense_index, fingerprint_path, landmarks,
+            sync_anchor_audio, strips
+        )
+        print(f"💾 Fingerprint saved to {fingerprint_path}")
+        return metadata
+    
     # Save metadata
     with open(config.METADATA_FILE, 'w') as f:
         json.dump(metadata, f, indent=2)
@@ -139,7 +139,7 @@ Automated Anti-Piracy Detection System"""
 
     # 2. Prepare Data
     data = {
-        "movie_name": config.MOVIE_NAME,
+        "movie_name": results.get("title_name", config.MOVIE_NAME),
         "production_company": config.PRODUCTION_COMPANY,
         "channel_id": channel_id,
         "message_id": msg_id,
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the detection pipeline's building blocks (run with pytest)
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pytest
+
+import config
+import utils
+import hashing
+import fingerprint
+import hash_index
+import catalog
+import artifact_cache
+import audio_sync
+import detection
+
+
+def test_fingerprint_round_trip(tmp_path):
+    """Arrays and info come back unchanged; foreign or newer files are refused"""
+    path = str(tmp_path / "reference.mpfp")
+    info = {"original_video": "movie.mp4", "duration": 5400.0, "timestamps": [62.0, 75.0]}
+    arrays = {
+        "phashes": np.array([0, 1, 2 ** 64 - 1], dtype=np.uint64),
+        "audio_features": np.arange(24, dtype=np.float32).reshape(2, 3, 4),
+        "sample_valid": np.array([1, 0], dtype=np.uint8),
+        "empty": np.zeros(0, dtype=np.float64)
+    }
+    fingerprint.save_fingerprint(path, info, arrays)
+
+    fp = fingerprint.load_fingerprint(path)
+    assert fp.info == info
+    assert set(fp.arrays) == set(arrays)
+    for name, array in arrays.items():
+        assert fp[name].dtype == array.dtype
+        np.testing.assert_array_equal(fp[name], array)
+
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+
+    bad_magic = tmp_path / "bad_magic.mpfp"
+    bad_magic.write_bytes(b"XXXX" + bytes(data[4:]))
+    with pytest.raises(ValueError, match="Not a fingerprint"):
+        fingerprint.load_fingerprint(str(bad_magic))
+
+    newer = tmp_path / "newer.mpfp"
+    data[4:6] = (fingerprint.VERSION + 1).to_bytes(2, "little")
+    newer.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="Unsupported fingerprint version"):
+        fingerprint.load_fingerprint(str(newer))
+
+
+def test_hash_index_within_matches_brute_force():
+    """BK-tree radius lookups find exactly the hashes a linear scan does"""
+    rng = np.random.default_rng(9)
+    # Clusters of near-duplicate frames plus unrelated ones, as in a film
+    centres = rng.integers(0, 2 ** 63, size=20, dtype=np.uint64)
+    hashes = []
+    for centre in centres:
+        for _ in range(10):
+            flips = rng.choice(64, size=rng.integers(0, 8), replace=False)
+            hashes.append(int(centre) ^ sum(1 << int(b) for b in flips))
+    hashes += [int(h) for h in rng.integers(0, 2 ** 63, size=100, dtype=np.uint64)]
+    hashes = np.array(hashes, dtype=np.uint64)
+    times = np.arange(len(hashes), dtype=np.float64)
+    index = hash_index.HashIndex(hashes, times)
+
+    for query in list(hashes[::15]) + list(rng.integers(0, 2 ** 63, size=5, dtype=np.uint64)):
+        for radius in (0, 4, 10):
+            expected = sorted(
+                (hash_index.hamming(int(query), int(h)), float(t))
+                for h, t in zip(hashes, times)
+                if hash_index.hamming(int(query), int(h)) <= radius
+            )
+            found = index.within(int(query), radius)
+            assert sorted(found) == expected
+            assert [d for d, _ in found] == sorted(d for d, _ in found)
+
+
+def _flip_bits(value: int, count: int, rng) -> int:
+    """A hash exactly count bits away from value"""
+    for bit in rng.choice(64, size=count, replace=False):
+        value ^= 1 << int(bit)
+    return value
+
+
+def test_catalog_identify_recall(tmp_path, monkeypatch):
+    """Every probe within CATALOG_MATCH_DISTANCE of a title's frame votes for that title"""
+    rng = np.random.default_rng(10)
+    titles = catalog.Catalog(str(tmp_path / "catalog"))
+    dense = {}
+    for title_id in ("alpha", "beta", "gamma"):
+        dense[title_id] = rng.integers(0, 2 ** 63, size=500, dtype=np.uint64)
+        path = str(tmp_path / title_id / "reference.mpfp")
+        fingerprint.save_fingerprint(path, {}, {
+            "dense_hashes": dense[title_id],
+            "dense_times": np.arange(500, dtype=np.float64)
+        })
+        titles.titles[title_id] = {"name": title_id, "fingerprint": path}
+    titles.build_index()
+
+    # Upload frames of "beta", each as far from its original as a match may be
+    frames = rng.choice(dense["beta"], size=config.CATALOG_PROBE_FRAMES, replace=False)
+    probes = [f"{_flip_bits(int(h), config.CATALOG_MATCH_DISTANCE, rng):016x}" for h in frames]
+    monkeypatch.setattr(utils, "get_video_duration", lambda path: 600.0)
+    monkeypatch.setattr(hashing, "hash_video_frames", lambda path, timestamps: probes[:len(timestamps)])
+
+    ranked = titles.identify("upload.mp4")
+    assert ranked[0][0] == "beta"
+    assert ranked[0][1] == config.CATALOG_PROBE_FRAMES
+    assert ranked[0][2] <= config.CATALOG_MATCH_DISTANCE
+
+
+def test_artifact_cache_evicts_down_to_target(tmp_path, monkeypatch):
+    """An over-full cache drops its least recently used entries until it fits _EVICT_TO of the limit"""
+    monkeypatch.setattr(config, "ARTIFACT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ARTIFACT_CACHE_MAX_MB", 1)
+    monkeypatch.setattr(artifact_cache, "_size", None)
+    limit = 1024 * 1024
+    entry_size = 64 * 1024
+
+    # 20 entries (1.25 MB), oldest first
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"entry_{i:02d}.json"
+        path.write_bytes(b"x" * entry_size)
+        os.utime(path, ns=(i * 10 ** 9, i * 10 ** 9))
+        paths.append(path)
+    (tmp_path / "entry_99.123.tmp.json").write_bytes(b"x" * entry_size)  # Being written: never evicted
+
+    artifact_cache._evict()
+
+    kept = [p for p in paths if p.exists()]
+    total = sum(p.stat().st_size for p in kept)
+    assert total <= limit * artifact_cache._EVICT_TO
+    assert total + entry_size > limit * artifact_cache._EVICT_TO  # Nothing more than needed went
+    assert kept == paths[len(paths) - len(kept):]  # Oldest went first
+    assert artifact_cache._size == total
+    assert (tmp_path / "entry_99.123.tmp.json").exists()
+
+
+def test_fit_time_map_recovers_offset_and_rate():
+    """A sped-up, shifted upload's time map survives a third of the points being wrong"""
+    rng = np.random.default_rng(15)
+    offset, rate = 42.0, 1.04
+    rec_times = np.linspace(0, 3000, 20)
+    points = [(offset + rate * t + rng.normal(0, 0.05), t) for t in rec_times]
+    outliers = [(rng.uniform(0, 6000), t) for t in rng.uniform(0, 3000, 10)]
+
+    time_map = audio_sync.fit_time_map(points + outliers)
+    assert time_map["offset"] == pytest.approx(offset, abs=0.2)
+    assert time_map["rate"] == pytest.approx(rate, abs=1e-4)
+    assert time_map["inliers"] == len(points)
+    assert time_map["points"] == len(points) + len(outliers)
+
+
+def _samples_to_decide(outcomes):
+    """Samples the sequential test needs before it decides (None if it never does)"""
+    for n in range(1, len(outcomes) + 1):
+        decision, _, _ = detection.sequential_test(outcomes[:n])
+        if decision is not None:
+            return decision, n
+    return None
+
+
+def test_sequential_test_decision_counts(monkeypatch):
+    """Clear-cut uploads stop early, mixed evidence keeps drawing, and the minimum sample count holds"""
+    monkeypatch.setattr(config, "SPRT_MATCH_RATE_PIRATED", 0.8)
+    monkeypatch.setattr(config, "SPRT_MATCH_RATE_CLEAN", 0.1)
+    monkeypatch.setattr(config, "SPRT_FALSE_POSITIVE", 0.01)
+    monkeypatch.setattr(config, "SPRT_FALSE_NEGATIVE", 0.05)
+
+    # Bounds are about -2.99 and +4.55; a match adds 2.08, a miss subtracts 1.50
+    monkeypatch.setattr(config, "SPRT_MIN_SAMPLES", 1)
+    assert _samples_to_decide([True] * 10) == ("pirated", 3)
+    assert _samples_to_decide([False] * 10) == ("clean", 2)
+    assert _samples_to_decide([True, False] * 5) is None
+
+    monkeypatch.setattr(config, "SPRT_MIN_SAMPLES", 3)
+    assert _samples_to_decide([False] * 10) == ("clean", 3)
+    decision, confidence, llr = detection.sequential_test([True] * 3)
+    assert decision == "pirated"
+    assert confidence > 0.99 and llr >= detection.sprt_bounds()[1]
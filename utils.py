@@ -3,9 +3,13 @@ Utility functions for video and audio processing using FFmpeg
 """
 
 import os
+import hashlib
 import subprocess
 import json
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+import numpy as np
 import config
 
 
@@ -14,9 +18,210 @@ def ensure_directory(directory: str) -> None:
     os.makedirs(directory, exist_ok=True)
 
 
+def run_parallel(tasks: List[Callable], max_workers: Optional[int] = None) -> List:
+    """
+    Run zero-argument callables on a bounded thread pool
+    
+    The work is FFmpeg subprocesses and file I/O, so threads are enough to keep
+    every core busy. Results come back in task order regardless of which task
+    finishes first, so callers can report per-task outcomes deterministically.
+    
+    Args:
+        tasks: Callables to run
+        max_workers: Concurrency cap (defaults to config.EXTRACTION_WORKERS)
+        
+    Returns:
+        List of task results, in the same order as tasks
+    """
+    max_workers = max_workers or config.EXTRACTION_WORKERS
+    if max_workers <= 1 or len(tasks) <= 1:
+        return [task() for task in tasks]
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+        futures = [pool.submit(task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def _split_batches(count: int) -> List[List[int]]:
+    """Split indices into batches, spreading small jobs over all workers"""
+    workers = max(1, config.EXTRACTION_WORKERS)
+    batch_size = max(1, min(config.SCREENSHOT_BATCH_SIZE, -(-count // workers)))
+    return [list(range(start, min(start + batch_size, count))) for start in range(0, count, batch_size)]
+
+
+# Files still being written, with their in-memory probe results (see transient_file)
+_transient: Dict[str, Dict] = {}
+
+
+@contextmanager
+def transient_file(path: str):
+    """
+    Keep a file that is still being written out of the on-disk caches
+    
+    While the context is open, probe results for the file live in memory and
+    artifact-cache entries for it are not stored, so nothing keyed to one
+    prefix of a growing download outlives the pass over it.
+    """
+    key = os.path.abspath(path)
+    _transient[key] = {}
+    try:
+        yield
+    finally:
+        _transient.pop(key, None)
+
+
+def is_transient(path: str) -> bool:
+    """Whether a file is inside transient_file (and must not be cached on disk)"""
+    return os.path.abspath(path) in _transient
+
+
+def file_key(path: str) -> str:
+    """Identify a file by path, size and modification time (for on-disk caches)"""
+    stat = os.stat(path)
+    identity = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(identity.encode()).hexdigest()[:16]
+
+
+def content_key(path: str) -> str:
+    """Identify a file by its contents (for caches that should survive the file being rewritten)"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def _probe_streams(video_path: str) -> Dict:
+    """Run FFprobe for duration and stream layout"""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries',
+        'format=duration:stream=index,codec_type,codec_name,width,height,avg_frame_rate,sample_rate,channels',
+        '-of', 'json',
+        video_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout)
+    return {
+        "duration": float(data['format']['duration']),
+        "streams": data.get('streams', [])
+    }
+
+
+def _probe_keyframes(video_path: str) -> List[float]:
+    """Run FFprobe over the video packets and collect keyframe timestamps (no decoding)"""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'json',
+        video_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    packets = json.loads(result.stdout).get('packets', [])
+    keyframes = set()
+    for packet in packets:
+        if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A'):
+            keyframes.add(round(float(packet['pts_time']), 3))
+    return sorted(keyframes)
+
+
+def _detect_crop(video_path: str, info: Dict) -> Optional[List[int]]:
+    """
+    Find the picture area of a video from a few frames spread over it
+
+    Letterbox/pillarbox bars and the desktop around a screen recording stay
+    the same from frame to frame, while the film changes, so the crop is the
+    bounding box of the rows and columns that vary across the sampled frames.
+
+    Returns:
+        [width, height, x, y] in source pixels, or None if the whole frame is picture
+    """
+    video = next((s for s in info["streams"] if s.get("codec_type") == "video"), None)
+    if video is None or not video.get("width") or not video.get("height"):
+        return None
+    width, height = int(video["width"]), int(video["height"])
+    
+    size = config.CROP_DETECT_SIZE
+    times = np.linspace(0.1, 0.9, config.CROP_DETECT_FRAMES) * info["duration"]
+    frames = [f for f in extract_small_frames(video_path, [round(float(t), 3) for t in times], size) if f is not None]
+    if len(frames) < 2:
+        return None
+    
+    activity = np.stack(frames).astype(np.float32).std(axis=0)
+    rows = np.nonzero(activity.mean(axis=1) >= config.CROP_MIN_ACTIVITY)[0]
+    cols = np.nonzero(activity.mean(axis=0) >= config.CROP_MIN_ACTIVITY)[0]
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+    
+    # Scale the box back to source pixels (outward, even sizes for chroma subsampling)
+    x0 = int(cols[0] * width / size) // 2 * 2
+    y0 = int(rows[0] * height / size) // 2 * 2
+    x1 = min(width, -(-(cols[-1] + 1) * width // size))
+    y1 = min(height, -(-(rows[-1] + 1) * height // size))
+    crop_w, crop_h = (x1 - x0) // 2 * 2, (y1 - y0) // 2 * 2
+    
+    area = crop_w * crop_h / (width * height)
+    if area < config.CROP_MIN_AREA or (crop_w >= width - 2 * width // size and crop_h >= height - 2 * height // size):
+        # Too small to trust (static or dark samples), or nothing worth cropping
+        return None
+    return [int(crop_w), int(crop_h), int(x0), int(y0)]
+
+
+def probe_video(video_path: str, keyframes: bool = False, crop: bool = False) -> Optional[Dict]:
+    """
+    Probe a video once and cache the result on disk
+    
+    The cache is keyed on path + size + mtime, so repeat runs on the same file
+    never call FFprobe again (files inside transient_file are cached in memory
+    only). The keyframe index needs a pass over every packet
+    and the crop a few decoded frames, so they are only built (and then cached)
+    when asked for.
+    
+    Args:
+        video_path: Path to the video file
+        keyframes: Also build the keyframe timestamp index
+        crop: Also detect the picture area (see _detect_crop)
+        
+    Returns:
+        Dict with "duration", "streams" and optionally "keyframes" and "crop", or None if failed
+    """
+    try:
+        transient = _transient.get(os.path.abspath(video_path))
+        cache_path = None if transient is not None else os.path.join(config.PROBE_CACHE_DIR, f"{file_key(video_path)}.json")
+        info = transient.get("probe") if transient is not None else None
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, 'r') as f:
+                info = json.load(f)
+        
+        changed = False
+        if info is None:
+            info = _probe_streams(video_path)
+            changed = True
+        if keyframes and "keyframes" not in info:
+            info["keyframes"] = _probe_keyframes(video_path)
+            changed = True
+        if crop and "crop" not in info:
+            info["crop"] = _detect_crop(video_path, info)
+            changed = True
+        
+        if changed and transient is not None:
+            transient["probe"] = info
+        elif changed:
+            ensure_directory(config.PROBE_CACHE_DIR)
+            with open(cache_path, 'w') as f:
+                json.dump(info, f)
+        return info
+    except (OSError, subprocess.CalledProcessError, KeyError, ValueError, json.JSONDecodeError) as e:
+        print(f"❌ Error probing video: {e}")
+        return None
+
+
 def get_video_duration(video_path: str) -> Optional[float]:
     """
-    Get the duration of a video file in seconds using FFprobe
+    Get the duration of a video file in seconds (cached FFprobe result)
     
     Args:
         video_path: Path to the video file
@@ -24,25 +229,46 @@ def get_video_duration(video_path: str) -> Optional[float]:
     Returns:
         Duration in seconds, or None if failed
     """
-    try:
-        cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'json',
-            video_path
-        ]
+    info = probe_video(video_path)
+    if info is None:
+        return None
+    return info["duration"]
+
+
+def has_audio(video_path: str) -> bool:
+    """
+    Whether a video has an audio stream (cached FFprobe result)
+    
+    Args:
+        video_path: Path to the video file
         
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        duration = float(data['format']['duration'])
-        return duration
-    except (subprocess.CalledProcessError, KeyError, ValueError, json.JSONDecodeError) as e:
-        print(f"❌ Error getting video duration: {e}")
+    Returns:
+        True if the probe lists an audio stream
+    """
+    info = probe_video(video_path)
+    return info is not None and any(s.get("codec_type") == "audio" for s in info["streams"])
+
+
+def get_video_crop(video_path: str) -> Optional[List[int]]:
+    """
+    Picture area of a video, detected once and cached with the probe
+    
+    Returns:
+        [width, height, x, y] for FFmpeg's crop filter, or None (no crop / AUTO_CROP off)
+    """
+    if not config.AUTO_CROP:
         return None
+    info = probe_video(video_path, crop=True)
+    return info.get("crop") if info is not None else None
+
+
+def _crop_filter(crop: Optional[List[int]]) -> str:
+    """Leading crop step for an FFmpeg filter chain (empty without a crop)"""
+    return "crop={}:{}:{}:{},".format(*crop) if crop else ""
 
 
-def extract_screenshot(video_path: str, timestamp: float, output_path: str) -> bool:
+def extract_screenshot(video_path: str, timestamp: float, output_path: str,
+                       crop: Optional[List[int]] = None) -> bool:
     """
     Extract a screenshot from a video at a specific timestamp
     
@@ -50,6 +276,7 @@ def extract_screenshot(video_path: str, timestamp: float, output_path: str) -> b
         video_path: Path to the video file
         timestamp: Time in seconds
         output_path: Path to save the screenshot
+        crop: Optional [width, height, x, y] picture area
         
     Returns:
         True if successful, False otherwise
@@ -59,6 +286,7 @@ def extract_screenshot(video_path: str, timestamp: float, output_path: str) -> b
             'ffmpeg',
             '-ss', str(timestamp),
             '-i', video_path,
+            '-vf', f"{_crop_filter(crop)}null",
             '-vframes', '1',
             '-q:v', '2',  # High quality
             '-y',  # Overwrite output file
@@ -77,6 +305,227 @@ def extract_screenshot(video_path: str, timestamp: float, output_path: str) -> b
         return False
 
 
+def extract_screenshots(video_path: str, timestamps: List[float], output_paths: List[str],
+                        crop: Optional[List[int]] = None) -> List[bool]:
+    """
+    Extract screenshots at several timestamps with a single FFmpeg process
+
+    Every timestamp is an input-seeked stream of the same FFmpeg invocation, so
+    the process is spawned once per batch while each frame keeps a fast seek.
+    Batches run concurrently on the worker pool; frames that could not be
+    written are retried with extract_screenshot.
+
+    Args:
+        video_path: Path to the video file
+        timestamps: Times in seconds
+        output_paths: Paths to save the screenshots (same order as timestamps)
+        crop: Optional [width, height, x, y] picture area
+
+    Returns:
+        List of success flags, one per timestamp
+    """
+    results = [False] * len(timestamps)
+
+    def run_batch(batch: List[int]) -> None:
+        cmd = ['ffmpeg', '-y']
+        for i in batch:
+            cmd += ['-ss', str(timestamps[i]), '-i', video_path]
+        for stream, i in enumerate(batch):
+            if crop:
+                cmd += ['-filter_complex', f"[{stream}:v:0]{_crop_filter(crop)}null[c{stream}]", '-map', f'[c{stream}]']
+            else:
+                cmd += ['-map', f'{stream}:v:0']
+            cmd += [
+                '-frames:v', '1',
+                '-q:v', '2',  # High quality
+                output_paths[i]
+            ]
+
+        # Remove stale outputs so a partial failure can't be mistaken for success
+        for i in batch:
+            if os.path.exists(output_paths[i]):
+                os.remove(output_paths[i])
+
+        subprocess.run(
+            cmd,
+            stderr=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL
+        )
+
+        for i in batch:
+            if os.path.exists(output_paths[i]) and os.path.getsize(output_paths[i]) > 0:
+                results[i] = True
+            else:
+                results[i] = extract_screenshot(video_path, timestamps[i], output_paths[i], crop)
+
+    run_parallel([lambda batch=batch: run_batch(batch) for batch in _split_batches(len(timestamps))])
+    return results
+
+
+def shrink_filter(size: int, crop: Optional[List[int]] = None, color: bool = False) -> str:
+    """
+    FFmpeg filter steps that crop a frame, shrink it to size x size (LANCZOS)
+    and drop colour (unless color)
+
+    The one definition of a small frame: FFmpeg subprocesses and PyAV filter
+    graphs (see video_source) both run these steps.
+    """
+    return f"{_crop_filter(crop)}scale={size}:{size}:flags=lanczos,format={'rgb24' if color else 'gray'}"
+
+
+def _small_frame_filter(stream: int, size: int, crop: Optional[List[int]] = None, color: bool = False) -> str:
+    """FFmpeg filter chain that keeps one frame and shrinks it (see shrink_filter)"""
+    return f"[{stream}:v:0]trim=end_frame=1,{shrink_filter(size, crop, color)},setpts=PTS-STARTPTS"
+
+
+def extract_small_frame(video_path: str, timestamp: float, size: int = config.HASH_FRAME_SIZE,
+                       crop: Optional[List[int]] = None, color: bool = False) -> Optional[np.ndarray]:
+    """
+    Decode one downscaled frame, gray or RGB, straight into memory (no image file)
+    
+    Args:
+        video_path: Path to the video file
+        timestamp: Time in seconds
+        size: Width and height of the returned frame
+        crop: Optional [width, height, x, y] picture area
+        color: Return an RGB frame instead of a gray one
+        
+    Returns:
+        (size, size) uint8 array ((size, size, 3) with color), or None if failed
+    """
+    frames = _run_small_frames(video_path, [timestamp], size, crop, color)
+    return frames[0] if frames is not None else None
+
+
+def _run_small_frames(video_path: str, timestamps: List[float], size: int,
+                     crop: Optional[List[int]] = None, color: bool = False) -> Optional[np.ndarray]:
+    """Run one FFmpeg process that pipes a raw small frame (gray or RGB) per timestamp"""
+    cmd = ['ffmpeg', '-v', 'error']
+    for timestamp in timestamps:
+        cmd += ['-ss', str(timestamp), '-i', video_path]
+    
+    chains = [f"{_small_frame_filter(k, size, crop, color)}[v{k}]" for k in range(len(timestamps))]
+    inputs = "".join(f"[v{k}]" for k in range(len(timestamps)))
+    chains.append(f"{inputs}concat=n={len(timestamps)}:v=1:a=0[out]")
+    
+    cmd += [
+        '-filter_complex', ";".join(chains),
+        '-map', '[out]',
+        '-vsync', '0',  # One output frame per input frame
+        '-f', 'rawvideo',
+        '-pix_fmt', 'rgb24' if color else 'gray',
+        'pipe:1'
+    ]
+    
+    result = subprocess.run(cmd, capture_output=True)
+    shape = (size, size, 3) if color else (size, size)
+    frame_bytes = int(np.prod(shape))
+    if result.returncode != 0 or len(result.stdout) != frame_bytes * len(timestamps):
+        return None
+    return np.frombuffer(result.stdout, dtype=np.uint8).reshape((len(timestamps),) + shape)
+
+
+def extract_small_frames(video_path: str, timestamps: List[float], size: int = config.HASH_FRAME_SIZE,
+                        crop: Optional[List[int]] = None, color: bool = False) -> List[Optional[np.ndarray]]:
+    """
+    Decode downscaled frames, gray or RGB, at several timestamps over a pipe
+    
+    FFmpeg scales and converts the frames in its filter graph and streams rawvideo
+    bytes, so no PNG is encoded, written or re-read. Frames are fetched in
+    batches run concurrently on the worker pool; a batch that comes back short
+    is retried frame by frame so one bad timestamp doesn't lose the others.
+    
+    Args:
+        video_path: Path to the video file
+        timestamps: Times in seconds
+        size: Width and height of each frame
+        crop: Optional [width, height, x, y] picture area
+        color: Return RGB frames instead of gray ones
+        
+    Returns:
+        List with a (size, size) uint8 array ((size, size, 3) with color, or None if failed) per timestamp
+    """
+    frames = [None] * len(timestamps)
+    
+    def run_batch(batch: List[int]) -> None:
+        decoded = _run_small_frames(video_path, [timestamps[i] for i in batch], size, crop, color)
+        
+        if decoded is not None:
+            for k, i in enumerate(batch):
+                frames[i] = decoded[k]
+        else:
+            for i in batch:
+                frames[i] = extract_small_frame(video_path, timestamps[i], size, crop, color)
+    
+    run_parallel([lambda batch=batch: run_batch(batch) for batch in _split_batches(len(timestamps))])
+    return frames
+
+
+def extract_gray_frames_at_rate(video_path: str, fps: float, size: int = config.HASH_FRAME_SIZE,
+                                crop: Optional[List[int]] = None) -> Optional[np.ndarray]:
+    """
+    Decode the whole video once at a fixed frame rate as small gray frames
+    
+    Args:
+        video_path: Path to the video file
+        fps: Frames per second to keep (frame k is at k / fps seconds)
+        size: Width and height of each frame
+        crop: Optional [width, height, x, y] picture area
+        
+    Returns:
+        (N, size, size) uint8 array, or None if failed
+    """
+    try:
+        cmd = [
+            'ffmpeg',
+            '-v', 'error',
+            '-i', video_path,
+            '-an',  # No audio
+            '-vf', f"fps={fps}:round=up,{shrink_filter(size, crop)}",
+            '-f', 'rawvideo',
+            '-pix_fmt', 'gray',
+            'pipe:1'
+        ]
+        result = subprocess.run(cmd, capture_output=True, check=True)
+        count = len(result.stdout) // (size * size)
+        return np.frombuffer(result.stdout[:count * size * size], dtype=np.uint8).reshape(count, size, size)
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Error decoding frames at {fps} fps: {e}")
+        return None
+
+
+def decode_audio_segment(video_path: str, start_time: float, duration: float,
+                         sr: int = config.SYNC_SAMPLE_RATE) -> Optional[np.ndarray]:
+    """
+    Decode one stretch of a video's audio straight into memory (seeks, so the rest of the track is never read)
+    
+    Args:
+        video_path: Path to the video file
+        start_time: Start time in seconds
+        duration: Duration in seconds
+        sr: Sample rate
+        
+    Returns:
+        Float32 mono samples in [-1, 1], or None if the video has no readable audio there
+    """
+    cmd = [
+        'ffmpeg',
+        '-v', 'error',
+        '-ss', str(start_time),
+        '-i', video_path,
+        '-t', str(duration),
+        '-vn',  # No video
+        '-ac', '1',  # Mono
+        '-ar', str(sr),
+        '-f', 's16le',
+        'pipe:1'
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0 or len(result.stdout) < 2:
+        return None
+    return np.frombuffer(result.stdout[:len(result.stdout) // 2 * 2], dtype='<i2').astype(np.float32) / 32768.0
+
+
 def extract_audio_clip(video_path: str, start_time: float, duration: float, output_path: str) -> bool:
     """
     Extract an audio clip from a video
@@ -0,0 +1,242 @@
+"""
+Video Source Module
+Keeps a video open in-process so frames and audio can be read many times
+without spawning FFmpeg or re-parsing the container for every request
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+import config
+import utils
+import audio_cache
+import artifact_cache
+
+try:
+    import av
+except ImportError:  # PyAV is optional; without it frames come from FFmpeg subprocesses
+    av = None
+
+
+# Open sources, keyed by video path
+_sources: Dict = {}
+_sources_lock = threading.Lock()
+
+
+def _filter_frame(frame, steps: str) -> np.ndarray:
+    """Run one decoded frame through comma-separated FFmpeg filter steps in a PyAV filter graph"""
+    graph = av.filter.Graph()
+    nodes = [graph.add_buffer(width=frame.width, height=frame.height, format=frame.format.name,
+                              time_base=frame.time_base)]
+    for step in steps.split(","):
+        name, _, args = step.partition("=")
+        nodes.append(graph.add(name, args))
+    nodes.append(graph.add("buffersink"))
+    graph.link_nodes(*nodes).configure()
+    graph.push(frame)
+    return graph.pull().to_ndarray()
+
+
+class _Decoder:
+    """One open container + video decoder that reuses its position between seeks"""
+
+    def __init__(self, video_path: str):
+        self.container = av.open(video_path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.start = float((self.stream.start_time or 0) * self.stream.time_base)
+        self._frames = None
+        self._position = None  # Time of the last decoded frame (relative to start)
+
+    def frame_at(self, timestamp: float):
+        """Return the first frame at or after timestamp (like FFmpeg's -ss), or None"""
+        # Decode forward when the target is just ahead, otherwise seek to the keyframe before it
+        if (self._frames is None or self._position is None or timestamp < self._position
+                or timestamp - self._position > config.VIDEO_SEEK_THRESHOLD):
+            target = int((max(0.0, timestamp) + self.start) / self.stream.time_base)
+            self.container.seek(target, stream=self.stream)
+            self._frames = self.container.decode(self.stream)
+            self._position = None
+
+        for frame in self._frames:
+            if frame.time is None:
+                continue
+            self._position = frame.time - self.start
+            if self._position >= timestamp - 1e-3:
+                return frame
+
+        # End of stream
+        self._frames = None
+        return None
+
+    def close(self) -> None:
+        self.container.close()
+
+
+class VideoSource:
+    """
+    A video opened once for the whole run
+
+    Frames are decoded in-process with PyAV; open decoders are pooled and reused
+    across calls so container headers are parsed once per decoder, and forward
+    requests inside VIDEO_SEEK_THRESHOLD keep decoding instead of seeking.
+    Audio comes from the decoded-once PCM cache. Without PyAV, frames fall back
+    to the FFmpeg helpers in utils.
+    """
+
+    def __init__(self, video_path: str):
+        self.video_path = video_path
+        self._idle: List[_Decoder] = []
+        self._decoders: List[_Decoder] = []
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> Optional[float]:
+        """Duration in seconds (cached probe)"""
+        return utils.get_video_duration(self.video_path)
+
+    @property
+    def crop(self) -> Optional[List[int]]:
+        """Picture area [width, height, x, y] applied to every frame (cached probe), or None"""
+        return utils.get_video_crop(self.video_path)
+
+    def _crop_frame(self, frame, crop: List[int]):
+        """PIL image of the picture area of a decoded frame"""
+        width, height, x, y = crop
+        return frame.to_image().crop((x, y, x + width, y + height))
+
+    def _acquire(self) -> _Decoder:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        decoder = _Decoder(self.video_path)
+        with self._lock:
+            self._decoders.append(decoder)
+        return decoder
+
+    def _release(self, decoder: _Decoder) -> None:
+        with self._lock:
+            self._idle.append(decoder)
+
+    def _decode_at(self, timestamps: List[float], convert) -> List:
+        """Decode the frame at each timestamp and map it through convert, in parallel chunks"""
+        results = [None] * len(timestamps)
+        order = sorted(range(len(timestamps)), key=lambda i: timestamps[i])
+
+        def run_chunk(chunk: List[int]) -> None:
+            decoder = None
+            try:
+                decoder = self._acquire()
+                for i in chunk:
+                    frame = decoder.frame_at(timestamps[i])
+                    results[i] = convert(frame) if frame is not None else None
+            except (av.FFmpegError, IndexError, ValueError) as e:
+                print(f"❌ Error decoding frames from {self.video_path}: {e}")
+            finally:
+                if decoder is not None:
+                    self._release(decoder)
+
+        # Contiguous runs of sorted timestamps, one per worker, so each decoder moves forward
+        workers = max(1, min(config.EXTRACTION_WORKERS, len(order)))
+        size = -(-len(order) // workers) if order else 1
+        chunks = [order[k:k + size] for k in range(0, len(order), size)]
+        utils.run_parallel([lambda chunk=chunk: run_chunk(chunk) for chunk in chunks])
+        return results
+
+    def frames_at(self, timestamps: List[float], size: int = config.HASH_FRAME_SIZE,
+                  color: bool = False) -> List[Optional[np.ndarray]]:
+        """
+        Downscaled frames, gray or RGB, at several timestamps
+
+        Args:
+            timestamps: Times in seconds (any order)
+            size: Width and height of each frame
+            color: Return RGB frames instead of gray ones
+
+        Returns:
+            List with a (size, size) uint8 array ((size, size, 3) with color, or None if failed) per timestamp
+        """
+        crop = self.crop
+        if av is None:
+            return utils.extract_small_frames(self.video_path, timestamps, size, crop, color)
+
+        # The same crop / scale / format steps as the FFmpeg fallback, so both backends give the same pixels
+        steps = utils.shrink_filter(size, crop, color)
+        return self._decode_at(timestamps, lambda frame: _filter_frame(frame, steps))
+
+    def frames_at_rate(self, fps: float, size: int = config.HASH_FRAME_SIZE) -> Optional[np.ndarray]:
+        """
+        Every frame at a fixed rate over the whole video, as small gray frames
+
+        A single linear decode, so it runs in one FFmpeg process for both
+        backends (frame k is at k / fps seconds).
+
+        Returns:
+            (N, size, size) uint8 array, or None if failed
+        """
+        return utils.extract_gray_frames_at_rate(self.video_path, fps, size, self.crop)
+
+    def screenshots_at(self, timestamps: List[float], output_paths: List[str]) -> List[bool]:
+        """
+        Save full-resolution frames at several timestamps
+
+        Returns:
+            List of success flags, one per timestamp
+        """
+        crop = self.crop
+        if av is None:
+            return utils.extract_screenshots(self.video_path, timestamps, output_paths, crop)
+
+        def save(frame, path):
+            (self._crop_frame(frame, crop) if crop else frame.to_image()).save(path)
+            return True
+
+        saved = self._decode_at(timestamps, lambda frame: frame)
+        return [save(frame, path) if frame is not None else False for frame, path in zip(saved, output_paths)]
+
+    def audio(self, start_time: float, duration: float, sr: Optional[int] = None) -> Optional[np.ndarray]:
+        """
+        Float32 mono audio for (start, duration), sliced from the decoded-once cache
+
+        Args:
+            start_time: Start time in seconds
+            duration: Duration in seconds
+            sr: Sample rate (defaults to config.AUDIO_SAMPLE_RATE)
+
+        Returns:
+            Audio samples, or None if unavailable
+        """
+        return audio_cache.get_audio_cache(self.video_path).segment_float(start_time, duration, sr=sr)
+
+    def write_audio(self, start_time: float, duration: float, output_path: str) -> bool:
+        """Write an audio clip as WAV (see audio_cache.extract_audio_clip), reusing a cached copy if one exists"""
+        params = {"start": start_time, "duration": duration, "sr": config.AUDIO_SAMPLE_RATE}
+        return artifact_cache.cached_file("clip", [self.video_path], params, output_path, lambda path: (
+            audio_cache.extract_audio_clip(self.video_path, start_time, duration, path)
+        ))
+
+    def close(self) -> None:
+        """Close every open decoder"""
+        with self._lock:
+            for decoder in self._decoders:
+                decoder.close()
+            self._decoders = []
+            self._idle = []
+
+
+def open_video(video_path: str) -> VideoSource:
+    """Return the shared VideoSource for a video, opening it on first use"""
+    key = os.path.abspath(video_path)
+    with _sources_lock:
+        if key not in _sources:
+            _sources[key] = VideoSource(video_path)
+        return _sources[key]
+
+
+def close_video(video_path: str) -> None:
+    """Close and forget the shared VideoSource for a video (if open)"""
+    with _sources_lock:
+        source = _sources.pop(os.path.abspath(video_path), None)
+    if source is not None:
+        source.close()